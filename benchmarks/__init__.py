@@ -0,0 +1,7 @@
+"""
+Package: benchmarks
+Performance benchmarks for the customer service
+
+Every benchmark is a module that can be run with python -m, saves its
+results as JSON and can compare them against a stored baseline.
+"""
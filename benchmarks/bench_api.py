@@ -0,0 +1,476 @@
+"""
+End-to-end HTTP Benchmark
+
+Seeds a database with a configurable number of customers (see
+benchmarks/seed.py), then drives every route of the customer API and
+reports the throughput and p50/p95/p99 latency of each one, either in
+process through the Flask test client or over HTTP against a real gunicorn
+server, or both.
+
+Examples:
+    python -m benchmarks.bench_api --customers 10k
+    python -m benchmarks.bench_api --customers 100k --mode gunicorn --workers 4 --concurrency 16
+    python -m benchmarks.bench_api --output results.json --baseline baseline.json
+
+The database is a SQLite file in the temporary directory unless --database
+(or the DATABASE_URI environment variable) names another one, for example a
+local Postgres. The exit status is 1 when --baseline is given and any route
+regressed by more than --threshold.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.common import (
+    compare, default_database_uri, load_results, parse_count, report_regressions, save_results, summarize
+)
+from benchmarks.seed import CITIES, FIRST_NAMES, LAST_NAMES, seed_database
+
+# a route to benchmark: request(workload, i) returns the path and JSON body
+# of the i-th request and record(workload, document) keeps what it created
+Scenario = namedtuple("Scenario", ["name", "method", "request", "expected", "record", "max_requests"])
+Scenario.__new__.__defaults__ = (None, None)
+
+
+######################################################################
+#  W O R K L O A D
+######################################################################
+class Workload():
+    """ The seeded ids that requests are made for and the ids they create """
+
+    def __init__(self, customers, addresses, seed):
+        """
+        Args:
+            customers (list): sample of (id, first_name, last_name, userid) rows
+            addresses (list): sample of (customer_id, address_id) rows
+            seed (int): seed for the choice of ids
+        """
+        self.customers = customers
+        self.addresses = addresses
+        self.rng = random.Random(seed)
+        self.tag = "{:x}".format(int(time.time() * 1000))
+        self._lock = threading.Lock()
+        self.created_customers = []
+        self.created_addresses = []
+        self.customer_address_ids = {}
+
+    def customer(self):
+        """ Returns a random seeded customer row """
+        with self._lock:
+            return self.rng.choice(self.customers)
+
+    def customer_ids(self, count):
+        """ Returns the ids of count random seeded customers """
+        with self._lock:
+            return [row[0] for row in self.rng.sample(self.customers, min(count, len(self.customers)))]
+
+    def address(self):
+        """ Returns a random seeded (customer_id, address_id) row """
+        with self._lock:
+            return self.rng.choice(self.addresses)
+
+    def created_customer(self, i):
+        """ Returns the id of a customer made by the create_customer scenario """
+        with self._lock:
+            return self.created_customers[i % len(self.created_customers)]
+
+    def created_address(self, i):
+        """ Returns a (customer_id, address_id) made by the create_address scenario """
+        with self._lock:
+            return self.created_addresses[i % len(self.created_addresses)]
+
+    def address_ids(self, customer_id):
+        """ Returns the ids of the addresses a created customer was made with """
+        with self._lock:
+            return self.customer_address_ids[customer_id]
+
+    def record_customer(self, document):
+        """ Remembers a customer made by the benchmark """
+        with self._lock:
+            self.created_customers.append(document["id"])
+            self.customer_address_ids[document["id"]] = [address["id"] for address in document["addresses"]]
+
+    def record_address(self, document):
+        """ Remembers an address made by the benchmark """
+        with self._lock:
+            self.created_addresses.append((document["customer_id"], document["id"]))
+
+    def new_customer(self, i, addresses=0):
+        """ Returns the document of a new customer with a unique userid """
+        with self._lock:
+            first_name = self.rng.choice(FIRST_NAMES)
+            last_name = self.rng.choice(LAST_NAMES)
+            suffix = self.rng.getrandbits(32)
+        return {
+            "first_name": first_name,
+            "last_name": last_name,
+            "userid": "bench-{}-{}-{:08x}".format(self.tag, i, suffix),
+            "password": "secret",
+            "active": True,
+            "addresses": [self.new_address() for _ in range(addresses)],
+        }
+
+    def new_address(self):
+        """ Returns the document of a new address """
+        with self._lock:
+            city, state = self.rng.choice(CITIES)
+            number = self.rng.randint(1, 9999)
+        return {
+            "street": "{} Main Street".format(number),
+            "city": city,
+            "state": state,
+            "postal_code": "{:05d}".format(number),
+        }
+
+
+def scenarios(batch_size):
+    """ Returns every route of the API in an order where writes find what they need """
+    from service.routes import encode_cursor  # pylint: disable=import-outside-toplevel
+
+    def customer_path(customer_id, suffix=""):
+        return "/customers/{}{}".format(customer_id, suffix)
+
+    return [
+        Scenario("index", "GET", lambda w, i: ("/", None), (200,)),
+        Scenario("list_customers", "GET", lambda w, i: ("/customers", None), (200,)),
+        Scenario(
+            "list_customers_page", "GET",
+            lambda w, i: ("/customers?limit=20&cursor={}".format(encode_cursor(w.customer()[0])), None), (200,),
+        ),
+        Scenario(
+            "find_by_first_name", "GET",
+            lambda w, i: ("/customers?limit=20&first_name={}".format(w.customer()[1]), None), (200,),
+        ),
+        Scenario(
+            "find_by_last_name", "GET",
+            lambda w, i: ("/customers?limit=20&last_name={}".format(w.customer()[2]), None), (200,),
+        ),
+        Scenario("find_by_userid", "GET", lambda w, i: ("/customers?userid={}".format(w.customer()[3]), None), (200,)),
+        Scenario("read_customer", "GET", lambda w, i: (customer_path(w.customer()[0]), None), (200,)),
+        Scenario("list_addresses", "GET", lambda w, i: (customer_path(w.customer()[0], "/addresses"), None), (200,)),
+        Scenario("read_address", "GET", lambda w, i: _read_address(w), (200,)),
+        Scenario(
+            "create_customer", "POST", lambda w, i: ("/customers", w.new_customer(i, 1)), (201,),
+            Workload.record_customer,
+        ),
+        Scenario("update_customer", "PUT", lambda w, i: _update_customer(w, i), (200,)),
+        Scenario("deactivate_customer", "PUT", lambda w, i: (customer_path(w.customer()[0], "/deactivate"), {}), (200,)),
+        Scenario("activate_customer", "PUT", lambda w, i: (customer_path(w.customer()[0], "/activate"), {}), (200,)),
+        Scenario(
+            "create_address", "POST",
+            lambda w, i: (customer_path(w.created_customer(i), "/addresses"), w.new_address()), (201,),
+            Workload.record_address,
+        ),
+        Scenario(
+            "update_address", "PUT",
+            lambda w, i: (customer_path(w.created_address(i)[0], "/addresses/{}".format(w.created_address(i)[1])),
+                          w.new_address()), (200,),
+        ),
+        Scenario(
+            "delete_address", "DELETE",
+            lambda w, i: (customer_path(w.created_address(i)[0], "/addresses/{}".format(w.created_address(i)[1])),
+                          None), (204,),
+        ),
+        Scenario(
+            "batch_create", "POST",
+            lambda w, i: ("/customers/batch", [w.new_customer("{}-{}".format(i, n)) for n in range(batch_size)]),
+            (201,),
+        ),
+        Scenario("bulk_deactivate", "PUT", lambda w, i: ("/customers/deactivate", {"ids": w.customer_ids(10)}), (200,)),
+        Scenario("bulk_activate", "PUT", lambda w, i: ("/customers/activate", {"ids": w.customer_ids(10)}), (200,)),
+        Scenario("delete_customer", "DELETE", lambda w, i: (customer_path(w.created_customer(i)), None), (204,)),
+        Scenario("export", "GET", lambda w, i: ("/customers/export", None), (200,), None, 3),
+        Scenario("cache_stats", "GET", lambda w, i: ("/cache/stats", None), (200,)),
+        Scenario("pool_stats", "GET", lambda w, i: ("/pool/stats", None), (200,)),
+        Scenario("metrics", "GET", lambda w, i: ("/metrics", None), (200,)),
+    ]
+
+
+def _read_address(workload):
+    """ Returns the path of a random seeded address """
+    customer_id, address_id = workload.address()
+    return "/customers/{}/addresses/{}".format(customer_id, address_id), None
+
+
+def _update_customer(workload, i):
+    """
+    Returns the path and document of a PUT that replaces a created customer
+
+    PUT /customers/{id} reconciles the addresses by id and deletes the ones
+    left out, so the document keeps the ids of the customer's addresses and
+    the update rewrites them in place, as a client that edits what it read
+    would, instead of deleting them.
+    """
+    customer_id = workload.created_customer(i)
+    address_ids = workload.address_ids(customer_id)
+    document = workload.new_customer(i, len(address_ids))
+    for address, address_id in zip(document["addresses"], address_ids):
+        address["id"] = address_id
+    return "/customers/{}".format(customer_id), document
+
+
+######################################################################
+#  S E E D I N G
+######################################################################
+def sample_rows(sample_size, seed_value):
+    """ Returns samples of the seeded customer and address rows """
+    # pylint: disable=import-outside-toplevel
+    from service.models import Address, Customer, db
+    with db.engine.connect() as conn:
+        customers = conn.execute(
+            db.select(Customer.id, Customer.first_name, Customer.last_name, Customer.userid)
+            .order_by(Customer.id).limit(sample_size * 10)
+        ).fetchall()
+        addresses = conn.execute(
+            db.select(Address.customer_id, Address.id).order_by(Address.id).limit(sample_size * 10)
+        ).fetchall()
+    rng = random.Random(seed_value)
+    customers = rng.sample([tuple(row) for row in customers], min(sample_size, len(customers)))
+    addresses = rng.sample([tuple(row) for row in addresses], min(sample_size, len(addresses)))
+    return customers, addresses
+
+
+def count_customers():
+    """ Returns the number of seeded customers in the database """
+    from service.models import Customer, db  # pylint: disable=import-outside-toplevel
+    with db.engine.connect() as conn:
+        return conn.execute(
+            db.select(db.func.count(Customer.id)).where(~Customer.userid.like("bench-%"))
+        ).scalar()
+
+
+######################################################################
+#  D R I V E R S
+######################################################################
+class TestClientDriver():
+    """ Sends requests in process through the Flask test client """
+
+    name = "client"
+
+    def __init__(self):
+        from service import app  # pylint: disable=import-outside-toplevel
+        self.client = app.test_client()
+
+    def send(self, method, path, body):
+        """ Sends one request and returns the status code and JSON body """
+        resp = self.client.open(path, method=method, json=body)
+        data = resp.get_data()
+        if resp.is_json and data:
+            return resp.status_code, json.loads(data)
+        return resp.status_code, None
+
+    def close(self):
+        """ Nothing to stop """
+
+
+class GunicornDriver():
+    """ Sends requests over HTTP to a gunicorn server started for the benchmark """
+
+    name = "gunicorn"
+
+    def __init__(self, database_uri, workers, worker_class, threads, log_level, app="service:app"):
+        self.port = _free_port()
+        env = dict(os.environ, DATABASE_URI=database_uri)
+        command = [
+            sys.executable, "-m", "gunicorn",
+            "--bind", "127.0.0.1:{}".format(self.port),
+            "--workers", str(workers),
+            "--worker-class", worker_class,
+            "--threads", str(threads),
+            "--log-level", log_level,
+            app,
+        ]
+        self.process = subprocess.Popen(command, env=env)
+        self._local = threading.local()
+        self._wait_until_ready()
+
+    def send(self, method, path, body):
+        """ Sends one request and returns the status code and JSON body """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        headers = {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            raise
+        if resp.getheader("Content-Type", "").startswith("application/json") and data:
+            return resp.status, json.loads(data)
+        return resp.status, None
+
+    def close(self):
+        """ Stops the gunicorn server """
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+    def _wait_until_ready(self, timeout=60):
+        """ Waits until the server answers requests """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("gunicorn exited with status {}".format(self.process.returncode))
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=1)
+                conn.request("GET", "/")
+                conn.getresponse().read()
+                conn.close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        self.close()
+        raise RuntimeError("gunicorn did not start within {} seconds".format(timeout))
+
+
+def run_scenario(driver, workload, scenario, requests, warmup, concurrency):
+    """ Runs one scenario and returns its statistics """
+    if scenario.max_requests is not None:
+        requests = min(requests, scenario.max_requests)
+        warmup = min(warmup, 1)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def call(i, measure):
+        path, body = scenario.request(workload, i)
+        start = time.perf_counter()
+        try:
+            status, document = driver.send(scenario.method, path, body)
+        except (http.client.HTTPException, OSError):
+            status, document = None, None
+        elapsed = time.perf_counter() - start
+        if status in scenario.expected and scenario.record is not None:
+            scenario.record(workload, document)
+        with lock:
+            if status not in scenario.expected:
+                errors[0] += 1
+            elif measure:
+                latencies.append(elapsed)
+
+    for i in range(warmup):
+        call(i, False)
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(lambda i: call(i, True), range(warmup, warmup + requests)))
+    else:
+        for i in range(warmup, warmup + requests):
+            call(i, True)
+    return summarize(latencies, time.perf_counter() - start, errors[0])
+
+
+def run(driver, workload, args):
+    """ Runs every selected scenario with one driver and returns the results by scenario """
+    results = {}
+    for scenario in scenarios(args.batch_size):
+        if args.routes and scenario.name not in args.routes:
+            continue
+        concurrency = args.concurrency if driver.name == "gunicorn" else 1
+        stats = run_scenario(driver, workload, scenario, args.requests, args.warmup, concurrency)
+        results[scenario.name] = stats
+        print("{:>9} {:<22} {:>9.1f} req/s  p50 {:>8.2f} ms  p95 {:>8.2f} ms  p99 {:>8.2f} ms  errors {}".format(
+            driver.name, scenario.name, stats["throughput_rps"], stats["p50_ms"],
+            stats["p95_ms"], stats["p99_ms"], stats["errors"]))
+    return results
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def _free_port():
+    """ Returns a TCP port that nothing is listening on """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def parse_args(argv=None):
+    """ Parses the command line """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--customers", type=parse_count, default=parse_count("10k"),
+                        help="customers to seed, e.g. 10k, 100k or 1m (default 10k)")
+    parser.add_argument("--max-addresses", type=int, default=5, help="most addresses per customer (default 5)")
+    parser.add_argument("--seed", type=int, default=2022, help="random seed for the data and requests")
+    parser.add_argument("--database", default=None,
+                        help="database URI (default DATABASE_URI or a SQLite file in the temp directory)")
+    parser.add_argument("--reuse", action="store_true",
+                        help="keep the data already in the database if it has the requested number of customers")
+    parser.add_argument("--mode", choices=("client", "gunicorn", "both"), default="both")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per route (default 200)")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per route first (default 20)")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent gunicorn clients (default 8)")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers (default 2)")
+    parser.add_argument("--worker-class", default="sync", help="gunicorn worker class (default sync)")
+    parser.add_argument("--threads", type=int, default=1, help="threads per gunicorn worker (default 1)")
+    parser.add_argument("--batch-size", type=int, default=10, help="customers per POST /customers/batch")
+    parser.add_argument("--routes", nargs="*", help="only benchmark these scenarios")
+    parser.add_argument("--log-level", default="warning", help="log level of the service (default warning)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results with this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="fraction a metric may worsen before it is a regression (default 0.10)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Runs the benchmark from the command line """
+    args = parse_args(argv)
+    database_uri = args.database or default_database_uri()
+    # the service reads its database from the environment when it is imported
+    os.environ["DATABASE_URI"] = database_uri
+    from service.routes import app, init_db  # pylint: disable=import-outside-toplevel
+    app.logger.setLevel(args.log_level.upper())
+    init_db()
+
+    if not (args.reuse and count_customers() == args.customers):
+        print("Seeding {} customers with up to {} addresses each".format(args.customers, args.max_addresses))
+        start = time.perf_counter()
+        from service.models import db  # pylint: disable=import-outside-toplevel
+        seed_database(db.engine, args.customers, args.max_addresses, args.seed)
+        print("Seeded in {:.1f} s".format(time.perf_counter() - start))
+    customers, addresses = sample_rows(10000, args.seed)
+
+    results = {}
+    modes = ("client", "gunicorn") if args.mode == "both" else (args.mode,)
+    for mode in modes:
+        workload = Workload(customers, addresses, args.seed)
+        if mode == "client":
+            driver = TestClientDriver()
+        else:
+            driver = GunicornDriver(database_uri, args.workers, args.worker_class, args.threads, args.log_level)
+        try:
+            results[mode] = run(driver, workload, args)
+        finally:
+            driver.close()
+
+    dataset = {"customers": args.customers, "max_addresses": args.max_addresses, "seed": args.seed}
+    settings = {
+        "requests": args.requests, "warmup": args.warmup, "concurrency": args.concurrency,
+        "workers": args.workers, "worker_class": args.worker_class, "threads": args.threads,
+        "database": database_uri.split(":", 1)[0],
+    }
+    document = save_results(args.output, "api", results, dataset=dataset, settings=settings)
+    if args.baseline:
+        return report_regressions(compare(document["results"], load_results(args.baseline)["results"], args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
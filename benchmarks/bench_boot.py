@@ -0,0 +1,148 @@
+"""
+Boot Time Benchmark
+
+Measures how long a worker takes to start: the time to import the service
+package in a fresh interpreter, the SQL statements that the import sends
+to the database (there must be none, the schema is managed by
+"flask db-upgrade") and, unless --no-gunicorn is given, the time from
+starting gunicorn until it answers its first request.
+
+Examples:
+    python -m benchmarks.bench_boot
+    python -m benchmarks.bench_boot --repeat 20 --budget-ms 1500 --output boot.json
+    python -m benchmarks.bench_boot --baseline boot.json
+
+The exit status is 1 when the median import time is over --budget-ms, when
+the import ran any SQL statement, or when --baseline is given and a time
+regressed by more than --threshold, so the benchmark can gate a build.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from benchmarks.bench_api import GunicornDriver
+from benchmarks.common import (
+    compare, default_database_uri, load_results, percentile, report_regressions, save_results
+)
+
+# imports the service in a fresh interpreter and prints the time and SQL statements it took
+IMPORT_SCRIPT = """
+import json, time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+statements = []
+event.listen(Engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+start = time.perf_counter()
+import service
+print(json.dumps({"seconds": time.perf_counter() - start, "statements": statements}))
+"""
+
+
+def measure_import(database_uri, repeat):
+    """ Imports the service repeat times in new processes, returns the times and statements """
+    env = dict(os.environ, DATABASE_URI=database_uri)
+    times, statements = [], []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT], env=env, check=True, capture_output=True, text=True
+        ).stdout
+        measurement = json.loads(output.strip().splitlines()[-1])
+        times.append(measurement["seconds"])
+        statements.extend(measurement["statements"])
+    return times, statements
+
+
+def measure_gunicorn(database_uri, repeat, workers, worker_class):
+    """ Starts gunicorn repeat times, returns the seconds until it answered a request """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        driver = GunicornDriver(database_uri, workers, worker_class, 1, "warning")
+        times.append(time.perf_counter() - start)
+        driver.close()
+    return times
+
+
+def timings(times):
+    """ Returns the percentiles of a list of seconds in milliseconds """
+    ordered = sorted(times)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+def check_budget(results, budget_ms):
+    """ Returns a message for every way the results break the boot budget """
+    failures = []
+    if results["import"]["statements"]:
+        failures.append("importing the service ran {} SQL statements".format(results["import"]["statements"]))
+    if budget_ms and results["import"]["p50_ms"] > budget_ms:
+        failures.append("importing the service took {} ms, over the budget of {} ms".format(
+            results["import"]["p50_ms"], budget_ms))
+    return failures
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def parse_args(argv=None):
+    """ Parses the command line """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10, help="imports to measure (default 10)")
+    parser.add_argument("--budget-ms", type=float, default=2000,
+                        help="most milliseconds the median import may take, 0 for no budget (default 2000)")
+    parser.add_argument("--no-gunicorn", dest="gunicorn", action="store_false",
+                        help="only measure the import, not gunicorn")
+    parser.add_argument("--gunicorn-repeat", type=int, default=3, help="gunicorn starts to measure (default 3)")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers (default 2)")
+    parser.add_argument("--worker-class", default="sync", help="gunicorn worker class (default sync)")
+    parser.add_argument("--database", default=None,
+                        help="database URI (default DATABASE_URI or a SQLite file in the temp directory)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results with this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="fraction a metric may worsen before it is a regression (default 0.10)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Runs the benchmark from the command line """
+    args = parse_args(argv)
+    database_uri = args.database or default_database_uri()
+
+    times, statements = measure_import(database_uri, args.repeat)
+    results = {"import": dict(timings(times), statements=len(statements))}
+    print("import    p50 {:>8.1f} ms  p95 {:>8.1f} ms  max {:>8.1f} ms  SQL statements {}".format(
+        results["import"]["p50_ms"], results["import"]["p95_ms"], results["import"]["max_ms"], len(statements)))
+    for statement in sorted(set(statements)):
+        print("  " + " ".join(statement.split()))
+
+    if args.gunicorn:
+        # gunicorn serves index.html, which needs no tables, so the database may be empty
+        results["gunicorn"] = timings(measure_gunicorn(database_uri, args.gunicorn_repeat, args.workers,
+                                                       args.worker_class))
+        print("gunicorn  p50 {:>8.1f} ms  p95 {:>8.1f} ms  max {:>8.1f} ms  ({} {} workers)".format(
+            results["gunicorn"]["p50_ms"], results["gunicorn"]["p95_ms"], results["gunicorn"]["max_ms"],
+            args.workers, args.worker_class))
+
+    settings = {"repeat": args.repeat, "budget_ms": args.budget_ms, "workers": args.workers,
+                "worker_class": args.worker_class, "database": database_uri.split(":", 1)[0]}
+    document = save_results(args.output, "boot", results, settings=settings)
+    failures = check_budget(results, args.budget_ms)
+    for failure in failures:
+        print("BUDGET " + failure)
+    status = 1 if failures else 0
+    if args.baseline:
+        status = max(status, report_regressions(
+            compare(document["results"], load_results(args.baseline)["results"], args.threshold)))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+JSON Library Benchmark
+
+Compares the JSON libraries that service/json_provider.py can use. For
+every installed library it measures encoding and decoding GET /customers
+sized documents on their own, and whole GET /customers and POST /customers
+requests through the Flask test client.
+
+Examples:
+    python -m benchmarks.bench_json
+    python -m benchmarks.bench_json --sizes 100 1000 --output results.json
+"""
+import argparse
+import os
+import sys
+import time
+from benchmarks.common import (
+    compare, default_database_uri, load_results, report_regressions, save_results, summarize, time_per_call
+)
+from benchmarks.seed import seed_database
+
+
+def documents(count):
+    """ Returns a GET /customers body of count customers with two addresses each """
+    return [
+        {
+            "id": number,
+            "first_name": "jennifer",
+            "last_name": "patel",
+            "userid": "jennifer.patel.{}".format(number),
+            "password": "5f0c2b7e91aa",
+            "active": number % 10 != 0,
+            "addresses": [
+                {
+                    "id": number * 2 + offset,
+                    "customer_id": number,
+                    "street": "{} Main Street".format(number + offset),
+                    "city": "New York City",
+                    "state": "New York",
+                    "postal_code": "{:05d}".format(number % 99999),
+                }
+                for offset in range(2)
+            ],
+        }
+        for number in range(count)
+    ]
+
+
+def bench_codec(provider, sizes, repeat):
+    """ Returns the encode and decode time of documents of every size """
+    results = {}
+    for size in sizes:
+        document = documents(size)
+        body = provider.dumps(document)
+        encode = time_per_call(lambda: provider.dumps(document), repeat)
+        decode = time_per_call(lambda: provider.loads(body), repeat)
+        results["encode_{}".format(size)] = {"us_per_call": round(encode * 1e6, 2), "bytes": len(body)}
+        results["decode_{}".format(size)] = {"us_per_call": round(decode * 1e6, 2), "bytes": len(body)}
+    return results
+
+
+def bench_requests(client, sizes, requests):
+    """ Returns the latency of list and create requests through the test client """
+    results = {}
+    for size in sizes:
+        url = "/customers?limit={}".format(size)
+        results["get_customers_{}".format(size)] = _time_requests(lambda i: client.get(url), requests, 200)
+    body = documents(1)[0]
+    body.pop("id")
+
+    def create(i):
+        body["userid"] = "bench-json-{}-{}".format(time.time_ns(), i)
+        return client.post("/customers", json=body)
+    results["post_customer"] = _time_requests(create, requests, 201)
+    return results
+
+
+def _time_requests(send, requests, expected):
+    """ Sends requests one at a time and summarizes their latency """
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for i in range(requests):
+        began = time.perf_counter()
+        if send(i).status_code == expected:
+            latencies.append(time.perf_counter() - began)
+        else:
+            errors += 1
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def parse_args(argv=None):
+    """ Parses the command line """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="*", default=[10, 100, 1000],
+                        help="customers per document and page (default 10 100 1000)")
+    parser.add_argument("--repeat", type=int, default=5, help="timeit repeats, the best is kept (default 5)")
+    parser.add_argument("--requests", type=int, default=100, help="requests per route and library (default 100)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results with this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="fraction a metric may worsen before it is a regression (default 0.10)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Runs the benchmark from the command line """
+    args = parse_args(argv)
+    os.environ["DATABASE_URI"] = default_database_uri("customers-bench-json.db")
+    # pylint: disable=import-outside-toplevel
+    from service import app, json_provider
+    from service.models import db
+    from service.routes import init_db
+    app.logger.setLevel("WARNING")
+    init_db()
+    seed_database(db.engine, max(args.sizes), max_addresses=2, seed=2022, workers=1)
+    client = app.test_client()
+
+    libraries = ["json"] + (["orjson"] if json_provider.orjson is not None else [])
+    results = {}
+    for library in libraries:
+        provider = json_provider.use(library)
+        results[library] = bench_codec(provider, args.sizes, args.repeat)
+        results[library].update(bench_requests(client, args.sizes, args.requests))
+        for name, stats in results[library].items():
+            if "us_per_call" in stats:
+                print("{:<7} {:<20} {:>12.2f} us".format(library, name, stats["us_per_call"]))
+            else:
+                print("{:<7} {:<20} {:>12.2f} ms p50 {:>10.2f} ms p95".format(
+                    library, name, stats["p50_ms"], stats["p95_ms"]))
+    json_provider.use(app.config["JSON_LIBRARY"])
+
+    document = save_results(args.output, "json", results, settings={"sizes": args.sizes, "repeat": args.repeat})
+    if args.baseline:
+        return report_regressions(compare(document["results"], load_results(args.baseline)["results"], args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""
+Serialization Microbenchmark
+
+Measures Customer.serialize, Customer.deserialize, Address.serialize and
+Address.deserialize in isolation, plus the flask-restx marshalling that the
+routes used to apply to their output and the compiled serializers from
+service/serializers.py that replaced it, for several payload shapes,
+including invalid payloads that raise DataValidationError.
+
+For every case it reports the time per call (the best of several timeit
+repeats), calls per second, the peak memory a single call allocates and the
+memory that stays allocated per call (the returned value) using tracemalloc.
+
+Examples:
+    python -m benchmarks.bench_serialization
+    python -m benchmarks.bench_serialization --cases customer_serialize --output results.json
+    python -m benchmarks.bench_serialization --baseline baseline.json --threshold 0.05
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+from collections import namedtuple
+from benchmarks.common import (
+    compare, default_database_uri, load_results, report_regressions, save_results, time_per_call
+)
+
+ADDRESS_COUNTS = (0, 5, 50)
+
+# a function to measure: make() returns the function called for every measurement
+Case = namedtuple("Case", ["group", "shape", "make"])
+
+
+######################################################################
+#  P A Y L O A D S
+######################################################################
+def address_document(number):
+    """ Returns a valid Address document """
+    return {
+        "street": "{} Main Street".format(number),
+        "city": "New York City",
+        "state": "New York",
+        "postal_code": "{:05d}".format(number),
+    }
+
+
+def customer_document(addresses):
+    """ Returns a valid Customer document with a number of addresses """
+    return {
+        "first_name": "jennifer",
+        "last_name": "patel",
+        "userid": "jpatel",
+        "password": "secret",
+        "active": True,
+        "addresses": [address_document(number) for number in range(addresses)],
+    }
+
+
+def customer_object(addresses):
+    """ Returns an unsaved Customer with ids, as if it was read from the database """
+    from service.models import Customer  # pylint: disable=import-outside-toplevel
+    customer = Customer().deserialize(customer_document(addresses))
+    customer.id = 42
+    for number, address in enumerate(customer.addresses):
+        address.id = number + 1
+        address.customer_id = customer.id
+    return customer
+
+
+INVALID_CUSTOMERS = {
+    "missing_field": {"first_name": "jennifer", "userid": "jpatel"},
+    "wrong_type": {"first_name": 2022, "last_name": "patel"},
+    "not_a_dict": None,
+    "bad_address": dict(customer_document(1), addresses=[{"street": "1 Main Street"}]),
+}
+
+
+######################################################################
+#  C A S E S
+######################################################################
+def cases():
+    """ Returns every case, grouped by the function it measures """
+    # pylint: disable=import-outside-toplevel
+    from service.models import Address, Customer, DataValidationError
+
+    def serialize_customer(addresses):
+        customer = customer_object(addresses)
+        return customer.serialize
+
+    def deserialize_customer(addresses):
+        document = customer_document(addresses)
+        return lambda: Customer().deserialize(document)
+
+    def deserialize_invalid_customer(document):
+        def call():
+            try:
+                Customer().deserialize(document)
+            except DataValidationError as error:
+                return error
+            raise AssertionError("DataValidationError was not raised")
+        return call
+
+    def serialize_address():
+        return customer_object(1).addresses[0].serialize
+
+    def deserialize_address():
+        document = address_document(1)
+        return lambda: Address().deserialize(document)
+
+    def deserialize_invalid_address():
+        document = {"street": "1 Main Street", "city": "New York City"}
+
+        def call():
+            try:
+                Address().deserialize(document)
+            except DataValidationError as error:
+                return error
+            raise AssertionError("DataValidationError was not raised")
+        return call
+
+    def marshal_customer(addresses):
+        from service.routes import api, customer_model
+        document = customer_object(addresses).serialize()
+        return lambda: api.marshal(document, customer_model)
+
+    def serialize_and_marshal_customer(addresses):
+        from service.routes import api, customer_model
+        customer = customer_object(addresses)
+        return lambda: api.marshal(customer.serialize(), customer_model)
+
+    def compiled_customer(addresses):
+        from service.routes import serialize_customer
+        from service.serializers import dumps
+        customer = customer_object(addresses)
+        return lambda: dumps(serialize_customer(customer))
+
+    all_cases = []
+    for count in ADDRESS_COUNTS:
+        shape = "{}_addresses".format(count)
+        all_cases.append(Case("customer_serialize", shape, lambda count=count: serialize_customer(count)))
+        all_cases.append(Case("customer_deserialize", shape, lambda count=count: deserialize_customer(count)))
+        all_cases.append(Case("customer_marshal", shape, lambda count=count: marshal_customer(count)))
+        all_cases.append(Case(
+            "customer_serialize_and_marshal", shape, lambda count=count: serialize_and_marshal_customer(count)
+        ))
+        all_cases.append(Case("customer_compiled_to_json", shape, lambda count=count: compiled_customer(count)))
+    for shape, document in INVALID_CUSTOMERS.items():
+        all_cases.append(Case(
+            "customer_deserialize_invalid", shape, lambda document=document: deserialize_invalid_customer(document)
+        ))
+    all_cases.append(Case("address_serialize", "valid", serialize_address))
+    all_cases.append(Case("address_deserialize", "valid", deserialize_address))
+    all_cases.append(Case("address_deserialize_invalid", "missing_field", deserialize_invalid_address))
+    return all_cases
+
+
+######################################################################
+#  M E A S U R E M E N T
+######################################################################
+def allocations_per_call(func, calls=1000):
+    """
+    Returns the peak bytes allocated during one call and the bytes still
+    allocated per call afterwards (what each call returns and keeps alive)
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()  # fill any caches before measuring
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        kept = func()
+        _, peak = tracemalloc.get_traced_memory()
+        peak_bytes = peak - current
+        del kept
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+        kept = [func() for _ in range(calls)]
+        retained, _ = tracemalloc.get_traced_memory()
+        retained_bytes = (retained - current) / calls
+        del kept
+    finally:
+        tracemalloc.stop()
+    return peak_bytes, retained_bytes
+
+
+def measure(case, repeat):
+    """ Returns the timing and allocation metrics of one case """
+    func = case.make()
+    seconds = time_per_call(func, repeat)
+    peak_bytes, retained_bytes = allocations_per_call(func)
+    return {
+        "ns_per_call": round(seconds * 1e9, 1),
+        "calls_per_sec": round(1 / seconds, 1),
+        "peak_bytes": peak_bytes,
+        "retained_bytes": round(retained_bytes, 1),
+    }
+
+
+def run(selected, repeat):
+    """ Measures every selected case and returns the results by group and shape """
+    results = {}
+    for case in cases():
+        name = "{}/{}".format(case.group, case.shape)
+        if selected and not any(pattern in name for pattern in selected):
+            continue
+        stats = measure(case, repeat)
+        results.setdefault(case.group, {})[case.shape] = stats
+        print("{:<48} {:>12.1f} ns/call {:>12.1f} calls/s  peak {:>9} B  retained {:>9.1f} B".format(
+            name, stats["ns_per_call"], stats["calls_per_sec"], stats["peak_bytes"], stats["retained_bytes"]))
+    return results
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def parse_args(argv=None):
+    """ Parses the command line """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", nargs="*", help="only run cases whose group/shape contains one of these")
+    parser.add_argument("--repeat", type=int, default=5, help="timeit repeats, the best is kept (default 5)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results with this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="fraction a metric may worsen before it is a regression (default 0.10)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Runs the benchmark from the command line """
+    args = parse_args(argv)
+    # marshalling needs the API models, and importing them starts the service
+    os.environ["DATABASE_URI"] = default_database_uri()
+    import service  # pylint: disable=import-outside-toplevel,unused-import
+    service.app.logger.setLevel("WARNING")
+
+    results = run(args.cases, args.repeat)
+    document = save_results(args.output, "serialization", results, settings={"repeat": args.repeat})
+    if args.baseline:
+        return report_regressions(compare(document["results"], load_results(args.baseline)["results"], args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+Benchmark Utilities
+
+Latency statistics, result files and baseline comparison shared by every
+benchmark.
+
+Results are nested dictionaries whose leaves are dictionaries of metrics.
+The name of a metric says which way is better: names ending in _ms, _us,
+_ns or _bytes are costs, where lower is better, and names ending in _rps
+or _per_sec are rates, where higher is better. Other metrics, such as
+counts, are saved but never compared, and neither is the maximum, which
+a single slow request decides.
+"""
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+
+LOWER_IS_BETTER = ("_ms", "_us", "_ns", "_bytes")
+HIGHER_IS_BETTER = ("_rps", "_per_sec")
+NOT_COMPARED = ("max_ms",)
+
+
+def default_database_uri(name="customers-bench.db"):
+    """ Returns DATABASE_URI or a SQLite file in the temporary directory """
+    return os.getenv("DATABASE_URI") or "sqlite:///{}".format(os.path.join(tempfile.gettempdir(), name))
+
+
+def parse_count(value):
+    """ Parses a count such as 500, 10k or 1m """
+    value = str(value).strip().lower()
+    multiplier = 1
+    if value.endswith("k"):
+        value, multiplier = value[:-1], 1000
+    elif value.endswith("m"):
+        value, multiplier = value[:-1], 1000000
+    return int(float(value) * multiplier)
+
+
+def percentile(ordered, fraction):
+    """ Returns the nearest rank percentile of a sorted list """
+    if not ordered:
+        return 0.0
+    rank = max(math.ceil(fraction * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """
+    Returns the throughput and latency percentiles of a benchmark run
+
+    Args:
+        latencies (list): seconds taken by every request
+        elapsed (float): wall clock seconds for the whole run
+        errors (int): requests that failed
+    """
+    ordered = sorted(latencies)
+    count = len(ordered)
+    return {
+        "count": count,
+        "errors": errors,
+        "throughput_rps": round(count / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(ordered) / count * 1000, 3) if count else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if count else 0.0,
+    }
+
+
+def time_per_call(func, repeat=5):
+    """ Returns the best seconds per call of func over repeat timeit runs """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def environment():
+    """ Describes the machine the benchmark ran on """
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def save_results(path, name, results, **details):
+    """ Writes the results of a benchmark to a JSON file and returns the document """
+    document = {
+        "benchmark": name,
+        "created": datetime.utcnow().isoformat() + "Z",
+        "environment": environment(),
+        "results": results,
+    }
+    document.update(details)
+    if path:
+        with open(path, "w") as output:
+            json.dump(document, output, indent=2, sort_keys=True)
+            output.write("\n")
+    return document
+
+
+def load_results(path):
+    """ Reads a results file written by save_results """
+    with open(path) as source:
+        return json.load(source)
+
+
+def compare(results, baseline, threshold=0.10):
+    """
+    Compares results with a baseline and returns the regressions
+
+    A metric regresses when it is worse than the baseline by more than
+    threshold, as a fraction of the baseline value. Metrics that are missing
+    from either side are skipped.
+
+    Returns:
+        a list of (path, metric, baseline value, new value, change) tuples
+    """
+    regressions = []
+    for path, metrics in _leaves(results):
+        old_metrics = _lookup(baseline, path)
+        if not isinstance(old_metrics, dict):
+            continue
+        for metric, value in metrics.items():
+            if metric in NOT_COMPARED:
+                continue
+            old = old_metrics.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            change = (value - old) / old
+            if metric.endswith(LOWER_IS_BETTER) and change > threshold:
+                regressions.append(("/".join(path), metric, old, value, change))
+            elif metric.endswith(HIGHER_IS_BETTER) and -change > threshold:
+                regressions.append(("/".join(path), metric, old, value, change))
+    return regressions
+
+
+def report_regressions(regressions, stream=sys.stdout):
+    """ Prints the regressions found by compare and returns the exit status """
+    if not regressions:
+        print("No regressions against the baseline", file=stream)
+        return 0
+    for path, metric, old, new, change in regressions:
+        print("REGRESSION {} {}: {} -> {} ({:+.1%})".format(path, metric, old, new, change), file=stream)
+    return 1
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def _leaves(results, path=()):
+    """ Yields the path and metrics of every leaf of a results dictionary """
+    if any(not isinstance(value, dict) for value in results.values()):
+        yield path, results
+        return
+    for key, value in results.items():
+        yield from _leaves(value, path + (key,))
+
+
+def _lookup(results, path):
+    """ Returns the part of a results dictionary at path or None """
+    for key in path:
+        if not isinstance(results, dict) or key not in results:
+            return None
+        results = results[key]
+    return results
@@ -0,0 +1,312 @@
+"""
+Synthetic Data Seeder
+
+Loads millions of realistic customers into the database for capacity
+planning and benchmarks. First and last names follow a Zipf-like
+distribution, so a few names are very common and most are rare, like real
+name data. Userids are unique and every customer has a variable number of
+addresses.
+
+The customers have the same fields as tests/factories.py, but rows are
+generated directly instead of through factory_boy, which builds one ORM
+object at a time and is far too slow for millions of rows.
+
+The data is split into chunks that are generated in parallel worker
+processes. Every chunk has its own random generator derived from --seed and
+the chunk number, so the same arguments always load the same data no matter
+how many workers there are. Rows are loaded with the fastest bulk path of
+the database: COPY on PostgreSQL, where every worker loads its own chunks,
+and executemany elsewhere, where the main process loads the chunks the
+workers generate because SQLite allows only one writer.
+
+Examples:
+    python -m benchmarks.seed --customers 1m
+    python -m benchmarks.seed --customers 100k --append --seed 7 --database postgresql://...
+"""
+import argparse
+import csv
+import io
+import multiprocessing
+import os
+import random
+import sys
+import time
+from itertools import accumulate
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+from benchmarks.common import default_database_uri, parse_count
+
+FIRST_NAMES = [
+    "james", "mary", "robert", "patricia", "john", "jennifer", "michael", "linda", "david", "elizabeth",
+    "william", "barbara", "richard", "susan", "joseph", "jessica", "thomas", "sarah", "charles", "karen",
+    "wei", "priya", "jose", "maria", "mohammed", "fatima", "chen", "ana", "ahmed", "sofia",
+    "daniel", "nancy", "matthew", "lisa", "anthony", "betty", "mark", "sandra", "donald", "ashley",
+    "harsh", "jash", "bohan", "yueteng", "chensong", "aarav", "yuki", "hiroshi", "olga", "ivan",
+]
+LAST_NAMES = [
+    "smith", "johnson", "williams", "brown", "jones", "garcia", "miller", "davis", "rodriguez", "martinez",
+    "hernandez", "lopez", "gonzalez", "wilson", "anderson", "thomas", "taylor", "moore", "jackson", "martin",
+    "lee", "perez", "thompson", "white", "harris", "sanchez", "clark", "ramirez", "lewis", "robinson",
+    "zhang", "wang", "li", "liu", "chen", "patel", "shah", "doshi", "kim", "park",
+    "nguyen", "tran", "rofrano", "mueller", "schmidt", "rossi", "silva", "santos", "ivanov", "tanaka",
+]
+CITIES = [
+    ("New York City", "New York"), ("Los Angeles", "California"), ("Chicago", "Illinois"),
+    ("Houston", "Texas"), ("Phoenix", "Arizona"), ("Philadelphia", "Pennsylvania"),
+    ("San Antonio", "Texas"), ("San Diego", "California"), ("Dallas", "Texas"),
+    ("Jersey City", "New Jersey"), ("Austin", "Texas"), ("Seattle", "Washington"),
+    ("Denver", "Colorado"), ("Boston", "Massachusetts"), ("Buffalo", "New York"),
+]
+STREETS = ["Main", "Oak", "Pine", "Maple", "Cedar", "Elm", "Washington", "Lake", "Hill", "Park"]
+STREET_TYPES = ["Street", "Avenue", "Road", "Boulevard", "Lane"]
+
+# the exponent of the Zipf-like name distribution, 0 would be uniform
+ZIPF_EXPONENT = 1.1
+ACTIVE_RATIO = 0.9
+
+CUSTOMER_COLUMNS = ["id", "first_name", "last_name", "userid", "password", "active", "version"]
+ADDRESS_COLUMNS = ["customer_id", "street", "city", "state", "postal_code"]
+
+
+def zipf_weights(count, exponent=ZIPF_EXPONENT):
+    """ Returns cumulative weights where the k-th item has weight 1 / k**exponent """
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def address_count_weights(max_addresses):
+    """ Returns cumulative weights for 0 to max_addresses addresses, with 1 the most likely """
+    return list(accumulate(0.6 ** abs(count - 1) for count in range(max_addresses + 1)))
+
+
+FIRST_NAME_WEIGHTS = zipf_weights(len(FIRST_NAMES))
+LAST_NAME_WEIGHTS = zipf_weights(len(LAST_NAMES))
+
+
+######################################################################
+#  G E N E R A T I O N
+######################################################################
+def generate_chunk(seed, chunk, first_id, count, max_addresses):
+    """
+    Generates the rows of one chunk of customers
+
+    Args:
+        seed (int): the seed of the whole data set
+        chunk (int): the number of the chunk, which picks its random generator
+        first_id (int): the id of the first customer of the chunk
+        count (int): the number of customers in the chunk
+        max_addresses (int): the most addresses a customer can have
+
+    Returns:
+        a list of customer rows and a list of address rows, as tuples in the
+        order of CUSTOMER_COLUMNS and ADDRESS_COLUMNS
+    """
+    rng = random.Random("{}:{}".format(seed, chunk))
+    first_names = rng.choices(FIRST_NAMES, cum_weights=FIRST_NAME_WEIGHTS, k=count)
+    last_names = rng.choices(LAST_NAMES, cum_weights=LAST_NAME_WEIGHTS, k=count)
+    address_counts = rng.choices(range(max_addresses + 1), cum_weights=address_count_weights(max_addresses), k=count)
+    customers = []
+    addresses = []
+    for number in range(count):
+        customer_id = first_id + number
+        first_name = first_names[number]
+        last_name = last_names[number]
+        customers.append((
+            customer_id,
+            first_name,
+            last_name,
+            # the id makes the userid unique however common the name is
+            "{}.{}.{}".format(first_name, last_name, customer_id),
+            "{:012x}".format(rng.getrandbits(48)),
+            rng.random() < ACTIVE_RATIO,
+            1,
+        ))
+        for _ in range(address_counts[number]):
+            city, state = rng.choice(CITIES)
+            addresses.append((
+                customer_id,
+                "{} {} {}".format(rng.randint(1, 9999), rng.choice(STREETS), rng.choice(STREET_TYPES)),
+                city,
+                state,
+                "{:05d}".format(rng.randint(501, 99950)),
+            ))
+    return customers, addresses
+
+
+def plan_chunks(customers, chunk_size, first_id):
+    """ Returns the (chunk, first_id, count) of every chunk """
+    return [
+        (chunk, first_id + start, min(chunk_size, customers - start))
+        for chunk, start in enumerate(range(0, customers, chunk_size))
+    ]
+
+
+######################################################################
+#  L O A D I N G
+######################################################################
+def copy_rows(dbapi_connection, table, columns, rows):
+    """ Loads rows into a PostgreSQL table with COPY ... FROM STDIN """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    with dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(
+            "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(table, ", ".join(columns)), buffer
+        )
+
+
+def insert_rows(connection, table, columns, rows):
+    """ Loads rows into a table with one executemany """
+    if rows:
+        connection.execute(
+            text("INSERT INTO {} ({}) VALUES ({})".format(
+                table, ", ".join(columns), ", ".join(":" + column for column in columns)
+            )),
+            [dict(zip(columns, row)) for row in rows],
+        )
+
+
+def load_chunk(engine, customers, addresses):
+    """ Loads the rows of one chunk in one transaction """
+    if engine.dialect.name == "postgresql":
+        connection = engine.raw_connection()
+        try:
+            copy_rows(connection, "customer", CUSTOMER_COLUMNS, customers)
+            copy_rows(connection, "address", ADDRESS_COLUMNS, addresses)
+            connection.commit()
+        finally:
+            connection.close()
+    else:
+        with engine.begin() as connection:
+            insert_rows(connection, "customer", CUSTOMER_COLUMNS, customers)
+            insert_rows(connection, "address", ADDRESS_COLUMNS, addresses)
+
+
+# the engine of a worker process that loads its own chunks
+_worker_engine = None
+
+
+def _start_worker(url):
+    global _worker_engine  # pylint: disable=global-statement
+    _worker_engine = create_engine(url, poolclass=NullPool)
+
+
+def _generate_and_load(arguments):
+    customers, addresses = generate_chunk(*arguments)
+    load_chunk(_worker_engine, customers, addresses)
+    return len(customers), len(addresses)
+
+
+def _generate(arguments):
+    return generate_chunk(*arguments)
+
+
+def seed_database(engine, customers, max_addresses=5, seed=2022, chunk_size=10000, workers=None, append=False):
+    """
+    Loads generated customers and addresses into the database
+
+    Args:
+        engine: the SQLAlchemy engine of a database that has the schema
+        customers (int): the number of customers to add
+        max_addresses (int): the most addresses a customer can have
+        seed (int): the same seed always generates the same data
+        chunk_size (int): customers generated and loaded together
+        workers (int): processes that generate chunks, 1 runs everything in
+            this process and None uses one per CPU
+        append (bool): keep the customers already in the database
+
+    Returns:
+        the number of customers and addresses that were added
+    """
+    if not append:
+        truncate(engine)
+    with engine.connect() as connection:
+        first_id = (connection.execute(text("SELECT max(id) FROM customer")).scalar() or 0) + 1
+    chunks = [(seed, chunk, start, count, max_addresses) for chunk, start, count in
+              plan_chunks(customers, chunk_size, first_id)]
+    workers = min(workers or os.cpu_count() or 1, len(chunks)) or 1
+    added_customers = added_addresses = 0
+
+    if workers == 1:
+        for arguments in chunks:
+            rows, address_rows = generate_chunk(*arguments)
+            load_chunk(engine, rows, address_rows)
+            added_customers += len(rows)
+            added_addresses += len(address_rows)
+    elif engine.dialect.name == "postgresql":
+        url = engine.url.render_as_string(hide_password=False)
+        with multiprocessing.Pool(workers, initializer=_start_worker, initargs=(url,)) as pool:
+            for counts in pool.imap_unordered(_generate_and_load, chunks):
+                added_customers += counts[0]
+                added_addresses += counts[1]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            for rows, address_rows in pool.imap_unordered(_generate, chunks):
+                load_chunk(engine, rows, address_rows)
+                added_customers += len(rows)
+                added_addresses += len(address_rows)
+
+    reset_sequences(engine)
+    return added_customers, added_addresses
+
+
+def truncate(engine):
+    """ Removes every customer and address """
+    with engine.begin() as connection:
+        if engine.dialect.name == "postgresql":
+            connection.execute(text("TRUNCATE address, customer RESTART IDENTITY"))
+        else:
+            connection.execute(text("DELETE FROM address"))
+            connection.execute(text("DELETE FROM customer"))
+
+
+def reset_sequences(engine):
+    """ Moves the id sequences past the explicit ids that were loaded """
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as connection:
+        for table in ("customer", "address"):
+            connection.execute(text(
+                "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                "COALESCE((SELECT max(id) FROM {0}), 0) + 1, false)".format(table)
+            ))
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def parse_args(argv=None):
+    """ Parses the command line """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--customers", type=parse_count, default=parse_count("100k"),
+                        help="customers to generate, e.g. 10k, 100k or 1m (default 100k)")
+    parser.add_argument("--max-addresses", type=int, default=5, help="most addresses per customer (default 5)")
+    parser.add_argument("--seed", type=int, default=2022, help="the same seed always loads the same data")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="customers per chunk (default 10000)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default one per CPU)")
+    parser.add_argument("--append", action="store_true", help="keep the customers already in the database")
+    parser.add_argument("--database", default=None,
+                        help="database URI (default DATABASE_URI or a SQLite file in the temp directory)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """ Seeds the database from the command line """
+    args = parse_args(argv)
+    os.environ["DATABASE_URI"] = args.database or default_database_uri()
+    # pylint: disable=import-outside-toplevel
+    from service.models import db
+    from service.routes import init_db
+    init_db()  # create or upgrade the schema
+
+    start = time.perf_counter()
+    customers, addresses = seed_database(
+        db.engine, args.customers, args.max_addresses, args.seed, args.chunk_size, args.workers, args.append
+    )
+    elapsed = time.perf_counter() - start
+    print("Loaded {} customers and {} addresses in {:.1f} s ({:.0f} customers/s)".format(
+        customers, addresses, elapsed, customers / elapsed if elapsed else 0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -19,6 +19,55 @@ if 'VCAP_SERVICES' in os.environ:
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of every worker process (see service/pool.py)
+# DB_POOL_MODE is "internal" for a pool in each worker or "external" when a
+# transaction pooling proxy such as PgBouncer sits in front of the database
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "internal")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "yes", "1")
+
+# Database of the ASGI service (see service/asgi.py), which defaults to
+# DATABASE_URI with the asyncpg or aiosqlite driver
+ASYNC_DATABASE_URI = os.getenv("ASYNC_DATABASE_URI", "")
+
+# Keyset pagination for GET /customers
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Rows fetched per round trip by GET /customers/export
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+# POST /customers/batch limits
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "500"))
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "50000"))
+
+# In-process cache of GET /customers/{id} documents (size 0 disables it)
+CUSTOMER_CACHE_SIZE = int(os.getenv("CUSTOMER_CACHE_SIZE", "10000"))
+CUSTOMER_CACHE_TTL = float(os.getenv("CUSTOMER_CACHE_TTL", "30"))
+
+# JSON library for requests and responses: auto, orjson or json
+# (see service/json_provider.py)
+JSON_LIBRARY = os.getenv("JSON_LIBRARY", "auto")
+
+# Response compression and static files (see service/compression.py)
+COMPRESSION = os.getenv("COMPRESSION", "true").lower() in ("true", "yes", "1")
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "31536000"))
+
+# SQL instrumentation (see service/instrumentation.py)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() in ("true", "yes", "1")
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+
+# Logging through a queue written by a background thread (see service/log_handlers.py)
+LOG_QUEUE = os.getenv("LOG_QUEUE", "true").lower() in ("true", "yes", "1")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "100"))
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
 LOGGING_LEVEL = logging.INFO
\ No newline at end of file
@@ -0,0 +1,197 @@
+"""
+Gunicorn Configuration
+
+Production settings for serving the service with gunicorn, read from the
+environment. gunicorn loads this file by itself when it is started from the
+root of the repository, or explicitly with:
+
+    gunicorn --config gunicorn.conf.py service:app
+
+GUNICORN_WORKER_CLASS: sync (default), gthread or gevent, or the import path
+                       of another worker class such as
+                       uvicorn.workers.UvicornWorker for service.asgi:app
+GUNICORN_WORKERS: worker processes, WEB_CONCURRENCY when it is not set and
+                  otherwise derived from the CPUs of the container
+GUNICORN_THREADS: threads per gthread worker (default 4)
+GUNICORN_WORKER_CONNECTIONS: greenlets per gevent worker (default 1000)
+GUNICORN_TIMEOUT: seconds a worker may spend on one request (default 30)
+GUNICORN_GRACEFUL_TIMEOUT: seconds workers get to finish on restart
+GUNICORN_KEEPALIVE: seconds to hold idle keep-alive connections (default 5)
+GUNICORN_MAX_REQUESTS: restart a worker after this many requests (0 = never)
+GUNICORN_PRELOAD: import the application once in the master (default true)
+PORT: the port to listen on (default 8000)
+
+With preload the application is imported once in the master, which then
+closes any database connections it opened and freezes the
+garbage collector before the workers are forked, so the workers share the
+pages of the imported modules instead of copying them. Every worker still
+drops the pool it inherited, without closing the sockets of the master, so
+no two processes ever talk over the same database connection.
+"""
+import gc
+import glob
+import math
+import multiprocessing
+import os
+import sys
+import tempfile
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def env_int(name, default):
+    """ Returns an integer from the environment """
+    value = os.getenv(name, "")
+    return int(value) if value.strip() else default
+
+
+def env_bool(name, default):
+    """ Returns a flag from the environment """
+    value = os.getenv(name, "")
+    return value.lower() in ("true", "yes", "1") if value.strip() else default
+
+
+def cgroup_cpu_quota(root=CGROUP_ROOT):
+    """ Returns the CPUs a cgroup v2 or v1 quota allows, or None without a quota """
+    try:
+        with open(os.path.join(root, "cpu.max")) as cpu_max:
+            quota, period = cpu_max.read().split()[:2]
+        if quota == "max":
+            return None
+        return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(os.path.join(root, "cpu", "cpu.cfs_quota_us")) as quota_file:
+            quota = int(quota_file.read())
+        with open(os.path.join(root, "cpu", "cpu.cfs_period_us")) as period_file:
+            period = int(period_file.read())
+    except (OSError, ValueError):
+        return None
+    return quota / period if quota > 0 and period > 0 else None
+
+
+def cpu_count(root=CGROUP_ROOT):
+    """ Returns the CPUs this process may use: its affinity, capped by the container quota """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover
+        cpus = multiprocessing.cpu_count()
+    quota = cgroup_cpu_quota(root)
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return max(1, cpus)
+
+
+def default_workers(worker_class, cpus):
+    """
+    Returns the worker processes for a worker class on cpus CPUs
+
+    Sync workers serve one request at a time, so there are two per CPU to
+    keep the CPUs busy while requests wait on the database. Threaded and
+    asynchronous workers overlap that waiting themselves and need about one
+    per CPU.
+    """
+    if worker_class == "sync":
+        return 2 * cpus + 1
+    return cpus + 1
+
+
+def clear_multiproc_dir(path):
+    """ Removes the metric files a previous run left in the Prometheus directory """
+    for filename in glob.glob(os.path.join(path, "*.db")):
+        os.remove(filename)
+
+
+######################################################################
+#  S E T T I N G S
+######################################################################
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+workers = env_int("GUNICORN_WORKERS", env_int("WEB_CONCURRENCY", default_workers(worker_class, cpu_count())))
+threads = env_int("GUNICORN_THREADS", 4 if worker_class == "gthread" else 1)
+worker_connections = env_int("GUNICORN_WORKER_CONNECTIONS", 1000)
+
+bind = "0.0.0.0:{}".format(os.getenv("PORT", "8000"))
+timeout = env_int("GUNICORN_TIMEOUT", 30)
+graceful_timeout = env_int("GUNICORN_GRACEFUL_TIMEOUT", timeout)
+keepalive = env_int("GUNICORN_KEEPALIVE", 5)
+max_requests = env_int("GUNICORN_MAX_REQUESTS", 0)
+max_requests_jitter = env_int("GUNICORN_MAX_REQUESTS_JITTER", max_requests // 10)
+preload_app = env_bool("GUNICORN_PRELOAD", True)
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+# the worker heartbeat files live in memory instead of on a disk that may block
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+if worker_class == "gevent":
+    # patch before the application imports socket, ssl and threading
+    from gevent import monkey
+    monkey.patch_all()
+
+# every thread of a worker may hold a connection at the same time
+if threads > 5:
+    os.environ.setdefault("DB_POOL_SIZE", str(threads))
+
+# several workers must share their Prometheus samples (see service/metrics.py)
+if workers > 1 and not (os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.getenv("prometheus_multiproc_dir")):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="customers-metrics-")
+elif os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    clear_multiproc_dir(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+if preload_app:
+    # objects freed while importing would leave holes in shared pages
+    gc.disable()
+
+
+######################################################################
+#  S E R V E R   H O O K S
+######################################################################
+def when_ready(server):
+    """ Releases the database and freezes the heap of the master before the first fork """
+    if "service.models" in sys.modules:
+        from service import app
+        from service.models import db
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+        server.log.info("Closed the database connections of the master")
+    gc.collect()
+    gc.freeze()
+    gc.enable()
+    server.log.info(
+        "Starting %d %s workers with %d threads, %d objects shared",
+        server.cfg.workers, server.cfg.worker_class_str, server.cfg.threads, gc.get_freeze_count(),
+    )
+
+
+def post_fork(server, worker):
+    """ Gives a new worker its own database connections """
+    gc.enable()
+    if server.cfg.worker_class_str == "gevent":
+        try:
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+        except ImportError:
+            server.log.warning("psycogreen is not installed: database calls block every greenlet of a worker")
+    if "service.models" in sys.modules:
+        from service import app
+        from service.models import db
+        from service.pool import dispose_after_fork
+        with app.app_context():
+            dispose_after_fork(db.engine)
+
+
+def worker_exit(server, worker):
+    """ Writes out the log records a worker still has queued """
+    if "service.log_handlers" in sys.modules:
+        from service.log_handlers import stop_logging
+        stop_logging()
+
+
+def child_exit(server, worker):
+    """ Drops the live metrics of a worker that exited """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.getenv("prometheus_multiproc_dir"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -5,7 +5,6 @@ This module creates and configures the Flask app and sets up the logging
 and SQL database
 """
 import os
-import sys
 import logging
 from flask import Flask
 
@@ -16,33 +15,26 @@ app.url_map.strict_slashes = False
 app.config.from_object("config")
 
 # Import the routes After the Flask app is created
-from service import routes, models, error_handlers
+from service import (
+    routes, models, migrations, error_handlers, instrumentation, metrics, json_provider, compression, log_handlers
+)
+
+# workers do no database work when they start: "flask db-upgrade" makes the tables
+models.Customer.init_app(app)
+migrations.init_migrations(app)
+json_provider.init_json(app)
+instrumentation.init_instrumentation(app)
+metrics.init_metrics(app)
+compression.init_compression(app)
 
 # Set up logging for production
 if __name__ != "__main__":
-    gunicorn_logger = logging.getLogger("gunicorn.error")
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
-    app.logger.propagate = False
-    # Make all log formats consistent
-    formatter = logging.Formatter(
-        "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z"
-    )
-    for handler in app.logger.handlers:
-        handler.setFormatter(formatter)
-    app.logger.info("Logging handler established")
+    log_handlers.init_logging(app, "gunicorn.error")
 
 app.logger.info(70 * "*")
 app.logger.info("  M Y   S E R V I C E   R U N N I N G  ".center(70, "*"))
 app.logger.info(70 * "*")
 
-try:
-    routes.init_db()  # make our sqlalchemy tables
-except Exception as error:
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
-
 app.logger.info("Service initialized!")
 
 
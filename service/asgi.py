@@ -0,0 +1,605 @@
+"""
+ASGI Customer Service
+
+Serves the customer and address routes of service/routes.py, with the same
+paths and JSON documents, as an ASGI application for running under an
+ASGI server instead of gunicorn sync workers:
+
+    uvicorn service.asgi:app --host 0.0.0.0 --port 8000 --workers 4
+    gunicorn --worker-class uvicorn.workers.UvicornWorker service.asgi:app
+
+Requests await the database through an async SQLAlchemy engine (asyncpg for
+PostgreSQL, aiosqlite for SQLite), so while one request waits on the
+database the process goes on with the others and a single worker can hold
+hundreds of requests in flight. ASYNC_DATABASE_URI names the database; it
+defaults to DATABASE_URI with the async driver of the same database. The
+pool is sized by the same DB_POOL_* settings as the WSGI service.
+
+The tables are created or upgraded by "flask db-upgrade", as for the WSGI
+service; workers never change the schema when they start. The Swagger docs, the UI, /metrics and
+the cache and pool statistics are only served by the WSGI service.
+
+Paths:
+------
+GET /customers - Returns a list all of all Customers (paginated with limit and cursor)
+GET /customers/export - Streams all Customers as newline-delimited JSON
+PUT /customers/activate - activates all Customers matching ids or a filter
+PUT /customers/deactivate - deactivates all Customers matching ids or a filter
+GET /customers/{id} - Returns the Customer with a given id number
+POST /customers - creates a new Customer record in the database
+POST /customers/batch - creates many Customer records in the database
+PUT /customers/{id} - updates a Customer record in the database
+DELETE /customers/{id} - deletes a Customer record in the database
+DELETE /customers?ids=1,2,3 - deletes many Customer records in the database
+PUT /customers/{id}/activate - activates a Customer
+PUT /customers/{id}/deactivate - deactivates a Customer
+GET /customers/{id}/addresses - Returns the Addresses of a Customer
+POST /customers/{id}/addresses - adds an Address to a Customer
+GET /customers/{id}/addresses/{address_id} - Returns an Address
+PUT /customers/{id}/addresses/{address_id} - updates an Address
+DELETE /customers/{id}/addresses/{address_id} - deletes an Address
+"""
+import logging
+from urllib.parse import urlencode
+from flask_restx import inputs, marshal
+from sqlalchemy import event, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, selectinload, sessionmaker
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.pool import NullPool
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.exceptions import NotFound
+from werkzeug.http import parse_etags, quote_etag
+from service import app as wsgi_app, json_provider, status
+from service.cache import LRUCache
+from service.models import Address, Customer, DataValidationError, UseridConflictError, bump_customer_versions
+from service.pool import enable_foreign_keys, engine_options
+from service.routes import (
+    batch_result_model,
+    bulk_criteria,
+    cache_key,
+    customer_etag,
+    decode_cursor,
+    encode_cursor,
+    parse_ids,
+    prefers_minimal,
+    serialize_address,
+    serialize_customer,
+)
+
+logger = logging.getLogger("flask.app")
+
+JSON_MIMETYPE = "application/json"
+
+# (version, Customer JSON bytes) tuples keyed by id, like the WSGI service
+customer_cache = LRUCache(wsgi_app.config["CUSTOMER_CACHE_SIZE"], wsgi_app.config["CUSTOMER_CACHE_TTL"])
+
+
+class VersionedSession(Session):
+    """ The session behind every AsyncSession, which bumps Customer versions like db.session """
+
+
+event.listen(VersionedSession, "before_flush", bump_customer_versions)
+
+
+######################################################################
+#  D A T A B A S E
+######################################################################
+def async_database_uri(uri):
+    """ Returns a database URI that uses the asyncio driver of its database """
+    scheme, separator, rest = uri.partition("://")
+    backend = scheme.split("+", 1)[0]
+    if backend in ("postgres", "postgresql"):
+        return "postgresql+asyncpg" + separator + rest
+    if backend == "sqlite":
+        return "sqlite+aiosqlite" + separator + rest
+    return uri
+
+
+def async_engine_options(config, uri):
+    """ Returns the async engine options for the database and pool described by config """
+    options = engine_options(config, uri)
+    # asyncio drivers need the async adapted QueuePool that is their default
+    if options.get("poolclass") is not NullPool:
+        options.pop("poolclass", None)
+    elif make_url(uri).get_driver_name() == "asyncpg":
+        # behind PgBouncer in transaction mode the next transaction may run on
+        # another server connection, where the prepared statements do not exist
+        options["connect_args"] = {"statement_cache_size": 0, "prepared_statement_cache_size": 0}
+    return options
+
+
+def make_engine(config):
+    """ Returns the async engine for the database and pool described by config """
+    uri = config.get("ASYNC_DATABASE_URI") or async_database_uri(config["SQLALCHEMY_DATABASE_URI"])
+    engine = create_async_engine(uri, **async_engine_options(config, uri))
+    enable_foreign_keys(engine.sync_engine)
+    return engine
+
+
+async def startup():
+    """ Opens the async engine when the server starts """
+    app.state.engine = make_engine(wsgi_app.config)
+    app.state.session = sessionmaker(
+        app.state.engine, class_=AsyncSession, sync_session_class=VersionedSession, expire_on_commit=False
+    )
+    logger.info("ASGI service connected to %s", app.state.engine.url.get_backend_name())
+
+
+async def shutdown():
+    """ Closes every pooled connection when the server stops """
+    await app.state.engine.dispose()
+
+
+async def commit(session):
+    """
+    Commits the session, turning a duplicate userid into a UseridConflictError
+    and a Customer that another request changed first into a 412
+    """
+    try:
+        await session.commit()
+    except IntegrityError as error:
+        await session.rollback()
+        raise UseridConflictError("Userid already exists!") from error
+    except StaleDataError as error:
+        await session.rollback()
+        raise HTTPException(status.HTTP_412_PRECONDITION_FAILED, "Customer was changed by another request") from error
+
+
+def customer_query():
+    """ Returns a Customer query that loads the addresses with one more SELECT """
+    return select(Customer).options(selectinload(Customer.addresses))
+
+
+async def find_customer(session, customer_id):
+    """ Returns the Customer with its addresses, or None if not found """
+    key = cache_key(customer_id)
+    if not isinstance(key, int):
+        return None
+    return await session.get(Customer, key, options=[selectinload(Customer.addresses)])
+
+
+async def find_customer_or_404(session, customer_id):
+    """ Returns the Customer with its addresses or aborts with 404 """
+    customer = await find_customer(session, customer_id)
+    if customer is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Customer with id '{}' was not found.".format(customer_id))
+    return customer
+
+
+async def find_address(session, address_id):
+    """ Returns an Address, or None if not found """
+    key = cache_key(address_id)
+    if not isinstance(key, int):
+        return None
+    return await session.get(Address, key)
+
+
+######################################################################
+#  PATH: /customers/{id}
+######################################################################
+async def get_customer(request):
+    """ Retrieve a single Customer """
+    customer_id = request.path_params["customer_id"]
+    logger.info("Request for customer with id: %s", customer_id)
+    cached = customer_cache.get(cache_key(customer_id))
+    customer = None
+    if cached is not None:
+        version, body = cached
+    else:
+        async with request.app.state.session() as session:
+            customer = await find_customer_or_404(session, customer_id)
+        version, body = customer.version, None
+
+    # decide on 304 before the Customer and its addresses are serialized
+    etag = customer_etag(customer_id, version)
+    if parse_etags(request.headers.get("if-none-match")).contains_weak(etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": quote_etag(etag)})
+    if body is None:
+        body = json_provider.dumps(serialize_customer(customer))
+        customer_cache.set(cache_key(customer_id), (version, body))
+    return json_response(body, status.HTTP_200_OK, {"ETag": quote_etag(etag)})
+
+
+async def update_customer(request):
+    """ Update a Customer from the body that is posted """
+    customer_id = request.path_params["customer_id"]
+    logger.info("Request to update customer with id: %s", customer_id)
+    data = await payload(request)
+    async with request.app.state.session() as session:
+        customer = await find_customer_or_404(session, customer_id)
+        check_if_match(request, customer_id, customer.version)
+        customer.deserialize(data)
+        await commit(session)
+    customer_cache.invalidate(cache_key(customer_id))
+    etag = customer_etag(customer_id, customer.version)
+    return json_response(serialize_customer(customer), status.HTTP_200_OK, {"ETag": quote_etag(etag)})
+
+
+async def delete_customer(request):
+    """ Delete a Customer and its Addresses """
+    customer_id = request.path_params["customer_id"]
+    logger.info("Request to delete customer with id: %s", customer_id)
+    key = cache_key(customer_id)
+    if isinstance(key, int):
+        async with request.app.state.session() as session:
+            await session.run_sync(lambda sync_session: Customer.delete_by_ids([key], sync_session))
+    customer_cache.invalidate(key)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+######################################################################
+#  PATH: /customers
+######################################################################
+async def list_customers(request):
+    """ Returns all of the Customers, or one page of them """
+    args = {name: request.query_params.get(name) for name in ("first_name", "last_name", "userid", "cursor")}
+    limit = request.query_params.get("limit")
+    if limit is not None:
+        try:
+            limit = inputs.positive(limit, "limit")
+        except ValueError as error:
+            return json_response({
+                "errors": {"limit": "Maximum number of Customers per page {}".format(error)},
+                "message": "Input payload validation failed",
+            }, status.HTTP_400_BAD_REQUEST)
+    paginate = limit is not None or args["cursor"] is not None
+    query = customer_query()
+    for name in ("first_name", "last_name", "userid"):
+        if args[name]:
+            logger.info("Filtering by %s: %s", name, args[name])
+            query = query.where(*Customer.filter_criteria(**{name: args[name]}))
+            break
+
+    headers = {}
+    async with request.app.state.session() as session:
+        if paginate:
+            limit = min(limit or wsgi_app.config["DEFAULT_PAGE_SIZE"], wsgi_app.config["MAX_PAGE_SIZE"])
+            after_id = decode_cursor(args["cursor"])
+            if after_id is not None:
+                query = query.where(Customer.id > after_id)
+            # fetch one extra row so we know whether there is a next page
+            customers = (await session.execute(query.order_by(Customer.id).limit(limit + 1))).scalars().all()
+            if len(customers) > limit:
+                customers = customers[:limit]
+                headers["Link"] = next_page_link(request, args, limit, customers[-1].id)
+        else:
+            customers = (await session.execute(query)).scalars().all()
+    return json_response([serialize_customer(customer) for customer in customers], status.HTTP_200_OK, headers)
+
+
+async def create_customer(request):
+    """ Creates a Customer from the body that is posted """
+    logger.info("Request to create a customer")
+    customer = Customer(addresses=[]).deserialize(await payload(request))
+    customer.id = None
+    if customer.active is None:  # default active when created
+        customer.active = True
+    async with request.app.state.session() as session:
+        session.add(customer)
+        await commit(session)
+    logger.info("Customer with ID [%s] created.", customer.id)
+    location_url = request.url_for("customer", customer_id=customer.id)
+    return json_response(serialize_customer(customer), status.HTTP_201_CREATED, {"Location": location_url})
+
+
+async def delete_customers(request):
+    """ Deletes every Customer in the ids query argument with its addresses """
+    logger.info("Request to delete many customers")
+    ids = parse_ids(request.query_params.getlist("ids"))
+    if len(ids) > wsgi_app.config["MAX_BATCH_SIZE"]:
+        raise HTTPException(
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            "A request can delete at most {} Customers.".format(wsgi_app.config["MAX_BATCH_SIZE"]),
+        )
+    async with request.app.state.session() as session:
+        count = await session.run_sync(lambda sync_session: Customer.delete_by_ids(ids, sync_session))
+    for customer_id in ids:
+        customer_cache.invalidate(customer_id)
+    logger.info("Deleted %s customers", count)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+######################################################################
+#  PATH: /customers/batch
+######################################################################
+async def create_customers_batch(request):
+    """ Creates every Customer in the posted array and reports on each one """
+    logger.info("Request to create a batch of customers")
+    documents = await payload(request)
+    if not isinstance(documents, list):
+        raise DataValidationError("Invalid batch: body of request must be an array of Customers")
+    if len(documents) > wsgi_app.config["MAX_BATCH_SIZE"]:
+        raise HTTPException(
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            "A batch can hold at most {} Customers.".format(wsgi_app.config["MAX_BATCH_SIZE"]),
+        )
+    try:
+        chunk_size = int(request.query_params.get("chunk_size", wsgi_app.config["BATCH_CHUNK_SIZE"]))
+    except ValueError:
+        chunk_size = 0
+    if chunk_size < 1:
+        raise DataValidationError("Invalid chunk_size: must be a positive integer")
+
+    async with request.app.state.session() as session:
+        outcomes = await session.run_sync(
+            lambda sync_session: Customer.create_batch(documents, chunk_size, sync_session)
+        )
+    results = []
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, DataValidationError):
+            code = status.HTTP_409_CONFLICT if isinstance(outcome, UseridConflictError) \
+                else status.HTTP_400_BAD_REQUEST
+            results.append({"index": index, "status": code, "error": str(outcome)})
+        else:
+            location_url = request.url_for("customer", customer_id=outcome)
+            results.append({"index": index, "status": status.HTTP_201_CREATED, "id": outcome, "location": location_url})
+    created = sum(1 for result in results if result["status"] == status.HTTP_201_CREATED)
+    logger.info("Created %s of %s customers in batch", created, len(results))
+    code = status.HTTP_201_CREATED if created == len(results) else status.HTTP_207_MULTI_STATUS
+    return json_response(marshal(results, batch_result_model), code)
+
+
+######################################################################
+#  PATH: /customers/activate and /customers/deactivate
+######################################################################
+async def activate_customers(request):
+    """ Activates every Customer matching the ids or filter in the body """
+    return await bulk_set_active(request, True)
+
+
+async def deactivate_customers(request):
+    """ Deactivates every Customer matching the ids or filter in the body """
+    return await bulk_set_active(request, False)
+
+
+async def bulk_set_active(request, active):
+    """ Sets the active flag of the Customers selected by a bulk request body """
+    data = await payload(request)
+    criteria, ids = bulk_criteria(data)
+    async with request.app.state.session() as session:
+        count, changed_ids = await session.run_sync(
+            lambda sync_session: Customer.set_active_where(criteria, active, bool(data.get("return_ids")), sync_session)
+        )
+    if ids is not None:
+        for customer_id in ids:
+            customer_cache.invalidate(customer_id)
+    else:
+        customer_cache.clear()
+    logger.info("Set active to %s on %s customers", active, count)
+    return json_response({"count": count, "ids": changed_ids}, status.HTTP_200_OK)
+
+
+######################################################################
+#  PATH: /customers/export
+######################################################################
+async def export_customers(request):
+    """ Streams every Customer with its addresses as newline-delimited JSON """
+    logger.info("Request to export all customers")
+    chunk_size = wsgi_app.config["EXPORT_CHUNK_SIZE"]
+
+    async def generate():
+        # keyset pages, so no transaction or cursor stays open between chunks
+        async with request.app.state.session() as session:
+            last_id = None
+            while True:
+                query = customer_query().order_by(Customer.id).limit(chunk_size)
+                if last_id is not None:
+                    query = query.where(Customer.id > last_id)
+                customers = (await session.execute(query)).scalars().all()
+                for customer in customers:
+                    yield json_provider.dumps(serialize_customer(customer)) + b"\n"
+                if len(customers) < chunk_size:
+                    break
+                last_id = customers[-1].id
+                session.expunge_all()  # keep memory flat across chunks
+                await session.commit()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+######################################################################
+#  PATH: /customers/{id}/activate and /customers/{id}/deactivate
+######################################################################
+async def activate_customer(request):
+    """ Activate an existing Customer """
+    return await set_active(request, True)
+
+
+async def deactivate_customer(request):
+    """ Deactivate an existing Customer """
+    return await set_active(request, False)
+
+
+async def set_active(request, active):
+    """ Sets the active flag of one Customer with a single UPDATE, like the WSGI service """
+    customer_id = request.path_params["customer_id"]
+    logger.info("Request to set active to %s on customer with id: %s", active, customer_id)
+    key = cache_key(customer_id)
+    async with request.app.state.session() as session:
+        row = None
+        if isinstance(key, int):
+            row = await session.run_sync(lambda sync_session: Customer.set_active(key, active, sync_session))
+        if row is None:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, "Customer with id '{}' was not found.".format(customer_id))
+        customer_cache.invalidate(key)
+        headers = {"ETag": quote_etag(customer_etag(key, row.version))}
+        if prefers_minimal(request.headers.get("prefer")):
+            headers["Preference-Applied"] = "return=minimal"
+            return json_response({"id": row.id, "active": row.active}, status.HTTP_200_OK, headers)
+        customer = await find_customer_or_404(session, customer_id)
+    return json_response(serialize_customer(customer), status.HTTP_200_OK, headers)
+
+
+######################################################################
+#  PATH: /customers/{customer_id}/addresses/{address_id}
+######################################################################
+async def get_address(request):
+    """ Retrieve a single Address """
+    async with request.app.state.session() as session:
+        await find_customer_or_404(session, request.path_params["customer_id"])
+        address = await find_address(session, request.path_params["address_id"])
+        if address is None:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, NotFound.description)
+    return json_response(serialize_address(address), status.HTTP_200_OK)
+
+
+async def update_address(request):
+    """ Update an Address from the body that is posted """
+    customer_id = request.path_params["customer_id"]
+    data = await payload(request)
+    async with request.app.state.session() as session:
+        customer = await find_customer_or_404(session, customer_id)
+        check_if_match(request, customer_id, customer.version)
+        address = await find_address(session, request.path_params["address_id"])
+        if address is None:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, NotFound.description)
+        address.deserialize(data)
+        await commit(session)
+    invalidate_addresses_of(customer_id, address)
+    return json_response(serialize_address(address), status.HTTP_200_OK)
+
+
+async def delete_address(request):
+    """ Delete an Address """
+    customer_id = request.path_params["customer_id"]
+    async with request.app.state.session() as session:
+        await find_customer_or_404(session, customer_id)
+        address = await find_address(session, request.path_params["address_id"])
+        if address is not None:
+            await session.delete(address)
+            await commit(session)
+    invalidate_addresses_of(customer_id, address)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+######################################################################
+#  PATH: /customers/{customer_id}/addresses
+######################################################################
+async def list_addresses(request):
+    """ Returns all of the Addresses for a Customer """
+    customer_id = request.path_params["customer_id"]
+    async with request.app.state.session() as session:
+        customer = await find_customer_or_404(session, customer_id)
+    etag = customer_etag(customer_id, customer.version)
+    if parse_etags(request.headers.get("if-none-match")).contains_weak(etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": quote_etag(etag)})
+    results = [serialize_address(address) for address in customer.addresses]
+    return json_response(results, status.HTTP_200_OK, {"ETag": quote_etag(etag)})
+
+
+async def create_address(request):
+    """ Adds an Address to a Customer """
+    customer_id = request.path_params["customer_id"]
+    address = Address().deserialize(await payload(request))
+    async with request.app.state.session() as session:
+        customer = await find_customer_or_404(session, customer_id)
+        customer.addresses.append(address)
+        await commit(session)
+    customer_cache.invalidate(cache_key(customer_id))
+    return json_response(serialize_address(address), status.HTTP_201_CREATED)
+
+
+######################################################################
+#  E R R O R   H A N D L E R S
+######################################################################
+async def request_validation_error(request, error):
+    """ Handles Value Errors from bad data """
+    logger.warning(str(error))
+    return json_response(
+        {"status": status.HTTP_400_BAD_REQUEST, "error": "Bad Request", "message": str(error)},
+        status.HTTP_400_BAD_REQUEST,
+    )
+
+
+async def http_error(request, error):
+    """ Handles aborted requests the way flask-restx does """
+    return json_response({"message": error.detail}, error.status_code)
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+async def payload(request):
+    """ Returns the decoded JSON body of a request, or None if it has none """
+    body = await request.body()
+    if not body:
+        return None
+    try:
+        return json_provider.loads(body)
+    except ValueError as error:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Failed to decode JSON object: {}".format(error)) from error
+
+
+def json_response(body, code, headers=None):
+    """ Returns a response whose body is a document or already encoded JSON bytes """
+    if not isinstance(body, bytes):
+        body = json_provider.dumps(body)
+    return Response(body, status_code=code, headers=headers, media_type=JSON_MIMETYPE)
+
+
+def check_if_match(request, customer_id, version):
+    """ Aborts with 412 when the If-Match header names another version of a Customer, like the WSGI service """
+    if_match = parse_etags(request.headers.get("if-match"))
+    if if_match and not if_match.contains_weak(customer_etag(customer_id, version)):
+        raise HTTPException(
+            status.HTTP_412_PRECONDITION_FAILED,
+            "Customer with id '{}' has changed since the ETag in If-Match.".format(customer_id),
+        )
+
+
+def invalidate_addresses_of(customer_id, address):
+    """ Drops the cached Customer whose addresses have changed """
+    customer_cache.invalidate(cache_key(customer_id))
+    if address is not None and address.customer_id is not None:
+        customer_cache.invalidate(address.customer_id)
+
+
+def next_page_link(request, args, limit, last_id):
+    """ Builds the Link header that points to the next page of Customers """
+    params = {name: args[name] for name in ("first_name", "last_name", "userid") if args[name]}
+    params.update(limit=limit, cursor=encode_cursor(last_id))
+    return '<{}?{}>; rel="next"'.format(request.url_for("customers"), urlencode(sorted(params.items())))
+
+
+def middleware(config):
+    """ Returns the middleware for the configured response compression """
+    if not config["COMPRESSION"]:
+        return []
+    return [Middleware(
+        GZipMiddleware, minimum_size=config["COMPRESSION_MIN_SIZE"], compresslevel=config["COMPRESSION_GZIP_LEVEL"]
+    )]
+
+
+app = Starlette(
+    routes=[
+        Route("/customers", list_customers, methods=["GET"], name="customers"),
+        Route("/customers", create_customer, methods=["POST"]),
+        Route("/customers", delete_customers, methods=["DELETE"]),
+        Route("/customers/batch", create_customers_batch, methods=["POST"]),
+        Route("/customers/activate", activate_customers, methods=["PUT"]),
+        Route("/customers/deactivate", deactivate_customers, methods=["PUT"]),
+        Route("/customers/export", export_customers, methods=["GET"]),
+        Route("/customers/{customer_id}", get_customer, methods=["GET"], name="customer"),
+        Route("/customers/{customer_id}", update_customer, methods=["PUT"]),
+        Route("/customers/{customer_id}", delete_customer, methods=["DELETE"]),
+        Route("/customers/{customer_id}/activate", activate_customer, methods=["PUT"]),
+        Route("/customers/{customer_id}/deactivate", deactivate_customer, methods=["PUT"]),
+        Route("/customers/{customer_id}/addresses", list_addresses, methods=["GET"]),
+        Route("/customers/{customer_id}/addresses", create_address, methods=["POST"]),
+        Route("/customers/{customer_id}/addresses/{address_id}", get_address, methods=["GET"]),
+        Route("/customers/{customer_id}/addresses/{address_id}", update_address, methods=["PUT"]),
+        Route("/customers/{customer_id}/addresses/{address_id}", delete_address, methods=["DELETE"]),
+    ],
+    middleware=middleware(wsgi_app.config),
+    exception_handlers={DataValidationError: request_validation_error, HTTPException: http_error},
+    on_startup=[startup],
+    on_shutdown=[shutdown],
+)
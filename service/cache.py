@@ -0,0 +1,90 @@
+"""
+Read-through Cache
+
+A size bounded, thread safe LRU cache whose entries also expire after a
+time to live. It is used to keep serialized Customer documents in memory
+so repeated reads of the same Customer do not go to the database.
+
+The cache lives inside each worker process, so a write handled by one
+worker only invalidates that worker's copy. The TTL bounds how long
+another worker can keep serving the old document.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache():
+    """ Least recently used cache with a time to live for every entry """
+
+    def __init__(self, max_size=1024, ttl=60.0, clock=time.monotonic):
+        """
+        Args:
+            max_size (int): the most entries to keep, 0 disables the cache
+            ttl (float): seconds an entry stays valid after it is set
+            clock (callable): returns the current time in seconds
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """ Returns the value cached for key or None if it is missing or expired """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """ Caches value under key, evicting the least recently used entries if full """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, self._clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """ Removes the entry for key if there is one """
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        """ Removes every entry """
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        """ Returns the counters and current size of the cache """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+            }
@@ -0,0 +1,283 @@
+"""
+Response Compression
+
+Compresses responses with gzip, or with brotli when the Brotli package is
+installed, if the client accepts it and the body is at least
+COMPRESSION_MIN_SIZE bytes of JSON, text, JavaScript or SVG:
+
+COMPRESSION: false turns compression of responses off
+COMPRESSION_MIN_SIZE: smaller bodies are sent as they are
+COMPRESSION_GZIP_LEVEL: gzip level from 1 (fastest) to 9 (smallest)
+COMPRESSION_BROTLI_QUALITY: brotli quality from 0 (fastest) to 11 (smallest)
+
+A compressed response gets a weak ETag, because its bytes differ from the
+document the strong ETag describes; If-None-Match still matches it.
+
+The files in service/static are read when the service starts and served
+from memory. Each one is compressed with the highest gzip level and
+brotli quality the first time a client asks for that coding, so a worker
+boots without compressing anything. Each file also gets a URL with a hash of its content in the name,
+such as static/css/cerulean_bootstrap.min.3f2a9c0e1b7d.css, which is served
+with a Cache-Control max-age of STATIC_MAX_AGE seconds (a year by default)
+because its content can never change. index.html is served with its links
+rewritten to these URLs. Run "flask compress-static" when building the
+application to write the .gz and .br files next to the static files, so
+workers load them instead of compressing the files on first use.
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+from collections import namedtuple
+from flask import current_app, request
+from werkzeug.exceptions import NotFound
+from werkzeug.wrappers import Response
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+logger = logging.getLogger("flask.app")
+
+COMPRESSIBLE_MIMETYPES = frozenset((
+    "application/json",
+    "application/javascript",
+    "image/svg+xml",
+))
+# file extensions of the compressed copies written by "flask compress-static"
+EXTENSIONS = {"br": ".br", "gzip": ".gz"}
+
+# a static file: its hashed name, mimetype, ETag, the content codings it may
+# be compressed with and its bodies by content coding (None is the
+# uncompressed body), to which compressed bodies are added on first use
+StaticAsset = namedtuple("StaticAsset", ["filename", "hashed_name", "mimetype", "etag", "encodings", "bodies"])
+
+# links to static files in index.html, such as href="static/css/site.css"
+_STATIC_LINK = re.compile(r'((?:href|src)\s*=\s*")static/([^"?#]+)(")')
+
+
+def init_compression(app):
+    """ Compresses responses and serves the static files from memory """
+    app.after_request(compress_response)
+    app.extensions["static_assets"] = StaticAssets.load(
+        app.static_folder, app.config["COMPRESSION_MIN_SIZE"]
+    )
+    app.view_functions["static"] = send_static_asset
+    logger.info("Loaded %d static files", len(app.extensions["static_assets"].assets))
+    app.cli.command("compress-static")(compress_static_command)
+
+
+def available_encodings():
+    """ Returns the content codings the service can produce, best first """
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(data, encoding, level):
+    """ Returns data compressed with a content coding at a level or quality """
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compressible(mimetype):
+    """ Returns True for mimetypes whose bodies compress well """
+    return mimetype is not None and (mimetype.startswith("text/") or mimetype in COMPRESSIBLE_MIMETYPES)
+
+
+def negotiate(encodings):
+    """ Returns the content coding of encodings the client accepts best, or None """
+    return request.accept_encodings.best_match(encodings)
+
+
+######################################################################
+#  R E S P O N S E   C O M P R E S S I O N
+######################################################################
+def compress_response(response):
+    """ Compresses the body of a response when the client accepts it """
+    config = current_app.config
+    if (
+        not config["COMPRESSION"]
+        or response.direct_passthrough
+        or request.endpoint == "static"
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or "Content-Encoding" in response.headers
+        or not compressible(response.mimetype)
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    if response.content_length is not None and response.content_length < config["COMPRESSION_MIN_SIZE"]:
+        return response
+    encoding = negotiate(available_encodings())
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if len(data) < config["COMPRESSION_MIN_SIZE"]:
+        return response
+    level = config["COMPRESSION_BROTLI_QUALITY"] if encoding == "br" else config["COMPRESSION_GZIP_LEVEL"]
+    response.set_data(compress(data, encoding, level))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+######################################################################
+#  S T A T I C   F I L E S
+######################################################################
+class StaticAssets():
+    """ The static files of the service, kept in memory and compressed on first use """
+
+    def __init__(self, assets):
+        self.assets = assets
+        self.by_hashed_name = {asset.hashed_name: asset for asset in assets.values()}
+
+    @classmethod
+    def load(cls, folder, min_size=0):
+        """ Reads every file in folder and its precompressed copies """
+        assets = {filename: _load_asset(folder, filename, min_size) for filename in _static_files(folder)}
+        if "index.html" in assets:
+            assets["index.html"] = _rewrite_index(folder, assets, min_size)
+        return cls(assets)
+
+    def url_for(self, filename):
+        """ Returns the content hashed name of a static file """
+        return self.assets[filename].hashed_name
+
+    def response(self, filename):
+        """ Returns the response for a static file by its name or hashed name """
+        asset = self.by_hashed_name.get(filename)
+        immutable = asset is not None
+        if asset is None:
+            asset = self.assets.get(filename)
+        if asset is None:
+            raise NotFound()
+
+        encoding = negotiate(asset.encodings) if asset.encodings else None
+        body = asset.bodies[None] if encoding is None else _compressed_body(asset, encoding)
+        if body is None:
+            encoding, body = None, asset.bodies[None]
+        response = Response(body, mimetype=asset.mimetype)
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        if asset.encodings:
+            response.vary.add("Accept-Encoding")
+        # every coding of the file is a different representation
+        response.set_etag(asset.etag if encoding is None else "{}-{}".format(asset.etag, encoding))
+        if immutable:
+            response.cache_control.public = True
+            response.cache_control.max_age = current_app.config["STATIC_MAX_AGE"]
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+
+def send_static_asset(filename):
+    """ Serves a static file from memory (replaces the static view of Flask) """
+    return current_app.extensions["static_assets"].response(filename)
+
+
+def send_index():
+    """ Serves index.html with its links rewritten to the hashed static files """
+    return current_app.extensions["static_assets"].response("index.html")
+
+
+def write_precompressed(folder, min_size=0):
+    """ Writes the .gz and .br copy of every compressible file in folder, returns their paths """
+    written = []
+    for filename in _static_files(folder):
+        path = os.path.join(folder, filename)
+        mimetype = mimetypes.guess_type(filename)[0]
+        if not compressible(mimetype) or os.path.getsize(path) < min_size:
+            continue
+        with open(path, "rb") as static_file:
+            data = static_file.read()
+        for encoding in available_encodings():
+            with open(path + EXTENSIONS[encoding], "wb") as compressed_file:
+                compressed_file.write(compress(data, encoding, _max_level(encoding)))
+            written.append(path + EXTENSIONS[encoding])
+    return written
+
+
+def compress_static_command():
+    """ Precompresses the static files with gzip and brotli """
+    paths = write_precompressed(current_app.static_folder, current_app.config["COMPRESSION_MIN_SIZE"])
+    print("Wrote {} precompressed static files".format(len(paths)))
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def _static_files(folder):
+    """ Returns the names of the static files in folder, relative to it, with / separators """
+    if not folder or not os.path.isdir(folder):
+        return []
+    filenames = []
+    for directory, _, names in os.walk(folder):
+        for name in names:
+            if os.path.splitext(name)[1] in EXTENSIONS.values():
+                continue
+            path = os.path.relpath(os.path.join(directory, name), folder)
+            filenames.append(path.replace(os.sep, "/"))
+    return sorted(filenames)
+
+
+def _load_asset(folder, filename, min_size):
+    """ Reads a static file and the compressed copies that are not stale """
+    path = os.path.join(folder, filename)
+    with open(path, "rb") as static_file:
+        data = static_file.read()
+    precompressed = {}
+    for encoding, extension in EXTENSIONS.items():
+        if os.path.exists(path + extension) and os.path.getmtime(path + extension) >= os.path.getmtime(path):
+            with open(path + extension, "rb") as compressed_file:
+                precompressed[encoding] = compressed_file.read()
+    return _make_asset(filename, data, mimetypes.guess_type(filename)[0], precompressed, min_size)
+
+
+def _rewrite_index(folder, assets, min_size):
+    """ Returns the StaticAsset of index.html with its links replaced by the hashed names """
+    with open(os.path.join(folder, "index.html"), "rb") as index_file:
+        html = index_file.read().decode("utf-8")
+
+    def replace(match):
+        filename = match.group(2)
+        if filename not in assets:
+            return match.group(0)
+        return "{}static/{}{}".format(match.group(1), assets[filename].hashed_name, match.group(3))
+    return _make_asset("index.html", _STATIC_LINK.sub(replace, html).encode("utf-8"), "text/html", {}, min_size)
+
+
+def _make_asset(filename, data, mimetype, precompressed, min_size):
+    """ Returns a StaticAsset with the precompressed bodies, leaving the others to _compressed_body """
+    encodings = available_encodings() if compressible(mimetype) and len(data) >= min_size else ()
+    bodies = {None: data}
+    bodies.update((encoding, body) for encoding, body in precompressed.items() if encoding in encodings)
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    root, extension = os.path.splitext(filename)
+    return StaticAsset(
+        filename, "{}.{}{}".format(root, digest, extension), mimetype or "application/octet-stream", digest,
+        encodings, bodies,
+    )
+
+
+def _compressed_body(asset, encoding):
+    """ Returns the body of a static file in a content coding, or None when that does not make it smaller """
+    body = asset.bodies.get(encoding)
+    if body is None:
+        # two threads may both compress the file once, which is harmless
+        body = compress(asset.bodies[None], encoding, _max_level(encoding))
+        asset.bodies[encoding] = body
+    return body if len(body) < len(asset.bodies[None]) else None
+
+
+def _max_level(encoding):
+    """ Returns the level or quality that compresses best """
+    return 11 if encoding == "br" else 9
@@ -0,0 +1,127 @@
+"""
+SQL Instrumentation
+
+Counts the SQL statements each request executes and the time spent in the
+database, using SQLAlchemy engine events, so a slow request can be traced
+back to the queries behind it.
+
+SERVER_TIMING: when true every response carries a Server-Timing header with
+               the statement count and database time, which browser
+               developer tools and most load testing tools display
+SLOW_QUERY_THRESHOLD_MS: statements that take at least this long are logged
+                         to the "flask.app.slow_query" logger as one JSON
+                         object with the normalized SQL and the route that
+                         ran it (0 turns the slow query log off)
+
+Bound parameters are never logged, because they can hold passwords.
+"""
+import json
+import logging
+import re
+import time
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+slow_query_logger = logging.getLogger("flask.app.slow_query")
+
+# literals and driver placeholders are replaced with ? so the same query
+# always normalizes to the same text
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|(?<!:):\w+|\$\d+")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def init_instrumentation(app):
+    """ Starts counting the SQL statements of every request """
+    app.before_request(_start_request)
+    app.after_request(_add_server_timing)
+
+
+def normalize_sql(statement):
+    """ Returns statement on one line with its literals and parameters replaced by ? """
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _PLACEHOLDER.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    statement = _PLACEHOLDER_LIST.sub("(?, ...)", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def route_name():
+    """ Returns the route template of the current request or None outside a request """
+    if not has_request_context():
+        return None
+    if request.url_rule is None:
+        return "<unmatched>"
+    # the API is mounted with prefix "/", which doubles the leading slash
+    return "/" + request.url_rule.rule.lstrip("/")
+
+
+def statement_count():
+    """ Returns the number of SQL statements the current request has executed """
+    return g.get("sql_statements", 0) if has_request_context() else 0
+
+
+def db_time():
+    """ Returns the seconds the current request has spent executing SQL """
+    return g.get("sql_seconds", 0.0) if has_request_context() else 0.0
+
+
+######################################################################
+#  R E Q U E S T   H O O K S
+######################################################################
+def _start_request():
+    g.sql_statements = 0
+    g.sql_seconds = 0.0
+    g.request_start = time.perf_counter()
+
+
+def _add_server_timing(response):
+    if not current_app.config.get("SERVER_TIMING") or "request_start" not in g:
+        return response
+    total = time.perf_counter() - g.request_start
+    response.headers.add(
+        "Server-Timing",
+        'db;dur={:.2f};desc="{} statements", app;dur={:.2f}'.format(
+            db_time() * 1000, statement_count(), total * 1000
+        ),
+    )
+    return response
+
+
+######################################################################
+#  E N G I N E   E V E N T S
+######################################################################
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop("query_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    if has_request_context() and "sql_statements" in g:
+        g.sql_statements += 1
+        g.sql_seconds += elapsed
+    if has_app_context():
+        threshold = current_app.config.get("SLOW_QUERY_THRESHOLD_MS", 0)
+        if threshold > 0 and elapsed * 1000 >= threshold:
+            _log_slow_query(statement, elapsed, executemany)
+
+
+def _log_slow_query(statement, elapsed, executemany):
+    """ Writes one slow statement to the slow query log """
+    record = {
+        "event": "slow_query",
+        "duration_ms": round(elapsed * 1000, 3),
+        "statement": normalize_sql(statement),
+        "executemany": executemany,
+        "route": route_name(),
+        "method": request.method if has_request_context() else None,
+    }
+    slow_query_logger.warning(json.dumps(record), extra={"slow_query": record})
@@ -0,0 +1,165 @@
+"""
+JSON Provider
+
+Encodes responses and decodes request bodies with the JSON library named
+by the JSON_LIBRARY setting:
+
+auto:   orjson when it is installed, otherwise the json module (default)
+orjson: orjson, falling back to the json module with a warning when it is
+        not installed
+json:   the json module of the standard library
+
+Flask 2.0 has no JSON provider interface, so init_json() plugs the library
+into the places Flask and flask-restx encode and decode JSON: the request
+class behind request.get_json() and api.payload, the encoder behind
+jsonify(), and the flask-restx representation of application/json. The
+compiled serializers in service/serializers.py call dumps() directly.
+
+orjson makes the same documents as the json module, except that it writes
+non-ASCII characters as UTF-8 instead of \\u escapes. Values orjson cannot
+encode, such as integers over 64 bits, are handed to the json module.
+"""
+import json
+import logging
+from flask import current_app, make_response
+from flask.json import JSONEncoder
+from flask.wrappers import Request
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+logger = logging.getLogger("flask.app")
+
+JSON_LIBRARIES = ("auto", "orjson", "json")
+
+
+class StdlibJSON():
+    """ JSON with the json module of the standard library """
+
+    name = "json"
+
+    def __init__(self):
+        self._default = JSONEncoder().default
+
+    def dumps(self, obj, sort_keys=False):
+        """ Encodes obj as compact JSON bytes """
+        return json.dumps(obj, separators=(",", ":"), sort_keys=sort_keys, default=self._default).encode("utf-8")
+
+    def loads(self, data):
+        """ Decodes JSON from bytes or a string """
+        return json.loads(data)
+
+
+class OrjsonJSON(StdlibJSON):
+    """ JSON with orjson """
+
+    name = "orjson"
+
+    def dumps(self, obj, sort_keys=False):
+        """ Encodes obj as compact JSON bytes """
+        # let Flask format datetimes so the documents match the json module
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=self._default, option=option)
+        except orjson.JSONEncodeError:
+            return super().dumps(obj, sort_keys)
+
+    def loads(self, data):
+        """ Decodes JSON from bytes or a string """
+        return orjson.loads(data)
+
+
+# the library in use, chosen by init_json()
+provider = OrjsonJSON() if orjson is not None else StdlibJSON()
+
+
+def select(library):
+    """ Returns the JSON provider for a JSON_LIBRARY setting """
+    if library not in JSON_LIBRARIES:
+        raise ValueError("JSON_LIBRARY must be one of {}, not {!r}".format(JSON_LIBRARIES, library))
+    if library == "json":
+        return StdlibJSON()
+    if orjson is None:
+        if library == "orjson":
+            logger.warning("JSON_LIBRARY is orjson but it is not installed, using json instead")
+        return StdlibJSON()
+    return OrjsonJSON()
+
+
+def use(library):
+    """ Switches to the JSON library named by library and returns its provider """
+    global provider  # pylint: disable=global-statement
+    provider = select(library)
+    return provider
+
+
+def dumps(obj):
+    """ Encodes obj as compact JSON bytes with the configured library """
+    return provider.dumps(obj)
+
+
+def loads(data):
+    """ Decodes JSON with the configured library """
+    return provider.loads(data)
+
+
+def init_json(app):
+    """ Makes the app encode and decode JSON with the configured library """
+    use(app.config.get("JSON_LIBRARY", "auto"))
+    app.request_class = ProviderRequest
+    app.json_encoder = ProviderJSONEncoder
+    logger.info("Using the %s library for JSON", provider.name)
+
+
+def output_json(data, code, headers=None):
+    """ Makes a flask-restx response with a JSON encoded body """
+    settings = current_app.config.get("RESTX_JSON", {})
+    if settings or current_app.debug:
+        # indented or customized output is left to the json module
+        settings = dict(settings)
+        if current_app.debug:
+            settings.setdefault("indent", 4)
+        body = json.dumps(data, **settings) + "\n"
+    else:
+        body = provider.dumps(data) + b"\n"
+    resp = make_response(body, code)
+    resp.headers.extend(headers or {})
+    return resp
+
+
+######################################################################
+#  F L A S K   I N T E G R A T I O N
+######################################################################
+class _ProviderModule():
+    """ The loads and dumps that werkzeug looks up on Request.json_module """
+
+    @staticmethod
+    def loads(data, **kwargs):
+        if kwargs:
+            return json.loads(data, **kwargs)
+        return provider.loads(data)
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        if kwargs:
+            return json.dumps(obj, **kwargs)
+        return provider.dumps(obj).decode("utf-8")
+
+
+class ProviderRequest(Request):
+    """ A request whose JSON body is decoded with the configured library """
+
+    json_module = _ProviderModule
+
+
+class ProviderJSONEncoder(JSONEncoder):
+    """ The encoder behind jsonify() """
+
+    def encode(self, o):
+        if self.indent is not None:
+            return super().encode(o)
+        return provider.dumps(o, sort_keys=self.sort_keys).decode("utf-8")
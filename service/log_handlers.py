@@ -0,0 +1,238 @@
+"""
+Queue-based Logging
+
+Takes log output off the request path. The records of the application
+logger, and of the "flask.app" logger that the service modules and the
+slow query log write to, are put on a bounded in-memory queue, and a
+background thread formats them and writes them to the real handlers
+(those of gunicorn when the service runs under gunicorn) in batches, with
+one write and one flush per handler for each batch of stream output:
+
+LOG_QUEUE: false writes every record synchronously, as handlers usually do
+LOG_QUEUE_SIZE: records that can wait on the queue before new ones are dropped
+LOG_BATCH_SIZE: most records written at once
+
+A request never waits for the log: when the queue is full the record is
+dropped and counted, and the listener reports how many were dropped. The
+message is interpolated with its arguments, and an exception formatted,
+before the record is queued, so the listener never touches objects that
+belong to a request. The listener is restarted in every forked worker and
+writes out the queue when the process exits, or when gunicorn calls
+stop_logging() as the worker exits.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler
+
+LOG_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s"
+LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+# the loggers of the service modules, besides the app logger ("flask.app.slow_query" propagates to it)
+SERVICE_LOGGERS = ("flask.app",)
+
+# the listener that writes the queued records of this process
+_listener = None
+
+
+def init_logging(app, logger_name):
+    """
+    Sends the records of the app logger, and of the loggers of the service
+    modules, to the handlers of another logger
+    """
+    logger = logging.getLogger(logger_name)
+    formatter = logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT)
+    for handler in logger.handlers:
+        handler.setFormatter(formatter)
+    if app.config["LOG_QUEUE"] and logger.handlers:
+        handlers = [start_logging(logger.handlers, app.config["LOG_QUEUE_SIZE"], app.config["LOG_BATCH_SIZE"])]
+    else:
+        handlers = logger.handlers
+    targets = [app.logger]
+    # without handlers to send them to, the module loggers keep propagating to the root logger
+    if logger.handlers:
+        targets.extend(logging.getLogger(name) for name in SERVICE_LOGGERS if name != app.logger.name)
+    for target in targets:
+        target.setLevel(logger.level)
+        target.propagate = False
+        target.handlers = list(handlers)
+    app.logger.info("Logging handler established")
+
+
+def start_logging(handlers, queue_size=10000, batch_size=100):
+    """ Starts the listener of this process and returns the handler that queues records for it """
+    global _listener  # pylint: disable=global-statement
+    stop_logging()
+    _listener = BatchingQueueListener(handlers, queue_size, batch_size)
+    _listener.start()
+    return BoundedQueueHandler(_listener)
+
+
+def stop_logging(timeout=5.0):
+    """ Writes the records still on the queue and stops the listener """
+    if _listener is not None:
+        _listener.stop(timeout)
+
+
+def log_stats():
+    """ Returns the counters of the listener, or None when records are not queued """
+    return _listener.stats() if _listener is not None else None
+
+
+######################################################################
+#  Q U E U E   H A N D L E R
+######################################################################
+class BoundedQueueHandler(QueueHandler):
+    """ Puts records on the queue of a listener, dropping them when it is full """
+
+    def __init__(self, listener):
+        super().__init__(listener.queue)
+        self.listener = listener
+
+    def prepare(self, record):
+        """ Makes the record independent of the request, but leaves formatting to the listener """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        """ Queues a record without waiting """
+        try:
+            self.listener.queue.put_nowait(record)
+        except queue.Full:
+            self.listener.count_drop()
+
+
+######################################################################
+#  B A T C H I N G   L I S T E N E R
+######################################################################
+class BatchingQueueListener():
+    """ A thread that writes queued records to handlers in batches """
+
+    _STOP = None
+
+    def __init__(self, handlers, queue_size=10000, batch_size=100):
+        self.handlers = list(handlers)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self._reported_drops = 0
+
+    def start(self):
+        """ Starts the thread, which writes the queue out if the process exits """
+        self._thread = threading.Thread(target=self._run, args=(self.queue,), name="log-listener", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        # threads do not survive fork, so every worker starts its own
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._restart_after_fork)
+
+    def stop(self, timeout=5.0):
+        """ Writes every queued record and stops the thread """
+        thread, self._thread = self._thread, None
+        if thread is None or not thread.is_alive():
+            return
+        # wait for room rather than drop the signal to stop
+        try:
+            self.queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+
+    def count_drop(self):
+        """ Counts a record that was dropped because the queue was full """
+        with self._lock:
+            self.dropped += 1
+
+    def stats(self):
+        """ Returns the counters of the listener """
+        with self._lock:
+            return {
+                "queued": self.queue.qsize(),
+                "queue_size": self.queue_size,
+                "written": self.written,
+                "batches": self.batches,
+                "dropped": self.dropped,
+            }
+
+    def _run(self, records):
+        """ Takes batches of records off a queue until it is told to stop """
+        stopping = False
+        while not stopping:
+            batch = [records.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(records.get_nowait())
+                except queue.Empty:
+                    break
+            if self._STOP in batch:
+                stopping = True
+                batch = [record for record in batch if record is not self._STOP]
+                batch.extend(self._drain(records))
+            self._report_drops(batch)
+            if batch:
+                self._write(batch)
+
+    @classmethod
+    def _drain(cls, records):
+        """ Returns the records that are left on a queue """
+        drained = []
+        while True:
+            try:
+                record = records.get_nowait()
+            except queue.Empty:
+                return drained
+            if record is not cls._STOP:
+                drained.append(record)
+
+    def _report_drops(self, batch):
+        """ Adds a warning to the batch when records were dropped since the last one """
+        with self._lock:
+            dropped = self.dropped - self._reported_drops
+            self._reported_drops = self.dropped
+        if dropped:
+            batch.append(logging.makeLogRecord({
+                "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING", "module": "log_handlers",
+                "msg": "Dropped {} log records because the log queue was full".format(dropped),
+            }))
+
+    def _write(self, batch):
+        """ Formats and writes a batch of records to every handler """
+        for handler in self.handlers:
+            records = [record for record in batch if record.levelno >= handler.level and handler.filter(record)]
+            if not records:
+                continue
+            try:
+                if isinstance(handler, logging.StreamHandler) and handler.stream is not None:
+                    text = "".join(handler.format(record) + handler.terminator for record in records)
+                    with handler.lock:
+                        handler.stream.write(text)
+                        handler.flush()
+                else:
+                    for record in records:
+                        handler.handle(record)
+            except Exception:  # pylint: disable=broad-except
+                handler.handleError(records[0])
+        with self._lock:
+            self.written += len(batch)
+            self.batches += 1
+
+    def _restart_after_fork(self):
+        """ Starts a new queue and thread in a forked child if this listener was running """
+        if self._thread is None or self is not _listener:
+            return
+        self.queue = queue.Queue(self.queue_size)
+        self._lock = threading.Lock()
+        self.written = self.batches = self.dropped = self._reported_drops = 0
+        self._thread = threading.Thread(target=self._run, args=(self.queue,), name="log-listener", daemon=True)
+        self._thread.start()
@@ -0,0 +1,111 @@
+"""
+Prometheus Metrics
+
+Records the count, latency and database time of every request by route,
+method and status, plus the number of requests in flight, and serves them
+in the Prometheus text format at /metrics. Database time is measured by
+service/instrumentation.py.
+
+When gunicorn runs more than one worker, point the PROMETHEUS_MULTIPROC_DIR
+environment variable at an empty directory that all workers share before
+the service starts. Every worker then writes its samples to files in that
+directory and /metrics returns the sum over all workers, no matter which
+worker answers the scrape. The directory must be emptied between runs and
+gunicorn must call mark_process_dead() when a worker exits.
+"""
+import os
+import time
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from service.instrumentation import db_time, route_name
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_COUNT = Counter(
+    "customers_http_requests_total",
+    "HTTP requests handled",
+    ["method", "route", "status"],
+)
+REQUEST_LATENCY = Histogram(
+    "customers_http_request_duration_seconds",
+    "Time spent handling an HTTP request",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_DB_TIME = Histogram(
+    "customers_http_request_db_duration_seconds",
+    "Time spent executing SQL statements while handling an HTTP request",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "customers_http_requests_in_progress",
+    "HTTP requests currently being handled",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+)
+
+
+def init_metrics(app):
+    """ Starts recording request metrics and adds the /metrics route """
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+    app.teardown_request(_end_request)
+    app.add_url_rule("/metrics", "metrics", metrics)
+
+
+def metrics():
+    """ Returns all metrics in the Prometheus text format """
+    if multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def multiprocess_dir():
+    """ Returns the directory shared by all worker processes, if there is one """
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.environ.get("prometheus_multiproc_dir")
+
+
+def mark_process_dead(pid):
+    """ Drops the live gauges of a worker process that has exited """
+    if multiprocess_dir():
+        multiprocess.mark_process_dead(pid)
+
+
+######################################################################
+#  R E Q U E S T   H O O K S
+######################################################################
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_labels = (request.method, route_name())
+    REQUESTS_IN_PROGRESS.labels(*g.metrics_labels).inc()
+
+
+def _record_request(response):
+    labels = g.pop("metrics_labels", None)
+    if labels is None:
+        return response
+    REQUESTS_IN_PROGRESS.labels(*labels).dec()
+    REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - g.metrics_start)
+    REQUEST_DB_TIME.labels(*labels).observe(db_time())
+    REQUEST_COUNT.labels(*labels, response.status_code).inc()
+    return response
+
+
+def _end_request(error=None):
+    # the request failed before a response was made, so only undo the gauge
+    labels = g.pop("metrics_labels", None)
+    if labels is not None:
+        REQUESTS_IN_PROGRESS.labels(*labels).dec()
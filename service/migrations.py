@@ -0,0 +1,298 @@
+"""
+Schema Migrations
+
+Versioned, forward-only migrations for the customer database.
+
+A brand new database is created from the models with db.create_all() and
+stamped with the latest version. An existing database is upgraded by
+running every migration newer than the highest version recorded in the
+schema_version table, in order. Databases that were created before this
+module existed have the version 1 (baseline) schema.
+
+Migrations that cannot run inside a transaction (for example
+CREATE INDEX CONCURRENTLY on PostgreSQL, which builds an index without
+locking the table against writes) are marked as non-transactional and run
+in autocommit mode, so they are written to be safe to re-run.
+
+Workers never run migrations when they start: the schema is managed by
+running "flask db-upgrade" once per deployment, before the new workers
+start (the release phase of the Procfile).
+"""
+import logging
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import inspect, text
+from service.models import db
+
+logger = logging.getLogger("flask.app")
+
+# arbitrary key for the advisory lock that serializes concurrent upgrades
+MIGRATION_LOCK_KEY = 4201202201
+
+schema_version = db.Table(
+    "schema_version",
+    db.Column("version", db.Integer, primary_key=True, autoincrement=False),
+    db.Column("description", db.String(255), nullable=False),
+    db.Column("applied_at", db.DateTime, nullable=False),
+)
+
+# statements is a dictionary of dialect name (or "default") to a list of
+# SQL statements or functions that are called with the connection
+Migration = namedtuple("Migration", ["version", "description", "statements", "transactional"])
+
+MIGRATIONS = [
+    Migration(1, "Baseline customer and address tables", {}, True),
+    Migration(
+        2,
+        "Index customer names, lower(userid) and address customer_id",
+        {
+            "postgresql": [
+                lambda conn: _create_index_concurrently(conn, "ix_customer_first_name", "customer (first_name)"),
+                lambda conn: _create_index_concurrently(conn, "ix_customer_last_name", "customer (last_name)"),
+                lambda conn: _create_index_concurrently(conn, "ix_customer_userid_lower", "customer (lower(userid))"),
+                lambda conn: _create_index_concurrently(conn, "ix_address_customer_id", "address (customer_id)"),
+            ],
+            "default": [
+                "CREATE INDEX IF NOT EXISTS ix_customer_first_name ON customer (first_name)",
+                "CREATE INDEX IF NOT EXISTS ix_customer_last_name ON customer (last_name)",
+                "CREATE INDEX IF NOT EXISTS ix_customer_userid_lower ON customer (lower(userid))",
+                "CREATE INDEX IF NOT EXISTS ix_address_customer_id ON address (customer_id)",
+            ],
+        },
+        False,
+    ),
+    Migration(
+        3,
+        "Add customer version for ETags",
+        {
+            # a constant default does not rewrite the table on PostgreSQL 11+
+            "default": [
+                lambda conn: _add_column(conn, "customer", "version", "INTEGER NOT NULL DEFAULT 1"),
+            ],
+        },
+        True,
+    ),
+    Migration(
+        4,
+        "Delete the addresses of a customer with ON DELETE CASCADE",
+        {"default": [lambda conn: _cascade_address_deletes(conn)]},
+        True,
+    ),
+    Migration(
+        5,
+        "Validate the ON DELETE CASCADE key of address",
+        # committed on its own, so the scan of address holds only a SHARE
+        # UPDATE EXCLUSIVE lock instead of the lock that migration 4 took
+        {"postgresql": [lambda conn: _validate_foreign_keys(conn, "address")]},
+        False,
+    ),
+    Migration(
+        6,
+        "Make userids unique ignoring case",
+        {"default": [lambda conn: _unique_lower_userid(conn)]},
+        False,
+    ),
+]
+
+HEAD = MIGRATIONS[-1].version
+
+
+######################################################################
+#  M I G R A T I O N   C O M M A N D S
+######################################################################
+def init_migrations(app):
+    """ Registers the "flask db-upgrade" command """
+    app.cli.command("db-upgrade")(upgrade_command)
+
+
+def upgrade_command():
+    """ Creates or upgrades the database tables """
+    upgrade()
+    print("Database schema is at version {}".format(current_version()))
+
+
+def upgrade():
+    """ Brings the database schema up to the latest version """
+    engine = db.engine
+    with _migration_lock(engine):
+        if not inspect(engine).has_table("customer"):
+            logger.info("Creating database schema at version %s", HEAD)
+            db.create_all()
+            with engine.begin() as conn:
+                for migration in MIGRATIONS:
+                    _record(conn, migration)
+            return
+
+        schema_version.create(engine, checkfirst=True)
+        version = current_version()
+        if version is None:
+            logger.info("Stamping existing database with baseline version 1")
+            with engine.begin() as conn:
+                _record(conn, MIGRATIONS[0])
+            version = MIGRATIONS[0].version
+
+        for migration in MIGRATIONS:
+            if migration.version > version:
+                _apply(engine, migration)
+        logger.info("Database schema is at version %s", HEAD)
+
+
+def current_version():
+    """ Returns the version of the database schema or None if unversioned """
+    if not inspect(db.engine).has_table(schema_version.name):
+        return None
+    with db.engine.connect() as conn:
+        return conn.execute(db.select(db.func.max(schema_version.c.version))).scalar()
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def _apply(engine, migration):
+    """ Runs the statements of one migration and records it """
+    logger.info("Applying migration %s: %s", migration.version, migration.description)
+    statements = migration.statements.get(
+        engine.dialect.name, migration.statements.get("default", [])
+    )
+    if migration.transactional:
+        with engine.begin() as conn:
+            for statement in statements:
+                _execute(conn, statement)
+            _record(conn, migration)
+    else:
+        with engine.connect() as conn:
+            autocommit = conn.execution_options(isolation_level="AUTOCOMMIT")
+            for statement in statements:
+                _execute(autocommit, statement)
+        with engine.begin() as conn:
+            _record(conn, migration)
+
+
+def _execute(conn, statement):
+    """ Runs one SQL statement or migration function """
+    if callable(statement):
+        statement(conn)
+    else:
+        conn.execute(text(statement))
+
+
+def _add_column(conn, table, column, definition):
+    """ Adds a column to a table unless it is already there """
+    if column in {existing["name"] for existing in inspect(conn).get_columns(table)}:
+        return
+    conn.execute(text("ALTER TABLE {} ADD COLUMN {} {}".format(table, column, definition)))
+
+
+def _create_index_concurrently(conn, name, definition):
+    """
+    Builds an index without blocking writes, unless a valid one is already
+    there: a build that failed or was cancelled leaves an invalid index
+    behind, which the planner never uses, so it is dropped and built again
+    """
+    valid = conn.execute(
+        text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"), {"name": name}
+    ).scalar()
+    if valid:
+        return
+    conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS {}".format(name)))
+    conn.execute(text("CREATE INDEX CONCURRENTLY {} ON {}".format(name, definition)))
+
+
+def _cascade_address_deletes(conn):
+    """ Makes the foreign key from address to customer delete with the customer """
+    foreign_key = next(
+        key for key in inspect(conn).get_foreign_keys("address") if key["referred_table"] == "customer"
+    )
+    if foreign_key["options"].get("ondelete", "").upper() == "CASCADE":
+        return
+    if conn.dialect.name == "sqlite":
+        # SQLite cannot alter a constraint, so the table is copied
+        conn.execute(text(
+            "CREATE TABLE address_new (id INTEGER NOT NULL, customer_id INTEGER NOT NULL, "
+            "street VARCHAR(64), city VARCHAR(64), state VARCHAR(64), postal_code VARCHAR(64), PRIMARY KEY (id), "
+            "FOREIGN KEY(customer_id) REFERENCES customer (id) ON DELETE CASCADE)"
+        ))
+        conn.execute(text(
+            "INSERT INTO address_new (id, customer_id, street, city, state, postal_code) "
+            "SELECT id, customer_id, street, city, state, postal_code FROM address"
+        ))
+        conn.execute(text("DROP TABLE address"))
+        conn.execute(text("ALTER TABLE address_new RENAME TO address"))
+        conn.execute(text("CREATE INDEX ix_address_customer_id ON address (customer_id)"))
+        return
+    # the rows already satisfy the old key, so the new one is added without
+    # checking them and validated by migration 5
+    name = foreign_key["name"]
+    conn.execute(text(
+        "ALTER TABLE address DROP CONSTRAINT {name}, ADD CONSTRAINT {name} FOREIGN KEY (customer_id) "
+        "REFERENCES customer (id) ON DELETE CASCADE NOT VALID".format(name=name)
+    ))
+
+
+def _validate_foreign_keys(conn, table):
+    """ Validates the foreign keys of a table that were added NOT VALID, if any are left """
+    names = conn.execute(text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table AS regclass) "
+        "AND contype = 'f' AND NOT convalidated"
+    ), {"table": table}).scalars().all()
+    for name in names:
+        conn.execute(text("ALTER TABLE {} VALIDATE CONSTRAINT {}".format(table, name)))
+
+
+def _unique_lower_userid(conn):
+    """
+    Replaces the index on lower(userid) with a unique one, after checking
+    that no two userids differ only in case
+    """
+    duplicates = conn.execute(text(
+        "SELECT lower(userid) FROM customer WHERE userid IS NOT NULL GROUP BY lower(userid) HAVING COUNT(*) > 1"
+    )).scalars().all()
+    if duplicates:
+        raise RuntimeError(
+            "Cannot make userids unique ignoring case, rename the Customers with these userids first: {}".format(
+                ", ".join(sorted(duplicates)))
+        )
+    if conn.dialect.name != "postgresql":
+        conn.execute(text("DROP INDEX IF EXISTS ix_customer_userid_lower"))
+        conn.execute(text("CREATE UNIQUE INDEX ix_customer_userid_lower ON customer (lower(userid))"))
+        return
+    unique = conn.execute(text(
+        "SELECT indisunique FROM pg_index WHERE indexrelid = to_regclass('ix_customer_userid_lower')"
+    )).scalar()
+    if unique:
+        return
+    # built next to the old index without blocking writes, then swapped in;
+    # an invalid index left by a failed build is dropped first
+    conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_customer_userid_lower_unique"))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX CONCURRENTLY ix_customer_userid_lower_unique ON customer (lower(userid))"
+    ))
+    conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_customer_userid_lower"))
+    conn.execute(text("ALTER INDEX ix_customer_userid_lower_unique RENAME TO ix_customer_userid_lower"))
+
+
+def _record(conn, migration):
+    """ Records that a migration has been applied """
+    conn.execute(
+        schema_version.insert().values(
+            version=migration.version,
+            description=migration.description,
+            applied_at=datetime.utcnow(),
+        )
+    )
+
+
+@contextmanager
+def _migration_lock(engine):
+    """ Keeps two processes from upgrading the same database at once """
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
@@ -4,19 +4,35 @@ Models for Customer
 All of the models are stored in this module
 """
 import logging
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.exc import IntegrityError
+from contextlib import nullcontext
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.orm import object_session, selectinload
+from sqlalchemy.orm.exc import StaleDataError
+from service.pool import PooledSQLAlchemy
 
 logger = logging.getLogger("flask.app")
 
-# Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+# Create the SQLAlchemy object to be initialized later in init_app()
+db = PooledSQLAlchemy()
 
 
 class DataValidationError(Exception):
     """ Used for an data validation errors when deserializing """
 
     pass
+
+
+class UseridConflictError(DataValidationError):
+    """ Used when a Customer would have the same userid as another Customer """
+
+    pass
+
+
+class VersionConflictError(Exception):
+    """ Used when a Customer was changed by someone else since it was read """
+
+    pass
 ######################################################################
 #  P E R S I S T E N T   B A S E   M O D E L
 ######################################################################
@@ -37,7 +53,7 @@ class PersistentBase():
             db.session.commit()
         except IntegrityError:
             db.session.rollback()
-            raise DataValidationError(
+            raise UseridConflictError(
                 "Userid already exists!"
             )
             # error, there already is a customer with this userid
@@ -50,31 +66,55 @@ class PersistentBase():
             db.session.commit()
         except IntegrityError:
             db.session.rollback()
-            raise DataValidationError(
+            raise UseridConflictError(
                 "Userid already exists!"
             )
             # error, there already is a customer with this userid
+        except StaleDataError:
+            db.session.rollback()
+            raise VersionConflictError(
+                "Customer was changed by another request"
+            )
     def delete(self):
         """ Removes a Customer from the data store """
         #logger.info("Deleting %s", self.first_name)
         db.session.delete(self)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            raise VersionConflictError(
+                "Customer was changed by another request"
+            )
 
     @classmethod
-    def init_db(cls, app):
-        """ Initializes the database session """
-        logger.info("Initializing database")
+    def init_app(cls, app):
+        """ Connects the models to the Flask app without touching the database """
         cls.app = app
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
+
+    @classmethod
+    def init_db(cls, app):
+        """ Initializes the database session and creates or upgrades the tables """
+        logger.info("Initializing database")
+        # the service package already connected its app when it was imported
+        if cls.app is not app:
+            cls.init_app(app)
         app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        from service import migrations  # pylint: disable=import-outside-toplevel
+        migrations.upgrade()  # make or upgrade our sqlalchemy tables
+
+    @classmethod
+    def base_query(cls):
+        """ Returns the query that all lookups of many records start from """
+        return cls.query
 
     @classmethod
     def all(cls):
         """ Returns all of the records in the database """
         logger.info("Processing all records")
-        return cls.query.all()
+        return cls.base_query().all()
 
     @classmethod
     def find(cls, by_id):
@@ -87,6 +127,23 @@ class PersistentBase():
         """ Find a record by it's id """
         logger.info("Processing lookup or 404 for id %s ...", by_id)
         return cls.query.get_or_404(by_id)
+
+    @classmethod
+    def find_page(cls, query=None, limit=None, after_id=None):
+        """
+        Returns one page of records ordered by id using keyset pagination
+
+        Args:
+            query (Query): an optional filtered query, defaults to all records
+            limit (int): the maximum number of records to return
+            after_id (int): only records with an id greater than this are returned
+        """
+        logger.info("Processing page of %s records after id %s ...", limit, after_id)
+        if query is None:
+            query = cls.base_query()
+        if after_id is not None:
+            query = query.filter(cls.id > after_id)
+        return query.order_by(cls.id).limit(limit).all()
 ######################################################################
 #  A D D R E S S   M O D E L
 ######################################################################
@@ -97,7 +154,10 @@ class Address(db.Model,PersistentBase):
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
+    # the database deletes the addresses of a deleted customer (see Customer.delete_by_ids)
+    customer_id = db.Column(
+        db.Integer, db.ForeignKey('customer.id', ondelete='CASCADE'), nullable=False, index=True
+    )
     street = db.Column(db.String(64))
     city = db.Column(db.String(64))
     state = db.Column(db.String(64))
@@ -155,15 +215,42 @@ class Customer(db.Model, PersistentBase):
     ##################################################
     # Unique id, first name, last name, optional userid and password, addresses
     id = db.Column(db.Integer, primary_key=True)
-    first_name = db.Column(db.String(63), nullable=False)
-    last_name = db.Column(db.String(63), nullable=False)
+    first_name = db.Column(db.String(63), nullable=False, index=True)
+    last_name = db.Column(db.String(63), nullable=False, index=True)
     userid = db.Column(db.String(63), nullable=True, unique=True)
     password = db.Column(db.String(63), nullable=True)
     active = db.Column(db.Boolean(), nullable=False)
-    addresses = db.relationship('Address', backref='customer', lazy=True)  
+    # bumped whenever the Customer or one of its addresses changes, and checked
+    # by every UPDATE of a Customer (see bump_customer_versions)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    addresses = db.relationship(
+        'Address', backref='customer', lazy=True, cascade='all, delete-orphan', passive_deletes=True
+    )
+
+    # userid lookups ignore case, so userids are unique ignoring case through
+    # a unique index on lower(userid)
+    # (indexes on existing databases are added by service.migrations)
+    __table_args__ = (
+        db.Index("ix_customer_userid_lower", db.func.lower(userid), unique=True),
+    )
+    # UPDATE customer ... WHERE id = ? AND version = ? changes no row when another
+    # request got there first, and the flush raises StaleDataError
+    __mapper_args__ = {
+        "version_id_col": version,
+        "version_id_generator": False,
+    }
 
     def __repr__(self):
         return "<Customer %r id=[%s]>" % (self.first_name, self.id)
+
+    @classmethod
+    def base_query(cls):
+        """
+        Returns a Customer query that loads the addresses of all matching
+        Customers with one batched SELECT ... WHERE customer_id IN (...)
+        instead of one lazy SELECT per Customer when they are serialized
+        """
+        return cls.query.options(selectinload(cls.addresses))
     
     def serialize(self):
         """ Serializes a Customer into a dictionary """
@@ -204,17 +291,19 @@ class Customer(db.Model, PersistentBase):
                     + str(type(data["last_name"]))
                 )    
             
-            self.userid = data.get("userid")
+            if data.get("userid") is None or isinstance(data["userid"], str):
+                self.userid = data.get("userid")
+            else:
+                raise DataValidationError(
+                    "Invalid type for string [userid]: "
+                    + str(type(data["userid"]))
+                )
             self.password = data.get("password")
 
             self.active = data.get("active")
 
-            address_list = data.get("addresses", [])
-            #address_list = data.get("addresses")
-            for json_address in address_list:
-                address = Address()
-                address.deserialize(json_address)
-                self.addresses.append(address)
+            if "addresses" in data:
+                self._merge_addresses(data["addresses"])
 
         except AttributeError as error:
             raise DataValidationError("Invalid attribute: " + error.args[0])
@@ -225,27 +314,288 @@ class Customer(db.Model, PersistentBase):
                 "Invalid Customer: body of request contained bad or no data " + str(error)
             )
         return self
-    
+
+    def _merge_addresses(self, address_list):
+        """
+        Reconciles the addresses of a Customer with a list of documents by id
+
+        An address with the id of one of the Customer's addresses updates it,
+        any other address is added, and the addresses left out are deleted.
+        SQLAlchemy only writes the attributes whose values changed, so
+        addresses that are posted unchanged are not written at all.
+        """
+        session = object_session(self)
+        # loading the addresses must not flush the half deserialized Customer
+        with session.no_autoflush if session is not None else nullcontext():
+            existing = {address.id: address for address in self.addresses if address.id is not None}
+        for json_address in address_list:
+            address = existing.pop(json_address.get("id"), None) if isinstance(json_address, dict) else None
+            if address is None:
+                self.addresses.append(Address().deserialize(json_address))
+            else:
+                address.deserialize(json_address)
+        for address in existing.values():
+            self.addresses.remove(address)
+            # deleted explicitly, so the version bump sees it before the flush
+            if session is not None:
+                session.delete(address)
+
+    @classmethod
+    def create_batch(cls, documents, chunk_size, session=None):
+        """
+        Creates many Customers, committing chunk_size of them per transaction
+
+        A document that cannot be created does not stop the rest of the batch.
+
+        Args:
+            documents (list): dictionaries containing the Customer data
+            chunk_size (int): the number of Customers inserted per transaction
+            session (Session): the session to use, defaults to db.session
+
+        Returns:
+            a list with the new Customer id or the DataValidationError
+            for every document, in the same order as the documents
+        """
+        logger.info("Creating batch of %s in chunks of %s", len(documents), chunk_size)
+        session = session or db.session
+        results = []
+        userids = set()
+        for start in range(0, len(documents), chunk_size):
+            chunk = documents[start:start + chunk_size]
+            customers = {}
+            outcomes = []
+            for position, data in enumerate(chunk):
+                try:
+                    customer = cls._new_from_document(data)
+                except DataValidationError as error:
+                    outcomes.append(error)
+                    continue
+                if customer.userid is not None:
+                    if customer.userid.lower() in userids:
+                        outcomes.append(UseridConflictError("Userid already exists!"))
+                        continue
+                    userids.add(customer.userid.lower())
+                customers[position] = customer
+                outcomes.append(None)
+
+            # one SELECT finds every userid of this chunk that is already taken
+            taken = cls._existing_userids(
+                [customer.userid for customer in customers.values() if customer.userid is not None], session
+            )
+            for position, customer in list(customers.items()):
+                if customer.userid is not None and customer.userid.lower() in taken:
+                    outcomes[position] = UseridConflictError("Userid already exists!")
+                    del customers[position]
+
+            try:
+                session.add_all(customers.values())
+                session.commit()
+            except DBAPIError as error:
+                # someone else took a userid since the check, or the database refused
+                # a row (a value too long for its column), so retry one at a time
+                session.rollback()
+                if error.connection_invalidated:
+                    raise
+                for position in list(customers):
+                    customer = cls._new_from_document(chunk[position])
+                    try:
+                        session.add(customer)
+                        session.commit()
+                        customers[position] = customer
+                    except DBAPIError as row_error:
+                        session.rollback()
+                        if row_error.connection_invalidated:
+                            raise
+                        outcomes[position] = cls._refused(row_error)
+                        del customers[position]
+
+            for position, outcome in enumerate(outcomes):
+                results.append(customers[position].id if position in customers else outcome)
+            session.expunge_all()  # keep memory flat across chunks
+        return results
+
+    @staticmethod
+    def _refused(error):
+        """ Returns the DataValidationError for a Customer that the database refused to insert """
+        if isinstance(error, IntegrityError):
+            return UseridConflictError("Userid already exists!")
+        return DataValidationError("Invalid Customer: refused by the database: {}".format(error.orig))
+
+    @classmethod
+    def _new_from_document(cls, data):
+        """ Returns a new unsaved Customer deserialized from a document """
+        customer = cls()
+        customer.deserialize(data)
+        customer.id = None
+        if customer.active is None:  # default active when created
+            customer.active = True
+        return customer
+
+    @classmethod
+    def _existing_userids(cls, userids, session):
+        """ Returns the userids, in lower case, that already belong to a Customer in any case """
+        if not userids:
+            return set()
+        lower_userid = db.func.lower(cls.userid)
+        query = session.query(lower_userid).filter(lower_userid.in_([userid.lower() for userid in userids]))
+        return {userid for (userid,) in query}
+
+    @classmethod
+    def filter_criteria(cls, ids=None, first_name=None, last_name=None, userid=None):
+        """
+        Returns the SQL criteria that select Customers by a list of ids
+        or by the same filters as the find_by_* methods
+        """
+        criteria = []
+        if ids is not None:
+            criteria.append(cls.id.in_(ids))
+        if first_name is not None:
+            criteria.append(cls.first_name == first_name)
+        if last_name is not None:
+            criteria.append(cls.last_name == last_name)
+        if userid is not None:
+            criteria.append(db.func.lower(cls.userid) == userid.lower())
+        return criteria
+
+    @classmethod
+    def set_active_where(cls, criteria, active, return_ids=False, session=None):
+        """
+        Sets the active flag of every Customer matching criteria with a
+        single UPDATE statement, skipping rows that already have that value
+
+        Returns:
+            a tuple of the number of Customers changed and, if return_ids
+            is True, their ids (otherwise None)
+        """
+        logger.info("Processing bulk update of active to %s", active)
+        session = session or db.session
+        where = db.and_(*criteria, cls.active != active)
+        statement = db.update(cls.__table__).where(where).values(active=active, version=cls.version + 1)
+        ids = None
+        if return_ids and session.connection().dialect.full_returning:
+            ids = [row.id for row in session.execute(statement.returning(cls.id))]
+            count = len(ids)
+        else:
+            if return_ids:
+                # no RETURNING, so read the ids first inside the same transaction
+                ids = [row.id for row in session.execute(db.select(cls.id).where(where))]
+            count = session.execute(statement).rowcount
+        session.commit()
+        return count, ids
+
+    @classmethod
+    def set_active(cls, by_id, active, session=None):
+        """
+        Sets the active flag of one Customer with a single UPDATE ...
+        RETURNING statement, without loading the Customer first
+
+        Databases without RETURNING (SQLite) read the row back with a SELECT
+        in the same transaction instead.
+
+        Returns:
+            a row with the id, active flag and version of the Customer, or
+            None if it was not found
+        """
+        logger.info("Processing update of active to %s for id %s ...", active, by_id)
+        session = session or db.session
+        where = cls.id == by_id
+        statement = db.update(cls.__table__).where(where).values(
+            active=active,
+            # a Customer that already has the flag keeps its version, and its ETag
+            version=db.case((cls.active == active, cls.version), else_=cls.version + 1),
+        )
+        columns = [cls.id, cls.active, cls.version]
+        if session.connection().dialect.full_returning:
+            row = session.execute(statement.returning(*columns)).first()
+        else:
+            session.execute(statement)
+            row = session.execute(db.select(*columns).where(where)).first()
+        session.commit()
+        return row
+
+    @classmethod
+    def delete_by_ids(cls, ids, session=None):
+        """
+        Deletes the Customers with the given ids with a single DELETE
+        statement, and their addresses with them through ON DELETE CASCADE
+
+        Returns:
+            the number of Customers deleted, 0 for ids that do not exist
+        """
+        logger.info("Processing delete of %s customers", len(ids))
+        session = session or db.session
+        if not ids:
+            return 0
+        count = session.execute(db.delete(cls.__table__).where(cls.id.in_(ids))).rowcount
+        session.commit()
+        return count
+
+    @classmethod
+    def find_version(cls, by_id):
+        """ Returns the version of a Customer without loading it, or None if not found """
+        logger.info("Processing version lookup for id %s ...", by_id)
+        return db.session.query(cls.version).filter(cls.id == by_id).scalar()
+
+    @classmethod
+    def stream_all(cls, chunk_size):
+        """
+        Returns an iterator over every Customer ordered by id that fetches
+        chunk_size rows at a time from a server side cursor
+        """
+        logger.info("Processing export of all records in chunks of %s", chunk_size)
+        return cls.base_query().order_by(cls.id).yield_per(chunk_size)
+
     @classmethod
     def find_by_id(cls, id):
         """ Returns all Customer with the given unique id """
         logger.info("Processing lookup for id %s ...", id)
-        return cls.query.filter(cls.id == id)
+        return cls.base_query().filter(cls.id == id)
 
     @classmethod
     def find_by_first_name(cls, first_name):
         """ Returns all Customer with the given first name """
         logger.info("Processing lookup for first_name %s ...", first_name)
-        return cls.query.filter(cls.first_name == first_name)
+        return cls.base_query().filter(cls.first_name == first_name)
 
     @classmethod
     def find_by_last_name(cls, last_name):
         """ Returns all Customer with the given last name """
         logger.info("Processing lookup for last_name %s ...", last_name)
-        return cls.query.filter(cls.last_name == last_name)
+        return cls.base_query().filter(cls.last_name == last_name)
 
     @classmethod
     def find_by_userid(cls, userid):
-        """ Returns all Customer with the given userid """
+        """ Returns all Customer with the given userid, ignoring case """
         logger.info("Processing lookup for userid %s ...", userid)
-        return cls.query.filter(cls.userid == userid)
\ No newline at end of file
+        return cls.base_query().filter(db.func.lower(cls.userid) == userid.lower())
+
+
+######################################################################
+#  V E R S I O N   T R A C K I N G
+######################################################################
+@event.listens_for(db.session, "before_flush")
+def bump_customer_versions(session, flush_context, instances):
+    """ Bumps the version of every Customer changed directly or through its addresses """
+    changed = set()
+    with session.no_autoflush:
+        for obj in session.dirty:
+            if isinstance(obj, Customer) and session.is_modified(obj, include_collections=False):
+                changed.add(obj)
+            elif isinstance(obj, Address) and session.is_modified(obj):
+                changed.add(_owner_of(session, obj))
+        for obj in session.new | session.deleted:
+            if isinstance(obj, Address):
+                changed.add(_owner_of(session, obj))
+    for customer in changed:
+        if customer is None or customer in session.new or customer in session.deleted:
+            continue
+        customer.version = (customer.version or 0) + 1
+
+
+def _owner_of(session, address):
+    """ Returns the Customer that an Address belongs to """
+    if address.customer is not None:
+        return address.customer
+    if address.customer_id is not None:
+        return session.get(Customer, address.customer_id)
+    return None
@@ -0,0 +1,183 @@
+"""
+Database Connection Pool
+
+Builds the SQLAlchemy engine options for the connection pool from the
+application configuration and keeps live statistics about it.
+
+Two pool modes are supported:
+
+internal: every worker process keeps its own QueuePool of connections,
+          sized by DB_POOL_SIZE and DB_MAX_OVERFLOW
+external: connections are pooled by a proxy such as PgBouncer in
+          transaction mode, so the service opens a connection per
+          checkout (NullPool) and must not rely on any state that
+          outlives a transaction on the server, like prepared statements
+"""
+import threading
+import time
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+
+POOL_MODES = ("internal", "external")
+
+
+class PoolStats():
+    """ Counters for connection pool activity in this process """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Sets every counter back to zero """
+        with self._lock:
+            self.connects = 0
+            self.checkouts = 0
+            self.checkins = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.waits = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds, timed_out=False):
+        """ Records how long one checkout waited for a connection """
+        with self._lock:
+            self.waits += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def increment(self, counter):
+        """ Adds one to a counter """
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def snapshot(self, pool=None):
+        """ Returns the counters, plus the live state of pool if one is given """
+        with self._lock:
+            stats = {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+                "wait_seconds_avg": self.wait_seconds_total / self.waits if self.waits else 0.0,
+            }
+        if pool is not None:
+            stats["pool_class"] = type(pool).__name__
+            if isinstance(pool, QueuePool):
+                stats.update({
+                    "size": pool.size(),
+                    "checked_in": pool.checkedin(),
+                    "checked_out": pool.checkedout(),
+                    "overflow": pool.overflow(),
+                })
+        return stats
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """ A QueuePool that measures how long checkouts wait for a connection """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_stats.record_wait(time.perf_counter() - start)
+        return connection
+
+
+@event.listens_for(InstrumentedQueuePool, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    pool_stats.increment("connects")
+
+
+@event.listens_for(InstrumentedQueuePool, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_stats.increment("checkouts")
+
+
+@event.listens_for(InstrumentedQueuePool, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    pool_stats.increment("checkins")
+
+
+@event.listens_for(InstrumentedQueuePool, "invalidate")
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    pool_stats.increment("invalidations")
+
+
+def engine_options(config, url=None):
+    """
+    Returns the SQLAlchemy engine options for the pool described by config
+
+    SQLite databases keep the driver's default pool, so no options are
+    returned for them.
+    """
+    url = make_url(url or config["SQLALCHEMY_DATABASE_URI"])
+    if url.get_backend_name() == "sqlite":
+        return {}
+    mode = config.get("DB_POOL_MODE", "internal")
+    if mode not in POOL_MODES:
+        raise ValueError("DB_POOL_MODE must be one of {}, not {!r}".format(POOL_MODES, mode))
+    if mode == "external":
+        return {"poolclass": NullPool}
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": config.get("DB_POOL_SIZE", 5),
+        "max_overflow": config.get("DB_MAX_OVERFLOW", 10),
+        "pool_timeout": config.get("DB_POOL_TIMEOUT", 30),
+        "pool_recycle": config.get("DB_POOL_RECYCLE", -1),
+        "pool_pre_ping": config.get("DB_POOL_PRE_PING", True),
+    }
+
+
+def dispose_after_fork(engine):
+    """
+    Drops the connections a forked worker inherited from its parent
+
+    The sockets stay open for the parent, so the worker opens its own
+    connections instead of sharing them. The statistics start from zero.
+    """
+    engine.dispose(close=False)
+    pool_stats.reset()
+
+
+def enable_foreign_keys(engine):
+    """
+    Turns on foreign keys, and with them ON DELETE CASCADE, for every new
+    connection of a SQLite engine (SQLite leaves them off per connection)
+    """
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _enable_sqlite_foreign_keys)
+    return engine
+
+
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    """ Flask-SQLAlchemy that configures the pool of every engine it creates """
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super().apply_driver_hacks(app, sa_url, options)
+        # SQLALCHEMY_ENGINE_OPTIONS is applied afterwards and still wins
+        options.update(engine_options(app.config, sa_url))
+        return sa_url, options
+
+    def create_engine(self, sa_url, engine_opts):
+        return enable_foreign_keys(super().create_engine(sa_url, engine_opts))
@@ -3,27 +3,42 @@ Customer Service
 
 Paths:
 ------
-GET /customers - Returns a list all of all Customers
+GET /customers - Returns a list all of all Customers (paginated with limit and cursor)
+GET /customers/export - Streams all Customers as newline-delimited JSON
+PUT /customers/activate - activates all Customers matching ids or a filter
+PUT /customers/deactivate - deactivates all Customers matching ids or a filter
 GET /customers/{id} - Returns the Customer with a given id number
 POST /customers - creates a new Customer record in the database
+POST /customers/batch - creates many Customer records in the database
 PUT /customers/{id} - updates a Customer record in the database
 DELETE /customers/{id} - deletes a Customer record in the database
+DELETE /customers?ids=1,2,3 - deletes many Customer records in the database
 """
 
 import os
 import sys
 import logging
+import base64
+import binascii
 from functools import wraps
 import json
 from werkzeug.exceptions import NotFound
-from flask import Flask, jsonify, request, url_for, make_response, abort, render_template
+from werkzeug.http import quote_etag
+from flask import Flask, Response, jsonify, request, url_for, make_response, abort, render_template
+from flask import stream_with_context
 from flask_restx import Api, Resource, fields, reqparse, inputs
 from . import status  # HTTP Status Codes
 
 # For this example we'll use SQLAlchemy, a popular ORM that supports a
 # variety of backends including SQLite, MySQL, and PostgreSQL
 from flask_sqlalchemy import SQLAlchemy
-from service.models import Address, Customer, DataValidationError
+from service.models import Address, Customer, DataValidationError, UseridConflictError, VersionConflictError, db
+from service.pool import pool_stats
+from service.log_handlers import log_stats
+from service.cache import LRUCache
+from service.serializers import compile_serializer, dumps, json_response
+from service.json_provider import output_json
+from service.compression import send_index
 
 # Import Flask application
 from . import app
@@ -35,7 +50,28 @@ from . import app
 def index():
     """ Root URL response """
     app.logger.info("Request for Root URL")
-    return app.send_static_file("index.html")
+    return send_index()
+
+######################################################################
+# CACHE, POOL AND LOG STATISTICS
+######################################################################
+# (version, Customer JSON bytes) tuples keyed by id, see cache_key()
+customer_cache = LRUCache(app.config["CUSTOMER_CACHE_SIZE"], app.config["CUSTOMER_CACHE_TTL"])
+
+@app.route("/cache/stats")
+def cache_stats():
+    """ Returns the hit, miss and eviction counters of the customer cache """
+    return jsonify(customer_cache.stats()), status.HTTP_200_OK
+
+@app.route("/pool/stats")
+def pool_stats_view():
+    """ Returns the checkout and wait counters and live state of the connection pool """
+    return jsonify(pool_stats.snapshot(db.engine.pool)), status.HTTP_200_OK
+
+@app.route("/log/stats")
+def log_stats_view():
+    """ Returns the written and dropped counters of the log queue (empty when logs are not queued) """
+    return jsonify(log_stats() or {}), status.HTTP_200_OK
 
 ######################################################################
 # Configure Swagger before initializing it
@@ -50,6 +86,21 @@ api = Api(app,
           prefix='/' # /api if doesn't work
          )
 
+# encode responses with the configured JSON library
+api.representation('application/json')(output_json)
+
+# every write bumps the version of a Customer, so any of them can find that
+# another request changed it first (see Customer.__mapper_args__)
+@api.errorhandler(VersionConflictError)
+def version_conflict(error):
+    """Handles a Customer changed by another request with 412_PRECONDITION_FAILED"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        {'status': status.HTTP_412_PRECONDITION_FAILED, 'error': 'Precondition Failed', 'message': message},
+        status.HTTP_412_PRECONDITION_FAILED,
+    )
+
 # Define the model so that the docs reflect what can be sent
 create_addr_model = api.model('Address', {
     'street': fields.String(required=True,
@@ -97,11 +148,46 @@ customer_model = api.inherit(
     }
 )
 
+# Result of creating one Customer of a batch
+batch_result_model = api.model('BatchResult', {
+    'index': fields.Integer(description='The position of the Customer in the posted array'),
+    'status': fields.Integer(description='The HTTP status code for this Customer'),
+    'id': fields.Integer(description='The unique id assigned to the created Customer'),
+    'location': fields.String(description='The URL of the created Customer'),
+    'error': fields.String(description='Why this Customer was not created'),
+})
+
+# Selects the Customers of a bulk activate or deactivate
+bulk_active_model = api.model('BulkActive', {
+    'ids': fields.List(fields.Integer, required=False,
+                        description='The ids of the Customers to change'),
+    'first_name': fields.String(required=False,
+                          description='Change all Customers with this first name'),
+    'last_name': fields.String(required=False,
+                          description='Change all Customers with this last name'),
+    'userid': fields.String(required=False,
+                              description='Change the Customer with this userid'),
+    'return_ids': fields.Boolean(required=False, default=False,
+                                description='Also return the ids of the changed Customers'),
+})
+
+bulk_active_result_model = api.model('BulkActiveResult', {
+    'count': fields.Integer(description='The number of Customers that were changed'),
+    'ids': fields.List(fields.Integer, description='The ids of the changed Customers (if requested)'),
+})
+
+# serializers compiled from the models, which go from a Customer or Address
+# to the response document in one pass (see service/serializers.py)
+serialize_customer = compile_serializer(customer_model)
+serialize_address = compile_serializer(address_model)
+
 # query string arguments
 customer_args = reqparse.RequestParser()
 customer_args.add_argument('first_name', type=str, required=False, help='List Customers by first name')
 customer_args.add_argument('last_name', type=str, required=False, help='List Customers by last name')
 customer_args.add_argument('userid', type=str, required=False, help='List Customers by user id')
+customer_args.add_argument('limit', type=inputs.positive, required=False, help='Maximum number of Customers per page')
+customer_args.add_argument('cursor', type=str, required=False, help='Opaque cursor taken from the Link header of the previous page')
 #customer_args.add_argument('active', type=inputs.boolean, required=False, help='List Customers by active status')
 
 ######################################################################
@@ -121,8 +207,9 @@ class CustomerResource(Resource):
     # RETRIEVE A CUSTOMER
     #------------------------------------------------------------------
     @api.doc('get_customers')
+    @api.response(200, 'Success', customer_model)
+    @api.response(304, 'Customer not modified since the ETag in If-None-Match')
     @api.response(404, 'Customer not found')
-    @api.marshal_with(customer_model)
     def get(self, customer_id):
         """
         Retrieve a single customer
@@ -130,12 +217,28 @@ class CustomerResource(Resource):
         This endpoint will return a Customer based on it's id
         """
         app.logger.info("Request for customer with id: %s", customer_id)
-        customer = Customer.find(customer_id)
-        if not customer:
-            abort(status.HTTP_404_NOT_FOUND, "Customer with id '{}' was not found.".format(customer_id))
+        cached = customer_cache.get(cache_key(customer_id))
+        if cached is not None:
+            version, body = cached
+        else:
+            customer = Customer.find(customer_id)
+            if not customer:
+                abort(status.HTTP_404_NOT_FOUND, "Customer with id '{}' was not found.".format(customer_id))
+            version, body = customer.version, None
+
+        # decide on 304 before the Customer and its addresses are serialized
+        etag = customer_etag(customer_id, version)
+        if request.if_none_match.contains_weak(etag):
+            app.logger.info("Customer with id %s not modified", customer_id)
+            return '', status.HTTP_304_NOT_MODIFIED, {'ETag': quote_etag(etag)}
 
-        app.logger.info("Returning customer: %s", customer.first_name)
-        return customer.serialize(), status.HTTP_200_OK
+        response = json_response(
+            body if body is not None else serialize_customer(customer), status.HTTP_200_OK, {'ETag': quote_etag(etag)}
+        )
+        if body is None:
+            customer_cache.set(cache_key(customer_id), (version, response.get_data()))
+        app.logger.info("Returning customer with id %s", customer_id)
+        return response
     
     #------------------------------------------------------------------
     # UPDATE AN EXISTING Customer
@@ -143,8 +246,9 @@ class CustomerResource(Resource):
     @api.doc('update_customers')
     @api.response(404, 'Customer not found')
     @api.response(400, 'The posted Customer data was not valid')
+    @api.response(412, 'The Customer has changed since the ETag in If-Match')
+    @api.response(200, 'Customer updated', customer_model)
     @api.expect(customer_model)
-    @api.marshal_with(customer_model)
     def put(self, customer_id):
         """
         Update a Customer
@@ -152,17 +256,20 @@ class CustomerResource(Resource):
         """
         app.logger.info("Requesting to update a customer")
         customer = Customer.find(customer_id)
-        # if not customer:
-        #     abort(status.HTTP_404_NOT_FOUND, "Customer with id '{}' was not found.".format(customer_id))
+        if not customer:
+            abort(status.HTTP_404_NOT_FOUND, "Customer with id '{}' was not found.".format(customer_id))
+        check_if_match(customer_id, customer.version)
         
         app.logger.debug('Payload = %s', api.payload)
         data = api.payload
         customer.deserialize(data)
-        customer.id = customer_id
         customer.update()
+        customer_cache.invalidate(cache_key(customer_id))
         app.logger.info("Updated customer with id %s", customer.id)
         
-        return customer.serialize(), status.HTTP_200_OK
+        body = serialize_customer(customer)
+        etag = customer_etag(customer_id, customer.version)
+        return json_response(body, status.HTTP_200_OK, {'ETag': quote_etag(etag)})
     
     #------------------------------------------------------------------
     # DELETE A CUSTOMER
@@ -176,14 +283,11 @@ class CustomerResource(Resource):
         This endpoint will delete a Customer based the id specified in the path
         """
         app.logger.info("Request to delete customer with id: %s", customer_id)
-        customer = Customer.find(customer_id)
-        if customer:
-            for addr in customer.addresses:
-                address_id = addr.id
-                address = Address.find(address_id)
-                if address:
-                    address.delete()
-            customer.delete()
+        key = cache_key(customer_id)
+        if isinstance(key, int):
+            # one statement: the database deletes the addresses with the customer
+            Customer.delete_by_ids([key])
+        customer_cache.invalidate(key)
 
         app.logger.info("Customer with ID [%s] delete complete.", customer_id)
         return '', status.HTTP_204_NO_CONTENT
@@ -199,12 +303,13 @@ class CustomerCollection(Resource):
     #------------------------------------------------------------------
     @api.doc('list_customers')
     @api.expect(customer_args, validate=True)
-    @api.marshal_list_with(customer_model)
+    @api.response(200, 'Success', [customer_model])
     def get(self):
         """Returns all of the customer"""
         app.logger.info("Request for Customer list")
         customers = []
         args = customer_args.parse_args()
+        paginate = args['limit'] is not None or args['cursor'] is not None
         if args['first_name']:
             app.logger.info('Filtering by first name: %s', args['first_name'])
             customers = Customer.find_by_first_name(args['first_name'])
@@ -214,13 +319,26 @@ class CustomerCollection(Resource):
         elif args['userid']:
             app.logger.info('Filtering by userid: %s', args['userid'])
             customers = Customer.find_by_userid(args['userid'])
+        elif paginate:
+            app.logger.info('Returning unfiltered page.')
+            customers = None
         else:
             app.logger.info('Returning unfiltered list.')
             customers = Customer.all()
 
+        headers = {}
+        if paginate:
+            limit = min(args['limit'] or app.config['DEFAULT_PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+            after_id = decode_cursor(args['cursor'])
+            # fetch one extra row so we know whether there is a next page
+            customers = Customer.find_page(customers, limit + 1, after_id)
+            if len(customers) > limit:
+                customers = customers[:limit]
+                headers['Link'] = next_page_link(args, limit, customers[-1].id)
+
         #app.logger.info('[%s] Customers returned', len(customers))
-        results = [customer.serialize() for customer in customers]
-        return results, status.HTTP_200_OK
+        results = [serialize_customer(customer) for customer in customers]
+        return json_response(results, status.HTTP_200_OK, headers)
     
     #------------------------------------------------------------------
     # ADD A NEW CUSTOMER
@@ -228,8 +346,8 @@ class CustomerCollection(Resource):
     @api.doc('create_customers')
     @api.response(415, 'The posted data has unsupported media type')
     @api.response(400, 'The posted data was not valid')
+    @api.response(201, 'Customer created', customer_model)
     @api.expect(create_model)
-    @api.marshal_with(customer_model, code=201)
     def post(self):
         """
         Creates a Customer
@@ -242,8 +360,148 @@ class CustomerCollection(Resource):
         customer.create()
         app.logger.info("Customer with ID [%s] created.", customer.id)
         location_url = api.url_for(CustomerResource, customer_id=customer.id, _external=True)
-        return customer.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
+        return json_response(serialize_customer(customer), status.HTTP_201_CREATED, {"Location": location_url})
+
+    #------------------------------------------------------------------
+    # DELETE MANY CUSTOMERS
+    #------------------------------------------------------------------
+    @api.doc('delete_many_customers', params={'ids': 'Comma separated ids of the Customers to delete'})
+    @api.response(204, 'Customers deleted')
+    @api.response(400, 'The ids were missing or not integers')
+    @api.response(413, 'Too many ids in one request')
+    def delete(self):
+        """
+        Delete many Customers
+        This endpoint will delete every Customer in the ids query argument with its addresses
+        """
+        app.logger.info("Request to delete many customers")
+        ids = parse_ids(request.args.getlist('ids'))
+        if len(ids) > app.config['MAX_BATCH_SIZE']:
+            abort(
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                "A request can delete at most {} Customers.".format(app.config['MAX_BATCH_SIZE'])
+            )
+        count = Customer.delete_by_ids(ids)
+        for customer_id in ids:
+            customer_cache.invalidate(customer_id)
+        app.logger.info("Deleted %s customers", count)
+        return '', status.HTTP_204_NO_CONTENT
     
+######################################################################
+#  PATH: /customers/batch
+######################################################################
+@api.route('/customers/batch')
+class CustomerBatch(Resource):
+    """ Handles creating many Customers in one request """
+    #------------------------------------------------------------------
+    # ADD MANY NEW CUSTOMERS
+    #------------------------------------------------------------------
+    @api.doc('create_customers_batch', params={'chunk_size': 'Customers inserted per transaction'})
+    @api.response(207, 'Some of the Customers were not created', [batch_result_model])
+    @api.response(400, 'The posted data was not an array of Customers')
+    @api.response(413, 'Too many Customers in one batch')
+    @api.expect([create_model])
+    @api.marshal_list_with(batch_result_model, code=201)
+    def post(self):
+        """
+        Creates many Customers
+        This endpoint will create every Customer in the posted array and report on each one
+        """
+        app.logger.info("Request to create a batch of customers")
+        documents = api.payload
+        if not isinstance(documents, list):
+            raise DataValidationError("Invalid batch: body of request must be an array of Customers")
+        if len(documents) > app.config['MAX_BATCH_SIZE']:
+            abort(
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                "A batch can hold at most {} Customers.".format(app.config['MAX_BATCH_SIZE'])
+            )
+        try:
+            chunk_size = int(request.args.get('chunk_size', app.config['BATCH_CHUNK_SIZE']))
+        except ValueError:
+            chunk_size = 0
+        if chunk_size < 1:
+            raise DataValidationError("Invalid chunk_size: must be a positive integer")
+
+        results = []
+        for index, outcome in enumerate(Customer.create_batch(documents, chunk_size)):
+            if isinstance(outcome, DataValidationError):
+                code = status.HTTP_409_CONFLICT if isinstance(outcome, UseridConflictError) \
+                    else status.HTTP_400_BAD_REQUEST
+                results.append({'index': index, 'status': code, 'error': str(outcome)})
+            else:
+                location_url = api.url_for(CustomerResource, customer_id=outcome, _external=True)
+                results.append({
+                    'index': index, 'status': status.HTTP_201_CREATED, 'id': outcome, 'location': location_url
+                })
+        created = sum(1 for result in results if result['status'] == status.HTTP_201_CREATED)
+        app.logger.info("Created %s of %s customers in batch", created, len(results))
+        if created == len(results):
+            return results, status.HTTP_201_CREATED
+        return results, status.HTTP_207_MULTI_STATUS
+
+######################################################################
+#  PATH: /customers/activate
+######################################################################
+@api.route('/customers/activate')
+class BulkActivateResource(Resource):
+    """ Activates many Customers with one statement """
+    @api.doc('activate_customers')
+    @api.response(400, 'No ids or filter were given')
+    @api.expect(bulk_active_model)
+    @api.marshal_with(bulk_active_result_model)
+    def put(self):
+        """
+        Activate many Customers
+        This endpoint will activate every Customer matching the ids or filter in the body
+        """
+        app.logger.info("Request to activate many customers")
+        return bulk_set_active(api.payload, True), status.HTTP_200_OK
+
+######################################################################
+#  PATH: /customers/deactivate
+######################################################################
+@api.route('/customers/deactivate')
+class BulkDeactivateResource(Resource):
+    """ Deactivates many Customers with one statement """
+    @api.doc('deactivate_customers')
+    @api.response(400, 'No ids or filter were given')
+    @api.expect(bulk_active_model)
+    @api.marshal_with(bulk_active_result_model)
+    def put(self):
+        """
+        Deactivate many Customers
+        This endpoint will deactivate every Customer matching the ids or filter in the body
+        """
+        app.logger.info("Request to deactivate many customers")
+        return bulk_set_active(api.payload, False), status.HTTP_200_OK
+
+######################################################################
+#  PATH: /customers/export
+######################################################################
+@api.route('/customers/export')
+class CustomerExport(Resource):
+    """ Streams the whole Customer collection """
+    #------------------------------------------------------------------
+    # EXPORT ALL CUSTOMERS
+    #------------------------------------------------------------------
+    @api.doc('export_customers')
+    @api.produces(['application/x-ndjson'])
+    @api.response(200, 'One Customer document per line')
+    def get(self):
+        """
+        Export all Customers
+        This endpoint streams every Customer with its addresses as newline-delimited JSON
+        """
+        app.logger.info("Request to export all customers")
+        chunk_size = app.config['EXPORT_CHUNK_SIZE']
+
+        def generate():
+            for customer in Customer.stream_all(chunk_size):
+                yield dumps(serialize_customer(customer)) + b"\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
 ######################################################################
 #  PATH: /customers/{id}/activate
 ######################################################################
@@ -251,7 +509,9 @@ class CustomerCollection(Resource):
 @api.param('customer_id', 'The Customer identifier')
 class ActivateResource(Resource):
     @api.doc('activate_customer')
+    @api.response(200, 'Customer activated', customer_model)
     @api.response(404, 'Customer not found')
+    @api.header('Prefer', 'return=minimal to receive only the id and active flag')
     def put(self, customer_id):
         """
         Activate an existing Customer
@@ -259,14 +519,7 @@ class ActivateResource(Resource):
         """
 
         app.logger.info("Requesting to update a customer")
-        customer = Customer.find(customer_id)
-        if not customer:
-            abort(status.HTTP_404_NOT_FOUND, "Customer with id '{}' was not found.".format(customer_id))
-        customer.active = True
-        customer.update()
-        app.logger.info("Updated customer with id %s", customer.id)
-        
-        return customer.serialize(), status.HTTP_200_OK
+        return set_customer_active(customer_id, True)
 ######################################################################
 #  PATH: /customers/{id}/deactivate
 ######################################################################
@@ -274,7 +527,9 @@ class ActivateResource(Resource):
 @api.param('customer_id', 'The Customer identifier')
 class DeactivateResource(Resource):
     @api.doc('deactivate_customer')
+    @api.response(200, 'Customer deactivated', customer_model)
     @api.response(404, 'Customer not found')
+    @api.header('Prefer', 'return=minimal to receive only the id and active flag')
     def put(self, customer_id):
         """
         Dectivate an existing Customer
@@ -282,14 +537,7 @@ class DeactivateResource(Resource):
         """
 
         app.logger.info("Requesting to update a customer")
-        customer = Customer.find(customer_id)
-        if not customer:
-            abort(status.HTTP_404_NOT_FOUND, "Customer with id '{}' was not found.".format(customer_id))
-        customer.active = False
-        customer.update()
-        app.logger.info("Updated customer with id %s", customer.id)
-        
-        return customer.serialize(), status.HTTP_200_OK
+        return set_customer_active(customer_id, False)
 
 
 ######################################################################
@@ -310,8 +558,8 @@ class AddressResource(Resource):
     # RETRIEVE AN ADDRESS
     #------------------------------------------------------------------
     @api.doc('get_addresses')
+    @api.response(200, 'Success', address_model)
     @api.response(404, 'Address not found')
-    @api.marshal_with(address_model)
     def get(self, customer_id, address_id):
         """
         Retrieve a single customer's addresses
@@ -326,7 +574,7 @@ class AddressResource(Resource):
 
         app.logger.info("Request to get an address with id: %s", address_id)
         address = Address.find_or_404(address_id)
-        return address.serialize(), status.HTTP_200_OK
+        return json_response(serialize_address(address), status.HTTP_200_OK)
     
     #------------------------------------------------------------------
     # UPDATE AN EXISTING Customer
@@ -334,8 +582,9 @@ class AddressResource(Resource):
     @api.doc('update_addresses')
     @api.response(404, 'Address not found')
     @api.response(400, 'The posted Address data was not valid')
+    @api.response(412, 'The Customer has changed since the ETag in If-Match')
+    @api.response(200, 'Address updated', address_model)
     @api.expect(address_model)
-    @api.marshal_with(address_model)
     def put(self, customer_id, address_id):
         """
         Update an Address
@@ -345,17 +594,18 @@ class AddressResource(Resource):
         customer = Customer.find(customer_id)
         if not customer:
             abort(status.HTTP_404_NOT_FOUND, "Customer with id '{}' was not found.".format(customer_id))
+        check_if_match(customer_id, customer.version)
 
         app.logger.info("Request to update address with id: %s", address_id)
         address = Address.find_or_404(address_id)
         app.logger.debug('Payload = %s', api.payload)
         data = api.payload
         address.deserialize(data)
-        address.id = address_id
         address.update()
+        invalidate_addresses_of(customer_id, address)
         app.logger.info("Updated address with id %s", address.id)
         
-        return address.serialize(), status.HTTP_200_OK
+        return json_response(serialize_address(address), status.HTTP_200_OK)
     
     #------------------------------------------------------------------
     # DELETE A CUSTOMER
@@ -376,6 +626,7 @@ class AddressResource(Resource):
         address = Address.find(address_id)
         if address:
             address.delete()
+        invalidate_addresses_of(customer_id, address)
         return make_response("", status.HTTP_204_NO_CONTENT)
 
 ######################################################################
@@ -388,13 +639,19 @@ class AddressCollection(Resource):
     # LIST ALL CUSTOMERS
     #------------------------------------------------------------------
     @api.doc('list_addresses')
-    @api.marshal_list_with(address_model)
+    @api.response(200, 'Success', [address_model])
+    @api.response(304, 'Addresses not modified since the ETag in If-None-Match')
+    @api.response(404, 'Customer not found')
     def get(self, customer_id):
         """ Returns all of the Addresses for a customer """
         app.logger.info("Request for Customer Addresses...")
         customer = Customer.find_or_404(customer_id)
-        results = [address.serialize() for address in customer.addresses]
-        return results, status.HTTP_200_OK
+        etag = customer_etag(customer_id, customer.version)
+        if request.if_none_match.contains_weak(etag):
+            app.logger.info("Addresses of customer with id %s not modified", customer_id)
+            return '', status.HTTP_304_NOT_MODIFIED, {'ETag': quote_etag(etag)}
+        results = [serialize_address(address) for address in customer.addresses]
+        return json_response(results, status.HTTP_200_OK, {'ETag': quote_etag(etag)})
     
     #------------------------------------------------------------------
     # ADD A NEW CUSTOMER
@@ -402,8 +659,8 @@ class AddressCollection(Resource):
     @api.doc('create_addresses')
     @api.response(415, 'The posted data has unsupported media type')
     @api.response(400, 'The posted data was not valid')
+    @api.response(201, 'Address created', address_model)
     @api.expect(create_addr_model)
-    @api.marshal_with(address_model, code=201)
     def post(self, customer_id):
         """
         Create an Address on a Customer
@@ -416,8 +673,8 @@ class AddressCollection(Resource):
         address.deserialize(api.payload)
         customer.addresses.append(address)
         customer.update()
-        message = address.serialize()
-        return address.serialize(), status.HTTP_201_CREATED
+        customer_cache.invalidate(cache_key(customer_id))
+        return json_response(serialize_address(address), status.HTTP_201_CREATED)
 
 # ######################################################################
 # # LIST ALL CUSTOMERS
@@ -662,10 +919,136 @@ class AddressCollection(Resource):
 ######################################################################
 
 def init_db():
-    """ Initializes the SQLAlchemy app """
+    """ Initializes the SQLAlchemy app and creates or upgrades the tables """
     global app
     Customer.init_db(app)
 
+def cache_key(customer_id):
+    """ Returns the customer cache key for a Customer id taken from a URL """
+    try:
+        return int(customer_id)
+    except (TypeError, ValueError):
+        return customer_id
+
+def customer_etag(customer_id, version):
+    """ Returns the (unquoted) strong ETag of a Customer version """
+    return "{}-{}".format(cache_key(customer_id), version)
+
+def check_if_match(customer_id, version):
+    """
+    Aborts with 412 when the If-Match header of the request names another
+    version of a Customer
+
+    A weak ETag matches too: it only differs from the strong one because
+    the response it came with was compressed.
+    """
+    if request.if_match and not request.if_match.contains_weak(customer_etag(customer_id, version)):
+        abort(
+            status.HTTP_412_PRECONDITION_FAILED,
+            "Customer with id '{}' has changed since the ETag in If-Match.".format(customer_id)
+        )
+
+def invalidate_addresses_of(customer_id, address):
+    """ Drops the cached Customer whose addresses have changed """
+    customer_cache.invalidate(cache_key(customer_id))
+    if address is not None and address.customer_id is not None:
+        customer_cache.invalidate(address.customer_id)
+
+def set_customer_active(customer_id, active):
+    """
+    Sets the active flag of one Customer with a single UPDATE and returns
+    the Customer, or only its id and flag when the request prefers a
+    minimal response
+    """
+    key = cache_key(customer_id)
+    row = Customer.set_active(key, active) if isinstance(key, int) else None
+    if row is None:
+        abort(status.HTTP_404_NOT_FOUND, "Customer with id '{}' was not found.".format(customer_id))
+    customer_cache.invalidate(key)
+    app.logger.info("Set active to %s on customer with id %s", active, key)
+    headers = {'ETag': quote_etag(customer_etag(key, row.version))}
+    if prefers_minimal(request.headers.get('Prefer')):
+        headers['Preference-Applied'] = 'return=minimal'
+        return json_response({'id': row.id, 'active': row.active}, status.HTTP_200_OK, headers)
+    customer = Customer.base_query().filter(Customer.id == key).first()
+    if customer is None:
+        abort(status.HTTP_404_NOT_FOUND, "Customer with id '{}' was not found.".format(customer_id))
+    return json_response(serialize_customer(customer), status.HTTP_200_OK, headers)
+
+def prefers_minimal(prefer):
+    """ Returns True when a Prefer header asks for return=minimal """
+    if not prefer:
+        return False
+    return any(
+        preference.split(';')[0].strip().lower().replace(' ', '') == 'return=minimal'
+        for preference in prefer.split(',')
+    )
+
+def bulk_set_active(data, active):
+    """ Sets the active flag of the Customers selected by a bulk request body """
+    criteria, ids = bulk_criteria(data)
+    count, changed_ids = Customer.set_active_where(criteria, active, bool(data.get('return_ids')))
+    if ids is not None:
+        for customer_id in ids:
+            customer_cache.invalidate(customer_id)
+    else:
+        customer_cache.clear()
+    app.logger.info("Set active to %s on %s customers", active, count)
+    return {'count': count, 'ids': changed_ids}
+
+def bulk_criteria(data):
+    """ Returns the SQL criteria and the ids (if given) of a bulk request body """
+    if not isinstance(data, dict):
+        raise DataValidationError("Invalid request: body of request contained bad or no data")
+    selectors = [name for name in ('ids', 'first_name', 'last_name', 'userid') if data.get(name) is not None]
+    if len(selectors) != 1:
+        raise DataValidationError("Invalid request: give exactly one of ids, first_name, last_name or userid")
+    ids = data.get('ids')
+    if ids is not None and (
+            not isinstance(ids, list) or not all(isinstance(id, int) and not isinstance(id, bool) for id in ids)):
+        raise DataValidationError("Invalid request: ids must be a list of integers")
+    for name in ('first_name', 'last_name', 'userid'):
+        if data.get(name) is not None and not isinstance(data[name], str):
+            raise DataValidationError("Invalid type for string [{}]".format(name))
+    criteria = Customer.filter_criteria(
+        ids=ids, first_name=data.get('first_name'), last_name=data.get('last_name'), userid=data.get('userid')
+    )
+    return criteria, ids
+
+def parse_ids(values):
+    """ Returns the Customer ids in query arguments such as ids=1,2,3 (repeated or not) """
+    try:
+        ids = [int(value) for text in values for value in text.split(',') if value.strip()]
+    except ValueError:
+        raise DataValidationError("Invalid request: ids must be a comma separated list of integers")
+    if not ids:
+        raise DataValidationError("Invalid request: give the ids of the Customers to delete")
+    return ids
+
+def encode_cursor(last_id):
+    """ Encodes the id of the last Customer on a page as an opaque cursor """
+    return base64.urlsafe_b64encode("id:{}".format(last_id).encode()).decode()
+
+def decode_cursor(cursor):
+    """ Decodes a cursor back into the id to continue after """
+    if not cursor:
+        return None
+    try:
+        prefix, last_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(":", 1)
+        if prefix != "id":
+            raise ValueError(prefix)
+        return int(last_id)
+    except (binascii.Error, UnicodeError, ValueError) as error:
+        raise DataValidationError("Invalid cursor: " + cursor) from error
+
+def next_page_link(args, limit, last_id):
+    """ Builds the Link header that points to the next page of Customers """
+    params = {name: args[name] for name in ('first_name', 'last_name', 'userid') if args[name]}
+    url = api.url_for(
+        CustomerCollection, limit=limit, cursor=encode_cursor(last_id), _external=True, **params
+    )
+    return '<{}>; rel="next"'.format(url)
+
 # def check_content_type(media_type):
 #     """Checks that the media type is correct"""
 #     content_type = request.headers.get("Content-Type")
@@ -0,0 +1,103 @@
+"""
+Compiled Serializers
+
+Builds, once at import, a serializer function for a flask-restx model that
+reads the fields of the model straight from a database object and returns
+the document the model describes. Responses made with it are encoded to
+JSON once, instead of being built by serialize(), walked again field by
+field by marshal_with() and only then encoded by the JSON library from
+service/json_provider.py.
+
+The serializers follow the formatting rules of flask-restx for the field
+types used by the API models (String, Integer, Float, Boolean, Nested and
+List), so the documents are the same as marshal() makes and the Swagger
+docs generated from the models stay accurate. Fields of any other type,
+and fields with a default, are formatted by the field itself.
+"""
+from flask import Response
+from flask_restx import fields, inputs
+from service import json_provider
+
+# flask-restx field types and the functions they format values with
+FORMATTERS = {
+    fields.String: "str",
+    fields.Integer: "int",
+    fields.Float: "float",
+    fields.Boolean: "boolean",
+}
+JSON_MIMETYPE = "application/json"
+
+
+def compile_serializer(model):
+    """
+    Returns a function that turns an object into the document of a model
+
+    Args:
+        model: a flask-restx model (or a dictionary of fields)
+
+    Returns:
+        a function that is called with an object whose attributes hold the
+        values of the fields and returns a dictionary
+    """
+    namespace = {"boolean": inputs.boolean}
+    body = []
+    items = []
+    for index, (key, field) in enumerate(getattr(model, "resolved", model).items()):
+        if isinstance(field, type):
+            field = field()
+        attribute = field.attribute or key
+        name = "value{}".format(index)
+        if not isinstance(attribute, str) or not attribute.isidentifier() or field.default is not None:
+            namespace["field{}".format(index)] = field
+            body.append("    {} = field{}.output({!r}, obj)".format(name, index, key))
+        else:
+            body.append("    {} = obj.{}".format(name, attribute))
+            body.append("    if {0} is not None:".format(name))
+            body.append("        {0} = {1}".format(name, _format(field, name, index, key, namespace)))
+            if isinstance(field, fields.Nested):
+                # marshal() makes a document of nulls for a missing nested object
+                namespace["field{}".format(index)] = field
+                body.append("    else:")
+                body.append("        {} = field{}.output({!r}, obj)".format(name, index, key))
+        items.append("        {!r}: {},".format(key, name))
+
+    source = "\n".join(["def serialize(obj):"] + body + ["    return {"] + items + ["    }"])
+    exec(compile(source, "<serializer {}>".format(getattr(model, "name", "model")), "exec"), namespace)  # pylint: disable=exec-used
+    serialize = namespace["serialize"]
+    serialize.__doc__ = " Serializes an object into a {} document ".format(getattr(model, "name", "model"))
+    return serialize
+
+
+def dumps(document):
+    """ Encodes a document as JSON bytes with the configured JSON library """
+    return json_provider.dumps(document)
+
+
+def json_response(body, code, headers=None):
+    """ Returns a response whose body is a document or already encoded JSON bytes """
+    if not isinstance(body, bytes):
+        body = dumps(body)
+    return Response(body, status=code, headers=headers, mimetype=JSON_MIMETYPE)
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def _format(field, name, index, key, namespace):
+    """ Returns the expression that formats the value in variable name for field """
+    if type(field) in FORMATTERS:
+        return "{}({})".format(FORMATTERS[type(field)], name)
+    if type(field) is fields.Raw:
+        return name
+    if isinstance(field, fields.Nested):
+        namespace["nested{}".format(index)] = compile_serializer(field.nested)
+        return "nested{}({})".format(index, name)
+    if isinstance(field, fields.List) and isinstance(field.container, fields.Nested):
+        namespace["nested{}".format(index)] = compile_serializer(field.container.nested)
+        return "[nested{}(item) for item in {}]".format(index, name)
+    if isinstance(field, fields.List) and type(field.container) in FORMATTERS:
+        return "[None if item is None else {}(item) for item in {}]".format(
+            FORMATTERS[type(field.container)], name
+        )
+    namespace["field{}".format(index)] = field
+    return "field{}.output({!r}, obj)".format(index, key)
@@ -0,0 +1,74 @@
+"""
+Test cases for the Benchmark Utilities
+
+"""
+import os
+import tempfile
+import unittest
+from benchmarks.bench_boot import check_budget, measure_import, timings
+from benchmarks.common import compare, parse_count, percentile, summarize
+
+
+######################################################################
+#  B E N C H M A R K   U T I L I T Y   T E S T   C A S E S
+######################################################################
+class TestBenchmarkUtilities(unittest.TestCase):
+    """ Test Cases for benchmark statistics and baseline comparison """
+
+    def test_parse_count(self):
+        """ Parse dataset sizes with k and m suffixes """
+        self.assertEqual(parse_count("500"), 500)
+        self.assertEqual(parse_count("10k"), 10000)
+        self.assertEqual(parse_count("1.5M"), 1500000)
+
+    def test_percentile(self):
+        """ Take nearest rank percentiles """
+        ordered = list(range(1, 101))
+        self.assertEqual(percentile(ordered, 0.50), 50)
+        self.assertEqual(percentile(ordered, 0.95), 95)
+        self.assertEqual(percentile(ordered, 0.99), 99)
+        self.assertEqual(percentile([7], 0.99), 7)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+    def test_summarize(self):
+        """ Summarize latencies in milliseconds and throughput per second """
+        stats = summarize([0.001] * 99 + [0.1], 2.0, errors=3)
+        self.assertEqual(stats["count"], 100)
+        self.assertEqual(stats["errors"], 3)
+        self.assertEqual(stats["throughput_rps"], 50.0)
+        self.assertEqual(stats["p50_ms"], 1.0)
+        self.assertEqual(stats["p99_ms"], 1.0)
+        self.assertEqual(stats["max_ms"], 100.0)
+
+    def test_compare(self):
+        """ Flag metrics that got worse by more than the threshold """
+        baseline = {"client": {"read": {"p95_ms": 10.0, "throughput_rps": 100.0, "max_ms": 10.0, "count": 5}}}
+        results = {"client": {
+            "read": {"p95_ms": 10.5, "throughput_rps": 80.0, "max_ms": 90.0, "count": 50},
+            "new_route": {"p95_ms": 1000.0},
+        }}
+        regressions = compare(results, baseline, threshold=0.10)
+        self.assertEqual(len(regressions), 1)
+        path, metric, old, new, change = regressions[0]
+        self.assertEqual((path, metric, old, new), ("client/read", "throughput_rps", 100.0, 80.0))
+        self.assertAlmostEqual(change, -0.2)
+        self.assertEqual(compare(results, baseline, threshold=0.25), [])
+
+    def test_boot_budget(self):
+        """ Fail the boot budget on slow imports and on any SQL statement """
+        results = {"import": dict(timings([0.2, 0.3, 0.4]), statements=0)}
+        self.assertEqual(results["import"]["p50_ms"], 300.0)
+        self.assertEqual(check_budget(results, 500), [])
+        self.assertEqual(check_budget(results, 0), [])
+        self.assertEqual(len(check_budget(results, 250)), 1)
+        results["import"]["statements"] = 3
+        self.assertEqual(len(check_budget(results, 500)), 1)
+
+    def test_import_runs_no_sql(self):
+        """ Import the service without sending anything to the database """
+        with tempfile.TemporaryDirectory() as folder:
+            database_uri = "sqlite:///{}".format(os.path.join(folder, "boot.db"))
+            times, statements = measure_import(database_uri, 1)
+            self.assertEqual(len(times), 1)
+            self.assertEqual(statements, [])
+            self.assertFalse(os.path.exists(os.path.join(folder, "boot.db")))
@@ -0,0 +1,102 @@
+"""
+Test cases for the Gunicorn Configuration
+
+"""
+import gc
+import os
+import runpy
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+
+
+def load_config(**env):
+    """ Evaluates gunicorn.conf.py in an environment and returns its settings """
+    env.setdefault("GUNICORN_WORKERS", "1")
+    with patch.dict(os.environ, env):
+        for name in ("GUNICORN_WORKER_CLASS", "GUNICORN_THREADS", "WEB_CONCURRENCY", "PORT"):
+            if name not in env:
+                os.environ.pop(name, None)
+        try:
+            return runpy.run_path(CONFIG_PATH)
+        finally:
+            gc.enable()
+
+
+######################################################################
+#  G U N I C O R N   C O N F I G U R A T I O N   T E S T   C A S E S
+######################################################################
+class TestGunicornConf(unittest.TestCase):
+    """ Test Cases for the production gunicorn settings and server hooks """
+
+    def test_defaults(self):
+        """ Preload sync workers on port 8000 """
+        config = load_config()
+        self.assertEqual(config["worker_class"], "sync")
+        self.assertEqual(config["workers"], 1)
+        self.assertEqual(config["threads"], 1)
+        self.assertEqual(config["bind"], "0.0.0.0:8000")
+        self.assertEqual(config["timeout"], 30)
+        self.assertEqual(config["graceful_timeout"], 30)
+        self.assertTrue(config["preload_app"])
+        self.assertTrue(gc.isenabled())
+
+    def test_settings_from_environment(self):
+        """ Read the worker class, counts and timeouts from the environment """
+        config = load_config(
+            GUNICORN_WORKERS="", WEB_CONCURRENCY="3", GUNICORN_WORKER_CLASS="gthread",
+            GUNICORN_TIMEOUT="60", GUNICORN_MAX_REQUESTS="1000", GUNICORN_PRELOAD="false", PORT="5000",
+        )
+        self.assertEqual(config["workers"], 3)
+        self.assertEqual(config["threads"], 4)
+        self.assertEqual(config["timeout"], 60)
+        self.assertEqual(config["graceful_timeout"], 60)
+        self.assertEqual(config["max_requests_jitter"], 100)
+        self.assertFalse(config["preload_app"])
+        self.assertEqual(config["bind"], "0.0.0.0:5000")
+
+    def test_workers_from_cpus(self):
+        """ Derive the workers from the CPUs allowed by the container quota """
+        config = load_config()
+        self.assertEqual(config["default_workers"]("sync", 4), 9)
+        self.assertEqual(config["default_workers"]("gthread", 4), 5)
+        with tempfile.TemporaryDirectory() as root:
+            self.assertIsNone(config["cgroup_cpu_quota"](root))
+            with open(os.path.join(root, "cpu.max"), "w") as cpu_max:
+                cpu_max.write("max 100000\n")
+            self.assertIsNone(config["cgroup_cpu_quota"](root))
+            with open(os.path.join(root, "cpu.max"), "w") as cpu_max:
+                cpu_max.write("150000 100000\n")
+            self.assertEqual(config["cgroup_cpu_quota"](root), 1.5)
+            self.assertEqual(config["cpu_count"](root), min(2, len(os.sched_getaffinity(0))))
+        with tempfile.TemporaryDirectory() as root:
+            os.mkdir(os.path.join(root, "cpu"))
+            for name, value in (("cpu.cfs_quota_us", "50000"), ("cpu.cfs_period_us", "100000")):
+                with open(os.path.join(root, "cpu", name), "w") as cgroup_file:
+                    cgroup_file.write(value)
+            self.assertEqual(config["cgroup_cpu_quota"](root), 0.5)
+            self.assertEqual(config["cpu_count"](root), 1)
+
+    def test_post_fork_disposes_engine(self):
+        """ Give every worker its own database connections """
+        from service.models import db
+        config = load_config()
+        server = MagicMock()
+        server.cfg.worker_class_str = "sync"
+        with patch("service.pool.dispose_after_fork") as dispose:
+            config["post_fork"](server, MagicMock())
+        dispose.assert_called_once_with(db.engine)
+
+    def test_child_exit_marks_process_dead(self):
+        """ Drop the live metrics of a worker that exited """
+        config = load_config()
+        worker = MagicMock(pid=4242)
+        with patch("prometheus_client.multiprocess.mark_process_dead") as mark_process_dead:
+            with patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": tempfile.gettempdir()}):
+                config["child_exit"](MagicMock(), worker)
+            mark_process_dead.assert_called_once_with(4242)
+            with patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": ""}):
+                config["child_exit"](MagicMock(), worker)
+            mark_process_dead.assert_called_once_with(4242)
@@ -0,0 +1,154 @@
+"""
+Test cases for the Queue-based Logging
+
+"""
+import io
+import logging
+import unittest
+from flask import Flask
+from service import log_handlers
+from service.log_handlers import BatchingQueueListener, BoundedQueueHandler, init_logging, start_logging
+
+
+######################################################################
+#  Q U E U E   L O G G I N G   T E S T   C A S E S
+######################################################################
+class TestLogHandlers(unittest.TestCase):
+    """ Test Cases for logging through a bounded queue and a batching listener """
+
+    def setUp(self):
+        """ This runs before each test """
+        # other test modules turn logging off
+        self.logging_disabled = logging.root.manager.disable
+        logging.disable(logging.NOTSET)
+        self.stream = io.StringIO()
+        self.handler = logging.StreamHandler(self.stream)
+        self.handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        self.logger = logging.getLogger("test.log_handlers")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.service_logger = logging.getLogger("flask.app")
+        self.service_logger_state = (
+            self.service_logger.level, self.service_logger.propagate, list(self.service_logger.handlers)
+        )
+
+    def tearDown(self):
+        """ This runs after each test """
+        log_handlers.stop_logging()
+        log_handlers._listener = None  # pylint: disable=protected-access
+        self.logger.handlers = []
+        level, propagate, handlers = self.service_logger_state
+        self.service_logger.setLevel(level)
+        self.service_logger.propagate = propagate
+        self.service_logger.handlers = handlers
+        logging.disable(self.logging_disabled)
+
+    def _lines(self):
+        """ Returns the lines written to the stream """
+        return self.stream.getvalue().splitlines()
+
+    ######################################################################
+    #  T E S T   C A S E S
+    ######################################################################
+
+    def test_write_in_batches(self):
+        """ Write every queued record in batches and flush on stop """
+        self.logger.handlers = [start_logging([self.handler], queue_size=100, batch_size=10)]
+        for number in range(25):
+            self.logger.info("record %d", number)
+        self.logger.debug("below the level of the logger")
+        log_handlers.stop_logging()
+        self.assertEqual(self._lines(), ["INFO record {}".format(number) for number in range(25)])
+        stats = log_handlers.log_stats()
+        self.assertEqual(stats["written"], 25)
+        self.assertEqual(stats["dropped"], 0)
+        self.assertGreaterEqual(stats["batches"], 3)
+
+    def test_drop_when_full(self):
+        """ Drop records instead of waiting when the queue is full, and report them """
+        listener = BatchingQueueListener([self.handler], queue_size=2)
+        self.logger.handlers = [BoundedQueueHandler(listener)]
+        for number in range(5):
+            self.logger.warning("record %d", number)
+        self.assertEqual(listener.stats()["dropped"], 3)
+        self.assertEqual(listener.stats()["queued"], 2)
+        listener.start()
+        listener.stop()
+        self.assertEqual(self._lines(), [
+            "WARNING record 0",
+            "WARNING record 1",
+            "WARNING Dropped 3 log records because the log queue was full",
+        ])
+
+    def test_prepare_before_queueing(self):
+        """ Interpolate the message and format the exception before the record is queued """
+        listener = BatchingQueueListener([self.handler])
+        self.logger.handlers = [BoundedQueueHandler(listener)]
+        document = {"name": "before"}
+        try:
+            raise ValueError("bad document")
+        except ValueError:
+            self.logger.exception("Could not save %s", document)
+        document["name"] = "after"
+        listener.start()
+        listener.stop()
+        output = self.stream.getvalue()
+        self.assertIn("Could not save {'name': 'before'}", output)
+        self.assertIn("ValueError: bad document", output)
+
+    def test_handler_level(self):
+        """ Only write records at or above the level of each handler """
+        errors = io.StringIO()
+        error_handler = logging.StreamHandler(errors)
+        error_handler.setLevel(logging.ERROR)
+        self.logger.handlers = [start_logging([self.handler, error_handler])]
+        self.logger.info("information")
+        self.logger.error("failure")
+        log_handlers.stop_logging()
+        self.assertEqual(self._lines(), ["INFO information", "ERROR failure"])
+        self.assertEqual(errors.getvalue(), "failure\n")
+
+    def test_restart_after_fork(self):
+        """ Start a new queue and thread in a forked worker """
+        self.logger.handlers = [start_logging([self.handler])]
+        listener = log_handlers._listener  # pylint: disable=protected-access
+        self.logger.info("in the parent")
+        listener._restart_after_fork()  # pylint: disable=protected-access
+        self.logger.info("in the child")
+        log_handlers.stop_logging()
+        self.assertIn("INFO in the child", self._lines())
+
+    def test_init_logging(self):
+        """ Queue the records of the app only when logs are queued and there are handlers """
+        target = logging.getLogger("test.log_handlers.target")
+        target.handlers = [self.handler]
+        target.setLevel(logging.INFO)
+        app = Flask("test_log_handlers")
+        app.config.update(LOG_QUEUE=False, LOG_QUEUE_SIZE=10, LOG_BATCH_SIZE=5)
+        init_logging(app, target.name)
+        self.assertEqual(app.logger.handlers, [self.handler])
+        app.config["LOG_QUEUE"] = True
+        init_logging(app, target.name)
+        self.assertIsInstance(app.logger.handlers[0], BoundedQueueHandler)
+        self.assertEqual(log_handlers.log_stats()["queue_size"], 10)
+        target.handlers = []
+        init_logging(app, target.name)
+        self.assertEqual(app.logger.handlers, [])
+
+    def test_init_logging_service_loggers(self):
+        """ Queue the records of the loggers the service modules use """
+        target = logging.getLogger("test.log_handlers.target")
+        target.handlers = [self.handler]
+        target.setLevel(logging.INFO)
+        app = Flask("test_log_handlers")
+        app.config.update(LOG_QUEUE=True, LOG_QUEUE_SIZE=10, LOG_BATCH_SIZE=5)
+        init_logging(app, target.name)
+        self.assertIsInstance(self.service_logger.handlers[0], BoundedQueueHandler)
+        self.assertFalse(self.service_logger.propagate)
+        logging.getLogger("flask.app").info("from a model")
+        logging.getLogger("flask.app.slow_query").warning("slow query")
+        log_handlers.stop_logging()
+        self.assertIn("from a model", self.stream.getvalue())
+        self.assertIn("slow query", self.stream.getvalue())
+        self.assertGreaterEqual(log_handlers.log_stats()["written"], 2)
+        target.handlers = []
@@ -6,7 +6,8 @@ from ast import Add
 import logging
 import unittest
 import os
-from service.models import Customer, Address, DataValidationError, db
+from unittest.mock import patch
+from service.models import Customer, Address, DataValidationError, UseridConflictError, VersionConflictError, db
 from service import app
 from .factories import CustomerFactory, AddressFactory
 
@@ -70,6 +71,12 @@ class TestCustomerModel(unittest.TestCase):
     #  T E S T   C A S E S
     ######################################################################
 
+    def test_init_db_keeps_connected_app(self):
+        """ Initialize the database without connecting the app to SQLAlchemy again """
+        teardowns = list(app.teardown_appcontext_funcs)
+        Customer.init_db(app)
+        self.assertEqual(app.teardown_appcontext_funcs, teardowns)
+
     def test_create_a_customer(self):
         """Create a customer and assert that it exists"""
         customer = Customer(first_name="allen", last_name="zhang",
@@ -327,6 +334,22 @@ class TestCustomerModel(unittest.TestCase):
         test_customer.delete()
         self.assertEqual(len(test_customer.all()), 0)
 
+    def test_delete_customers_by_ids(self):
+        """Delete Customers and their Addresses with one statement"""
+        customers = []
+        for number in range(3):
+            customer = CustomerFactory(userid="userid{}".format(number))
+            customer.addresses.append(AddressFactory())
+            customer.create()
+            customers.append(customer)
+        ids = [customer.id for customer in customers]
+        db.session.expunge_all()
+        self.assertEqual(Customer.delete_by_ids(ids[:2] + [0]), 2)
+        self.assertEqual([customer.id for customer in Customer.all()], ids[2:])
+        self.assertEqual(len(Address.all()), 1)
+        self.assertEqual(Customer.delete_by_ids(ids[:2]), 0)
+        self.assertEqual(Customer.delete_by_ids([]), 0)
+
     def test_add_customer_address(self):
         """ Create a customer with an address and add it to the database """
         customers = Customer.all()
@@ -387,6 +410,29 @@ class TestCustomerModel(unittest.TestCase):
         address = customer.addresses[0]
         self.assertEqual(address.street, "XX")
 
+    def test_deserialize_merges_addresses(self):
+        """ Reconcile the addresses of a customer with a list by id """
+        customer = CustomerFactory()
+        customer.addresses = [AddressFactory(), AddressFactory()]
+        customer.create()
+        first, second = customer.addresses
+        document = customer.serialize()
+        document["addresses"][0]["city"] = "Springfield"
+        document["addresses"][1] = AddressFactory().serialize()
+        customer.deserialize(document)
+        self.assertEqual(len(customer.addresses), 2)
+        self.assertIs(customer.addresses[0], first)
+        self.assertEqual(first.city, "Springfield")
+        self.assertNotIn(second, customer.addresses)
+        customer.update()
+        self.assertEqual(len(Address.all()), 2)
+        self.assertIsNone(Address.find(second.id))
+
+        # leaving out the addresses leaves them alone
+        del document["addresses"]
+        customer.deserialize(document)
+        self.assertEqual(len(customer.addresses), 2)
+
     def test_delete_customer_address(self):
         """ Delete an customers address """
         customers = Customer.all()
@@ -449,4 +495,117 @@ class TestCustomerModel(unittest.TestCase):
         self.assertEqual(customer.password, "customers2022")
         customer.create()
         customer.userid="allenzhang"
-        self.assertRaises(DataValidationError, customer.update)
\ No newline at end of file
+        self.assertRaises(DataValidationError, customer.update)
+
+    def test_find_by_userid_ignores_case(self):
+        """ Find by userid in any case """
+        customer = CustomerFactory()
+        customer.userid = "MixedCase2022"
+        customer.create()
+
+        same_customer = Customer.find_by_userid("mixedcase2022")[0]
+        self.assertEqual(same_customer.id, customer.id)
+        self.assertEqual(same_customer.userid, "MixedCase2022")
+
+    def test_create_batch_with_refused_row(self):
+        """ Report a row the database refuses, and still create the rest of its chunk """
+        documents = [CustomerFactory().serialize() for _ in range(3)]
+        for number, document in enumerate(documents):
+            document["userid"] = "refused{}".format(number)
+        # the driver cannot bind a list, and refuses the row with a DBAPIError
+        documents[1]["password"] = ["not", "a", "string"]
+        documents[2]["userid"] = 42
+        results = Customer.create_batch(documents, 10)
+        self.assertIsInstance(results[0], int)
+        self.assertIsInstance(results[1], DataValidationError)
+        self.assertNotIsInstance(results[1], UseridConflictError)
+        self.assertIn("refused by the database", str(results[1]))
+        self.assertIn("userid", str(results[2]))
+        self.assertEqual(len(Customer.all()), 1)
+
+    def test_userid_unique_ignoring_case(self):
+        """ Refuse a userid that differs from a taken one only in case """
+        customer = CustomerFactory()
+        customer.userid = "MixedCase2022"
+        customer.create()
+        other = CustomerFactory()
+        other.userid = "mixedcase2022"
+        self.assertRaises(UseridConflictError, other.create)
+        documents = [CustomerFactory().serialize() for _ in range(3)]
+        documents[0]["userid"] = "MIXEDCASE2022"
+        documents[1]["userid"] = "Fresh"
+        documents[2]["userid"] = "fresh"
+        results = Customer.create_batch(documents, 10)
+        self.assertIsInstance(results[0], UseridConflictError)
+        self.assertIsInstance(results[1], int)
+        self.assertIsInstance(results[2], UseridConflictError)
+        self.assertEqual(len(Customer.find_by_userid("mixedcase2022").all()), 1)
+
+    def test_create_batch_with_userid_race(self):
+        """ Create a batch when a userid is taken after the conflict check """
+        customer = CustomerFactory()
+        customer.userid = "taken"
+        customer.create()
+        documents = [CustomerFactory().serialize() for _ in range(3)]
+        documents[0]["userid"] = "free0"
+        documents[1]["userid"] = "taken"
+        documents[2]["userid"] = "free2"
+        with patch.object(Customer, "_existing_userids", return_value=set()):
+            results = Customer.create_batch(documents, 10)
+        self.assertIsInstance(results[0], int)
+        self.assertIsInstance(results[1], UseridConflictError)
+        self.assertIsInstance(results[2], int)
+        self.assertEqual(len(Customer.all()), 3)
+
+    def test_version_tracks_changes(self):
+        """ Bump the version when the customer or its addresses change """
+        customer = CustomerFactory()
+        customer.create()
+        self.assertEqual(customer.version, 1)
+        customer.update()
+        self.assertEqual(Customer.find_version(customer.id), 1)
+        customer.first_name = "versioned"
+        customer.update()
+        self.assertEqual(Customer.find_version(customer.id), 2)
+        customer.addresses.append(AddressFactory(id=None))
+        customer.update()
+        self.assertEqual(Customer.find_version(customer.id), 3)
+        address = customer.addresses[0]
+        address.street = "versioned street"
+        address.update()
+        self.assertEqual(Customer.find_version(customer.id), 4)
+        address.delete()
+        self.assertEqual(Customer.find_version(customer.id), 5)
+        self.assertIsNone(Customer.find_version(0))
+
+    def test_set_active(self):
+        """ Set the active flag of one customer without loading it """
+        customer = CustomerFactory(active=True)
+        customer.create()
+        row = Customer.set_active(customer.id, False)
+        self.assertEqual((row.id, row.active, row.version), (customer.id, False, 2))
+        # a customer that already has the flag keeps its version
+        self.assertEqual(Customer.set_active(customer.id, False).version, 2)
+        self.assertFalse(Customer.find(customer.id).active)
+        self.assertIsNone(Customer.set_active(0, True))
+
+    def test_update_changed_by_another_request(self):
+        """ Refuse to overwrite a customer or its addresses that changed since they were read """
+        customer = CustomerFactory()
+        customer.addresses.append(AddressFactory(id=None))
+        customer.create()
+        customer = Customer.find(customer.id)
+        with db.engine.begin() as conn:
+            conn.execute(db.update(Customer.__table__).values(version=Customer.version + 1))
+        customer.first_name = "lost update"
+        self.assertRaises(VersionConflictError, customer.update)
+        self.assertEqual(Customer.find_version(customer.id), 2)
+        customer = Customer.find(customer.id)
+        self.assertNotEqual(customer.first_name, "lost update")
+
+        address = customer.addresses[0]
+        with db.engine.begin() as conn:
+            conn.execute(db.update(Customer.__table__).values(version=Customer.version + 1))
+        address.street = "lost update"
+        self.assertRaises(VersionConflictError, address.update)
+        self.assertNotEqual(Address.find(address.id).street, "lost update")
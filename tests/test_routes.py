@@ -6,12 +6,14 @@ Test cases can be run with the following:
   coverage report -m
 """
 import os
+import json
 import logging
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
+from sqlalchemy import event
 from service import status  # HTTP Status Codes
-from service.models import db
-from service.routes import app, init_db
+from service.models import Customer, db
+from service.routes import app, init_db, customer_cache
 
 from .factories import AddressFactory, CustomerFactory
 
@@ -49,6 +51,7 @@ class TestCustomerServer(TestCase):
         """ This runs before each test """
         db.drop_all()  # clean up the last tests
         db.create_all()  # create new tables
+        customer_cache.clear()  # ids are reused once the tables are recreated
         self.app = app.test_client()
 
     def tearDown(self):
@@ -77,6 +80,32 @@ class TestCustomerServer(TestCase):
             customers.append(test_customer)
         return customers
 
+    def _count_statements(self, url, method="GET", expected_status=status.HTTP_200_OK):
+        """Issues a request and returns the number of SQL statements it executed"""
+        return len(self._record_statements(url, method, expected_status))
+
+    def _record_statements(self, url, method="GET", expected_status=status.HTTP_200_OK, json=None, headers=None):
+        """Issues a request and returns the SQL statements it executed"""
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            resp = self.app.open(url, method=method, json=json, headers=headers)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        self.assertEqual(resp.status_code, expected_status)
+        return statements
+
+    def _set_active(self, customers, active):
+        """Puts customers into a known active state"""
+        for customer in customers:
+            action = "activate" if active else "deactivate"
+            resp = self.app.put("{}/{}/{}".format(BASE_URL, customer.id, action), json={})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
     def test_index(self):
         """ Test the index page """
         resp = self.app.get('/')
@@ -176,6 +205,104 @@ class TestCustomerServer(TestCase):
         self.assertEqual(new_customer["id"],updated_customer["id"])
         self.assertEqual(new_customer["first_name"], updated_customer["first_name"])
     
+    def test_update_reconciles_addresses(self):
+        """Update, add and delete the addresses of a customer by id"""
+        document = CustomerFactory().serialize()
+        document["addresses"] = [AddressFactory().serialize() for _ in range(3)]
+        resp = self.app.post(BASE_URL, json=document)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        customer = resp.get_json()
+        kept, changed, removed = customer["addresses"]
+        changed["street"] = "1 Changed Street"
+        added = AddressFactory().serialize()
+        customer["addresses"] = [kept, changed, added]
+        url = "{}/{}".format(BASE_URL, customer["id"])
+        resp = self.app.put(url, json=customer)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        addresses = {address["id"]: address for address in resp.get_json()["addresses"]}
+        self.assertEqual(len(addresses), 3)
+        self.assertEqual(addresses[kept["id"]], kept)
+        self.assertEqual(addresses[changed["id"]]["street"], "1 Changed Street")
+        self.assertNotIn(removed["id"], addresses)
+
+        # an idempotent PUT writes no address, and the customer keeps its version
+        customer = self.app.get(url).get_json()
+        etag = self.app.get(url).headers["ETag"]
+        statements = self._record_statements(url, "PUT", json=customer)
+        writes = [statement for statement in statements
+                  if statement.split()[0].upper() in ("INSERT", "UPDATE", "DELETE")]
+        self.assertEqual(writes, [])
+        self.assertEqual(self.app.get(url).headers["ETag"], etag)
+        self.assertEqual(self.app.get(url).get_json()["addresses"], customer["addresses"])
+
+    def test_update_if_match(self):
+        """Update a customer only while it still has the version in If-Match"""
+        customer = self._create_customers(1)[0].serialize()
+        url = "{}/{}".format(BASE_URL, customer["id"])
+        etag = self.app.get(url).headers["ETag"]
+        customer["first_name"] = "First"
+        resp = self.app.put(url, json=customer, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        new_etag = resp.headers["ETag"]
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(self.app.get(url).headers["ETag"], new_etag)
+
+        # the ETag read before the first update is stale now
+        customer["first_name"] = "Second"
+        resp = self.app.put(url, json=customer, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(self.app.get(url).get_json()["first_name"], "First")
+
+        # the weak ETag of a compressed response and * match too
+        for if_match in ("W/" + new_etag, "*"):
+            resp = self.app.put(url, json=customer, headers={"If-Match": if_match})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def _changed_after_find(self, method="find"):
+        """Returns a patch that makes another request change every customer right after a Customer lookup"""
+        original_find = getattr(Customer, method)
+
+        def find_then_change(customer_id):
+            found = original_find(customer_id)
+            with db.engine.begin() as conn:
+                conn.execute(db.update(Customer.__table__).values(version=Customer.version + 1))
+            return found
+
+        return patch.object(Customer, method, side_effect=find_then_change)
+
+    def test_update_changed_by_another_request(self):
+        """Answer 412 when another request changes the customer before the update commits"""
+        customer = self._create_customers(1)[0].serialize()
+        url = "{}/{}".format(BASE_URL, customer["id"])
+        customer["first_name"] = "Lost"
+        with self._changed_after_find():
+            resp = self.app.put(url, json=customer)
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertNotEqual(self.app.get(url).get_json()["first_name"], "Lost")
+
+    def test_update_not_found(self):
+        """Update a customer that does not exist"""
+        resp = self.app.put("{}/0".format(BASE_URL), json=CustomerFactory().serialize())
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_address_changes_by_another_request(self):
+        """Answer 412 when another request changes the customer before an address is added or deleted"""
+        customer = self._create_customers(1)[0]
+        url = "{}/{}/addresses".format(BASE_URL, customer.id)
+        with self._changed_after_find("find_or_404"):
+            resp = self.app.post(url, json=AddressFactory().serialize())
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(resp.get_json()["error"], "Precondition Failed")
+        self.assertEqual(self.app.get(url).get_json(), [])
+
+        resp = self.app.post(url, json=AddressFactory().serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        address_url = "{}/{}".format(url, resp.get_json()["id"])
+        with self._changed_after_find():
+            resp = self.app.delete(address_url)
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(self.app.get(address_url).status_code, status.HTTP_200_OK)
+
     def test_bad_request(self):
         """ Send wrong parameters in json """
         customer = CustomerFactory()
@@ -238,6 +365,49 @@ class TestCustomerServer(TestCase):
         )
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_delete_customer_in_one_statement(self):
+        """Delete a customer and its addresses with one statement"""
+        test_customer = self._create_customers(1)[0]
+        for address in AddressFactory.create_batch(3):
+            resp = self.app.post("/customers/{}/addresses".format(test_customer.id), json=address.serialize())
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        url = "{0}/{1}".format(BASE_URL, test_customer.id)
+        self.assertEqual(self._count_statements(url, "DELETE", status.HTTP_204_NO_CONTENT), 1)
+        self.assertEqual(db.session.execute("SELECT COUNT(*) FROM address").scalar(), 0)
+        # deleting again is a no-op
+        self.assertEqual(self.app.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.app.delete("{}/abc".format(BASE_URL)).status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_delete_many_customers(self):
+        """Delete many customers by id"""
+        customers = self._create_customers(4)
+        address = AddressFactory()
+        resp = self.app.post("/customers/{}/addresses".format(customers[0].id), json=address.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        # cache one of them to see it dropped
+        self.app.get("{}/{}".format(BASE_URL, customers[1].id))
+        url = "{}?ids={},{}&ids={}".format(BASE_URL, customers[0].id, customers[1].id, customers[2].id)
+        self.assertEqual(self._count_statements(url, "DELETE", status.HTTP_204_NO_CONTENT), 1)
+        remaining = [customer["id"] for customer in self.app.get(BASE_URL).get_json()]
+        self.assertEqual(remaining, [customers[3].id])
+        self.assertEqual(db.session.execute("SELECT COUNT(*) FROM address").scalar(), 0)
+        resp = self.app.get("{}/{}".format(BASE_URL, customers[1].id))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        # idempotent
+        self.assertEqual(self.app.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_delete_many_customers_bad_ids(self):
+        """Reject a bulk delete without ids or with ids that are not integers"""
+        self._create_customers(1)
+        for url in (BASE_URL, "{}?ids=".format(BASE_URL), "{}?ids=1,two".format(BASE_URL)):
+            resp = self.app.delete(url)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, url)
+        app.config["MAX_BATCH_SIZE"] = 2
+        self.addCleanup(app.config.__setitem__, "MAX_BATCH_SIZE", 50000)
+        resp = self.app.delete("{}?ids=1,2,3".format(BASE_URL))
+        self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(len(self.app.get(BASE_URL).get_json()), 1)
+
     def test_get_address_list(self):
         """ Get a list of Addresses """
         # add two addresses to customer
@@ -336,6 +506,14 @@ class TestCustomerServer(TestCase):
         address_id = data["id"]
         data["street"] = "XXXX"
 
+        # an If-Match with another version of the customer is refused
+        resp = self.app.put(
+            "/customers/{}/addresses/{}".format(customer.id, address_id),
+            json=data,
+            headers={"If-Match": '"{}-0"'.format(customer.id)}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
         # send the update back
         resp = self.app.put(
             "/customers/{}/addresses/{}".format(customer.id, address_id), 
@@ -442,6 +620,340 @@ class TestCustomerServer(TestCase):
         self.assertEqual(new_customer["id"],updated_customer["id"])
         self.assertEqual(new_customer["first_name"], updated_customer["first_name"])
         self.assertEqual(updated_customer["active"], False)
-        
 
-        
\ No newline at end of file
+    def test_activate_minimal(self):
+        """Activate and deactivate a customer with one round trip when a minimal response is preferred"""
+        customer = self._create_customers(1)[0]
+        self._set_active([customer], True)
+        url = "{}/{}".format(BASE_URL, customer.id)
+        etag = self.app.get(url).headers["ETag"]
+        statements = self._record_statements(url + "/deactivate", "PUT", headers={"Prefer": "return=minimal"})
+        # one UPDATE ... RETURNING, or an UPDATE and a SELECT without RETURNING
+        expected = 1 if db.engine.dialect.full_returning else 2
+        self.assertEqual(len(statements), expected)
+        self.assertTrue(statements[0].lstrip().upper().startswith("UPDATE"))
+
+        resp = self.app.put(url + "/deactivate", headers={"Prefer": "respond-async, return=minimal"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"id": customer.id, "active": False})
+        self.assertEqual(resp.headers["Preference-Applied"], "return=minimal")
+        # deactivating it twice changed it once
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        self.assertEqual(self.app.get(url).headers["ETag"], resp.headers["ETag"])
+        self.assertFalse(self.app.get(url).get_json()["active"])
+
+        resp = self.app.put(url + "/activate")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.get_json()["active"])
+        self.assertEqual(resp.get_json()["first_name"], customer.first_name)
+        self.assertNotIn("Preference-Applied", resp.headers)
+        resp = self.app.put("{}/{}/activate".format(BASE_URL, "abc"), headers={"Prefer": "return=minimal"})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_all_paginated(self):
+        """Walk all customers one page at a time using the Link header"""
+        customers = self._create_customers(5)
+        resp = self.app.get(BASE_URL, query_string="limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        seen = [customer["id"] for customer in resp.get_json()]
+        self.assertEqual(len(seen), 2)
+        pages = 1
+        while "Link" in resp.headers:
+            link = resp.headers["Link"]
+            self.assertTrue(link.endswith('rel="next"'))
+            next_url = link[link.index("<") + 1:link.index(">")]
+            resp = self.app.get(next_url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            seen.extend(customer["id"] for customer in resp.get_json())
+            pages += 1
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, sorted(customer.id for customer in customers))
+
+    def test_get_page_with_filter(self):
+        """Paginate a filtered list of customers"""
+        customers = self._create_customers(4)
+        for customer in customers:
+            customer.first_name = "paged"
+            resp = self.app.put(
+                "{}/{}".format(BASE_URL, customer.id), json=customer.serialize(), content_type=CONTENT_TYPE_JSON
+            )
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get(BASE_URL, query_string="first_name=paged&limit=3")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 3)
+        link = resp.headers["Link"]
+        self.assertIn("first_name=paged", link)
+        next_url = link[link.index("<") + 1:link.index(">")]
+        resp = self.app.get(next_url)
+        self.assertEqual(len(resp.get_json()), 1)
+        self.assertNotIn("Link", resp.headers)
+
+    def test_get_page_bad_cursor(self):
+        """Paginate with a cursor that was not issued by the service"""
+        resp = self.app.get(BASE_URL, query_string="limit=2&cursor=not-a-cursor")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(BASE_URL, query_string="limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_statement_count_is_constant(self):
+        """List customers with addresses without one query per customer"""
+        def add_customers(count):
+            for customer in self._create_customers(count):
+                for address in AddressFactory.create_batch(2):
+                    resp = self.app.post(
+                        "{}/{}/addresses".format(BASE_URL, customer.id),
+                        json=address.serialize(),
+                        content_type=CONTENT_TYPE_JSON
+                    )
+                    self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        add_customers(2)
+        db.session.execute("UPDATE customer SET last_name = 'doshi'")
+        db.session.commit()
+        few = self._count_statements(BASE_URL)
+        few_filtered = self._count_statements(BASE_URL + "?last_name=doshi")
+        few_paged = self._count_statements(BASE_URL + "?limit=100")
+        # _create_customers reuses userids so rename the first batch
+        db.session.execute("UPDATE customer SET userid = 'old' || userid")
+        db.session.commit()
+        add_customers(4)
+        db.session.execute("UPDATE customer SET last_name = 'doshi'")
+        db.session.commit()
+        resp = self.app.get(BASE_URL)
+        self.assertEqual(len(resp.get_json()), 6)
+        self.assertEqual(len(resp.get_json()[5]["addresses"]), 2)
+        self.assertEqual(self._count_statements(BASE_URL), few)
+        self.assertEqual(self._count_statements(BASE_URL + "?last_name=doshi"), few_filtered)
+        self.assertEqual(self._count_statements(BASE_URL + "?limit=100"), few_paged)
+
+    def test_export_customers(self):
+        """Export all customers as newline-delimited JSON"""
+        customers = self._create_customers(3)
+        address = AddressFactory()
+        resp = self.app.post(
+            "{}/{}/addresses".format(BASE_URL, customers[0].id),
+            json=address.serialize(),
+            content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.app.get(BASE_URL + "/export")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = resp.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 3)
+        exported = [json.loads(line) for line in lines]
+        self.assertEqual([data["id"] for data in exported], [customer.id for customer in customers])
+        self.assertEqual(exported[0]["addresses"][0]["street"], address.street)
+        self.assertEqual(exported[1]["addresses"], [])
+
+    def test_create_customer_batch(self):
+        """Create many customers with addresses in one request"""
+        documents = []
+        for index in range(5):
+            customer = CustomerFactory()
+            customer.userid = "batch{}".format(index)
+            data = customer.serialize()
+            data["addresses"] = [address.serialize() for address in AddressFactory.create_batch(index % 3)]
+            documents.append(data)
+        resp = self.app.post(
+            BASE_URL + "/batch?chunk_size=2", json=documents, content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        results = resp.get_json()
+        self.assertEqual([result["index"] for result in results], list(range(5)))
+        self.assertTrue(all(result["status"] == status.HTTP_201_CREATED for result in results))
+        resp = self.app.get(results[4]["location"])
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["userid"], "batch4")
+        self.assertEqual(len(resp.get_json()["addresses"]), 1)
+        resp = self.app.get(BASE_URL)
+        self.assertEqual(len(resp.get_json()), 5)
+
+    def test_create_customer_batch_with_failures(self):
+        """Create a batch where some customers are invalid or conflict"""
+        existing = self._create_customers(1)[0]
+        documents = [CustomerFactory().serialize() for _ in range(5)]
+        for index, data in enumerate(documents):
+            data["userid"] = "new{}".format(index)
+        documents[1]["last_name"] = 123
+        documents[2]["userid"] = existing.userid
+        documents[4]["userid"] = documents[3]["userid"]
+        resp = self.app.post(BASE_URL + "/batch", json=documents, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_207_MULTI_STATUS)
+        codes = [result["status"] for result in resp.get_json()]
+        self.assertEqual(codes, [
+            status.HTTP_201_CREATED,
+            status.HTTP_400_BAD_REQUEST,
+            status.HTTP_409_CONFLICT,
+            status.HTTP_201_CREATED,
+            status.HTTP_409_CONFLICT,
+        ])
+        resp = self.app.get(BASE_URL)
+        self.assertEqual(len(resp.get_json()), 3)
+
+    def test_create_customer_batch_bad_data(self):
+        """Create a batch that is not an array"""
+        resp = self.app.post(BASE_URL + "/batch", json={"first_name": "a"}, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post(BASE_URL + "/batch?chunk_size=0", json=[], content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post(BASE_URL + "/batch?chunk_size=abc", json=[], content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("chunk_size", resp.get_json()["message"])
+
+    def test_bulk_deactivate_and_activate_by_ids(self):
+        """Deactivate and activate many customers by id"""
+        customers = self._create_customers(4)
+        ids = [customer.id for customer in customers[:3]]
+        self._set_active(customers, True)
+        resp = self.app.put(
+            BASE_URL + "/deactivate", json={"ids": ids, "return_ids": True}, content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["count"], 3)
+        self.assertEqual(sorted(data["ids"]), ids)
+        for customer in customers:
+            resp = self.app.get("{}/{}".format(BASE_URL, customer.id))
+            self.assertEqual(resp.get_json()["active"], customer.id not in ids)
+
+        resp = self.app.put(BASE_URL + "/activate", json={"ids": ids}, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["count"], 3)
+        self.assertIsNone(resp.get_json()["ids"])
+        # activating again changes nothing
+        resp = self.app.put(BASE_URL + "/activate", json={"ids": ids}, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.get_json()["count"], 0)
+
+    def test_bulk_deactivate_by_filter(self):
+        """Deactivate all customers with a last name"""
+        customers = self._create_customers(3)
+        self._set_active(customers, True)
+        resp = self.app.put(
+            "{}/{}".format(BASE_URL, customers[0].id),
+            json=dict(customers[0].serialize(), last_name="bulk", active=True),
+            content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.put(
+            BASE_URL + "/deactivate", json={"last_name": "bulk", "return_ids": True}, content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"count": 1, "ids": [customers[0].id]})
+
+    def test_bulk_active_bad_request(self):
+        """Bulk activate without exactly one selector"""
+        for body in ({}, {"ids": [1], "last_name": "x"}, {"ids": "1"}, {"userid": 7}, []):
+            resp = self.app.put(BASE_URL + "/activate", json=body, content_type=CONTENT_TYPE_JSON)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_customer_is_cached(self):
+        """Serve a repeated customer GET from the cache"""
+        customer = self._create_customers(1)[0]
+        url = "{}/{}".format(BASE_URL, customer.id)
+        hits = customer_cache.stats()["hits"]
+        first = self.app.get(url)
+        second = self.app.get(url)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.get_json(), second.get_json())
+        self.assertEqual(customer_cache.stats()["hits"], hits + 1)
+        resp = self.app.get("/cache/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn("evictions", resp.get_json())
+
+    def test_writes_invalidate_cached_customer(self):
+        """Never serve a cached customer after it was changed"""
+        customer = self._create_customers(1)[0]
+        url = "{}/{}".format(BASE_URL, customer.id)
+        self.app.get(url)
+        data = dict(customer.serialize(), first_name="cached", active=True)
+        self.app.put(url, json=data, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(self.app.get(url).get_json()["first_name"], "cached")
+
+        self.app.put(url + "/deactivate", json={})
+        self.assertFalse(self.app.get(url).get_json()["active"])
+        self.app.put(BASE_URL + "/activate", json={"ids": [customer.id]}, content_type=CONTENT_TYPE_JSON)
+        self.assertTrue(self.app.get(url).get_json()["active"])
+        self.app.put(BASE_URL + "/deactivate", json={"first_name": "cached"}, content_type=CONTENT_TYPE_JSON)
+        self.assertFalse(self.app.get(url).get_json()["active"])
+
+        resp = self.app.post(url + "/addresses", json=AddressFactory().serialize(), content_type=CONTENT_TYPE_JSON)
+        address = resp.get_json()
+        self.assertEqual(len(self.app.get(url).get_json()["addresses"]), 1)
+        address["street"] = "cached street"
+        self.app.put("{}/addresses/{}".format(url, address["id"]), json=address, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(self.app.get(url).get_json()["addresses"][0]["street"], "cached street")
+        self.app.delete("{}/addresses/{}".format(url, address["id"]))
+        self.assertEqual(self.app.get(url).get_json()["addresses"], [])
+
+        self.app.delete(url)
+        self.assertEqual(self.app.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_customer_not_modified(self):
+        """Answer a conditional GET with 304 until the customer changes"""
+        customer = self._create_customers(1)[0]
+        url = "{}/{}".format(BASE_URL, customer.id)
+        for target in (url, url + "/addresses"):
+            resp = self.app.get(target)
+            etag = resp.headers["ETag"]
+            resp = self.app.get(target, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(resp.headers["ETag"], etag)
+            self.assertEqual(resp.data, b"")
+            resp = self.app.get(target, headers={"If-None-Match": '"something-else"'})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_etag_changes_with_customer_and_addresses(self):
+        """Give the customer a new ETag on every change"""
+        customer = self._create_customers(1)[0]
+        url = "{}/{}".format(BASE_URL, customer.id)
+        etags = [self.app.get(url).headers["ETag"]]
+
+        def changed(resp):
+            self.assertLess(resp.status_code, 300)
+            new_etag = self.app.get(url).headers["ETag"]
+            self.assertNotIn(new_etag, etags)
+            etags.append(new_etag)
+            # the addresses list shares the customer version
+            self.assertEqual(self.app.get(url + "/addresses").headers["ETag"], new_etag)
+
+        changed(self.app.put(url, json=dict(customer.serialize(), first_name="etag", active=False), content_type=CONTENT_TYPE_JSON))
+        resp = self.app.post(url + "/addresses", json=AddressFactory().serialize(), content_type=CONTENT_TYPE_JSON)
+        changed(resp)
+        address = resp.get_json()
+        address["city"] = "Hoboken"
+        changed(self.app.put("{}/addresses/{}".format(url, address["id"]), json=address, content_type=CONTENT_TYPE_JSON))
+        changed(self.app.delete("{}/addresses/{}".format(url, address["id"])))
+        changed(self.app.put(url + "/activate", json={}))
+        changed(self.app.put(BASE_URL + "/deactivate", json={"ids": [customer.id]}, content_type=CONTENT_TYPE_JSON))
+
+    def test_pool_stats(self):
+        """Report the connection pool statistics"""
+        resp = self.app.get("/pool/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertIn("checkouts", data)
+        self.assertIn("pool_class", data)
+
+    def test_log_stats(self):
+        """Report the log queue statistics"""
+        resp = self.app.get("/log/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # gunicorn installs no handlers under the tests, so nothing is queued
+        self.assertEqual(resp.get_json(), {})
+
+    def test_metrics(self):
+        """Report request counts, latency and database time"""
+        self._create_customers(1)
+        self.app.get(BASE_URL)
+        self.app.get("/not/a/route")
+        resp = self.app.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        text = resp.get_data(as_text=True)
+        self.assertIn('customers_http_requests_total{method="GET",route="/customers",status="200"}', text)
+        self.assertIn('customers_http_requests_total{method="POST",route="/customers",status="201"}', text)
+        self.assertIn('route="<unmatched>",status="404"', text)
+        self.assertIn('customers_http_request_duration_seconds_count{method="GET",route="/customers"}', text)
+        self.assertIn('customers_http_request_db_duration_seconds_count{method="GET",route="/customers"}', text)
+        self.assertIn('customers_http_requests_in_progress{method="GET",route="/metrics"} 1.0', text)